@@ -0,0 +1,85 @@
+# the common parts of the benchmarks.
+#
+# a benchmark measures the working tree, and with ``--before REV`` it also
+# measures ``lib_pg_make_schemas`` of another git revision. that revision is
+# exported to a temporary directory and measured by a child process, so both
+# versions are measured on the same generated source code
+
+import contextlib
+import json
+import os, os.path
+import subprocess
+import sys
+import tempfile
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# the ``os`` functions which are one system call each. ``os.path`` calls
+# them through the ``os`` module, so ``realpath``, ``isdir`` and ``isfile``
+# are counted too
+
+SYSCALL_NAME_LIST = ('stat', 'lstat', 'open', 'scandir', 'listdir', 'readlink')
+
+@contextlib.contextmanager
+def count_syscalls():
+    cnt_map = dict.fromkeys(SYSCALL_NAME_LIST, 0)
+    orig_func_map = {}
+
+    def make_counted_func(name, orig_func):
+        def counted_func(*args, **kwargs):
+            cnt_map[name] += 1
+
+            return orig_func(*args, **kwargs)
+
+        return counted_func
+
+    for name in SYSCALL_NAME_LIST:
+        orig_func_map[name] = getattr(os, name)
+
+        setattr(os, name, make_counted_func(name, orig_func_map[name]))
+
+    try:
+        yield cnt_map
+    finally:
+        for name, orig_func in orig_func_map.items():
+            setattr(os, name, orig_func)
+
+def write_file(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    with open(file_path, 'w', encoding='utf-8') as fd:
+        fd.write(content)
+
+@contextlib.contextmanager
+def exported_lib(rev):
+    with tempfile.TemporaryDirectory() as lib_dir:
+        archive = subprocess.run(
+            ['git', 'archive', rev, 'lib_pg_make_schemas'],
+            cwd=REPO_PATH, stdout=subprocess.PIPE, check=True,
+        ).stdout
+
+        subprocess.run(['tar', '-x', '-C', lib_dir], input=archive, check=True)
+
+        yield lib_dir
+
+def measure_in_lib(lib_dir, module_name, arg_list):
+    # the child process prints its result as json. the exported library
+    # goes before the working tree, the benchmarks are taken from the working tree
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([lib_dir, REPO_PATH])
+
+    output = subprocess.run(
+        [sys.executable, '-m', module_name, '--measure'] + arg_list,
+        env=env, cwd=lib_dir, stdout=subprocess.PIPE, check=True,
+    ).stdout
+
+    return json.loads(output)
+
+def print_result(name, result):
+    print('{}: {}'.format(
+        name,
+        ', '.join('{} {}'.format(key, value) for key, value in result.items()),
+    ))
+
+# vi:ts=4:sw=4:et
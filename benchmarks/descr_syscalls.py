@@ -0,0 +1,100 @@
+# a benchmark of the system calls of loading a generated source code.
+#
+#   python3 -m benchmarks.descr_syscalls --schemas-cnt 2500 --before 77ba529
+#
+# the source code has one schemas directory with ``--schemas-cnt`` schemas,
+# every schema has ``--file-cnt`` sql files
+
+import argparse
+import json
+import os, os.path
+import tempfile
+import time
+from lib_pg_make_schemas import descr
+from . import bench_utils
+
+def make_source_code(path, schemas_cnt, file_cnt):
+    bench_utils.write_file(
+        os.path.join(path, 'cluster.yaml'),
+        'cluster:\n  application: bench\n  revision: rev-1\n',
+    )
+    bench_utils.write_file(
+        os.path.join(path, 'schemas', 'schemas.yaml'),
+        'schemas:\n  type: main\n',
+    )
+
+    for i in range(schemas_cnt):
+        schema_dir = os.path.join(path, 'schemas', 'schema_{}'.format(i))
+
+        bench_utils.write_file(
+            os.path.join(schema_dir, 'schema.yaml'),
+            'schema:\n  name: schema_{}\n  type: {}\n  owner: bench\n'.format(
+                i,
+                'var' if i % 2 else 'func',
+            ),
+        )
+
+        for j in range(file_cnt):
+            bench_utils.write_file(
+                os.path.join(schema_dir, 'file_{}.sql'.format(j)),
+                'select {};\n'.format(j),
+            )
+
+def load_cluster_descr(path):
+    cluster_file_path = os.path.join(path, 'cluster.yaml')
+    cluster_descr = descr.ClusterDescr()
+
+    cluster_descr.load(cluster_file_path, [path], {})
+
+    return cluster_descr
+
+def measure(path):
+    start_time = time.perf_counter()
+
+    with bench_utils.count_syscalls() as cnt_map:
+        load_cluster_descr(path)
+
+    result = dict(cnt_map)
+    result['time'] = round(time.perf_counter() - start_time, 3)
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='a benchmark of the system calls of loading a generated source code',
+    )
+
+    parser.add_argument('--schemas-cnt', type=int, default=2500,
+            help='count of generated schemas. default is 2500')
+    parser.add_argument('--file-cnt', type=int, default=4,
+            help='count of sql files of every schema. default is 4')
+    parser.add_argument('--before', metavar='REV',
+            help='git revision to measure before the working tree')
+    parser.add_argument('--measure', metavar='SOURCE-CODE',
+            help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        print(json.dumps(measure(args.measure)))
+
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.realpath(tmp_dir)
+
+        make_source_code(path, args.schemas_cnt, args.file_cnt)
+
+        if args.before is not None:
+            with bench_utils.exported_lib(args.before) as lib_dir:
+                bench_utils.print_result(
+                    args.before,
+                    bench_utils.measure_in_lib(lib_dir, __spec__.name, [path]),
+                )
+
+        bench_utils.print_result('working tree', measure(path))
+
+if __name__ == '__main__':
+    main()
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,117 @@
+# a benchmark of parsing descriptor documents by the available backends.
+#
+#   python3 -m benchmarks.doc_parse --doc-cnt 5000
+#
+# the documents are small ``schema.yaml`` files. they are parsed in memory
+# by the pure python yaml loader, by the libyaml loader (when PyYAML is built
+# with it) and by ``json`` from their compiled form. ``LoadUtils.load_doc``
+# is measured on the files too, without and with the compiled documents
+
+import argparse
+import json
+import os, os.path
+import tempfile
+import time
+import yaml
+from lib_pg_make_schemas import descr
+from . import bench_utils
+
+def make_doc_content(i):
+    return (
+        'schema:\n'
+        '  name: schema_{i}\n'
+        '  type: {schema_type}\n'
+        '  owner: owner_{owner}\n'
+        '  grant:\n'
+        '    - grant usage on schema schema_{i} to reader_{owner}\n'
+        '    - grant select on all tables in schema schema_{i} to reader_{owner}\n'
+        '  include:\n'
+        '    - ../common/tables\n'
+        '    - $shared/functions\n'
+        '  first:\n'
+        '    - 00-types.sql\n'
+        '  last: 99-grants.sql\n'
+        '  sql: |\n'
+        '    comment on schema schema_{i} is \'generated schema {i}\';\n'
+    ).format(i=i, schema_type='var' if i % 2 else 'func', owner=i % 7)
+
+def make_doc_file_list(path, doc_cnt):
+    file_path_list = []
+
+    for i in range(doc_cnt):
+        file_path = os.path.join(path, 'schema_{}'.format(i), 'schema.yaml')
+
+        bench_utils.write_file(file_path, make_doc_content(i))
+        file_path_list.append(file_path)
+
+    return file_path_list
+
+def load_doc_list(load_utils, file_path_list, include_list):
+    try:
+        return [load_utils.load_doc(file_path, include_list) for file_path in file_path_list]
+    finally:
+        load_utils.close()
+
+def measure(func, *args):
+    start_time = time.perf_counter()
+    doc_list = func(*args)
+
+    return doc_list, round(time.perf_counter() - start_time, 3)
+
+def measure_all(path, doc_cnt):
+    content_list = [make_doc_content(i) for i in range(doc_cnt)]
+    compiled_content_list = [
+        json.dumps({'doc': yaml.load(content, Loader=yaml.SafeLoader)})
+        for content in content_list
+    ]
+    file_path_list = make_doc_file_list(os.path.join(path, 'source'), doc_cnt)
+    compiled_doc_path = os.path.join(path, 'compiled')
+    result_map = {}
+
+    result_map['yaml'] = measure(
+        lambda: [yaml.load(content, Loader=yaml.SafeLoader) for content in content_list],
+    )
+
+    if hasattr(yaml, 'CSafeLoader'):
+        result_map['libyaml'] = measure(
+            lambda: [yaml.load(content, Loader=yaml.CSafeLoader) for content in content_list],
+        )
+
+    result_map['compiled json'] = measure(
+        lambda: [json.loads(compiled_content)['doc'] for compiled_content in compiled_content_list],
+    )
+    result_map['load_doc'] = measure(
+        load_doc_list, descr.LoadUtils(), file_path_list, [path],
+    )
+
+    # the first loading writes the compiled documents, the second one reads them
+
+    result_map['load_doc compiling'] = measure(
+        load_doc_list, descr.LoadUtils(compiled_doc_path=compiled_doc_path), file_path_list, [path],
+    )
+    result_map['load_doc compiled'] = measure(
+        load_doc_list, descr.LoadUtils(compiled_doc_path=compiled_doc_path), file_path_list, [path],
+    )
+
+    return result_map
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='a benchmark of parsing descriptor documents by the available backends',
+    )
+
+    parser.add_argument('--doc-cnt', type=int, default=5000,
+            help='count of generated documents. default is 5000')
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result_map = measure_all(os.path.realpath(tmp_dir), args.doc_cnt)
+
+    for name, (_, elapsed) in result_map.items():
+        print('{}: {} documents: {:.3f}s'.format(name, args.doc_cnt, elapsed))
+
+if __name__ == '__main__':
+    main()
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,98 @@
+# a benchmark of loading a hosts file and rendering ``scr_env`` for every
+# its host, as the commands do, on growing generated hosts files.
+#
+#   python3 -m benchmarks.hosts_scale --host-cnt 1000,3000,10000 --before 77ba529
+#
+# every host has its params, and the hosts file has a ``shared`` object
+# of ``--shared-cnt`` items
+
+import argparse
+import json
+import os, os.path
+import tempfile
+import time
+from lib_pg_make_schemas import descr
+from lib_pg_make_schemas import scr_env
+from . import bench_utils
+
+def make_hosts_file(file_path, host_cnt, shared_cnt):
+    line_list = ['hosts:', '  - shared:']
+
+    for i in range(shared_cnt):
+        line_list.append('      key_{}: {{value: {}, text: "shared text {}"}}'.format(i, i, i))
+
+    for i in range(host_cnt):
+        line_list.append('  - name: host_{}'.format(i))
+        line_list.append('    type: type_{}'.format(i % 10))
+        line_list.append('    conninfo: host=db{}.example.com dbname=app'.format(i))
+        line_list.append('    params: {{shard: {}, region: region_{}}}'.format(i, i % 5))
+
+    bench_utils.write_file(file_path, '\n'.join(line_list) + '\n')
+
+def render_scr_env(hosts_file_path):
+    hosts_descr = descr.HostsDescr()
+
+    hosts_descr.load(hosts_file_path)
+
+    load_time = time.perf_counter()
+    size = 0
+
+    for host in hosts_descr.host_list:
+        size += len(scr_env.scr_env(hosts_descr, host['name']))
+
+    return load_time, size
+
+def measure(hosts_file_path):
+    start_time = time.perf_counter()
+    load_time, size = render_scr_env(hosts_file_path)
+    finish_time = time.perf_counter()
+
+    return {
+        'load': round(load_time - start_time, 3),
+        'scr_env': round(finish_time - load_time, 3),
+        'size': size,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='a benchmark of a hosts file scaled to many hosts',
+    )
+
+    parser.add_argument('--host-cnt', default='1000,3000,10000',
+            help='comma separated counts of generated hosts. default is 1000,3000,10000')
+    parser.add_argument('--shared-cnt', type=int, default=200,
+            help='count of items of the shared object. default is 200')
+    parser.add_argument('--before', metavar='REV',
+            help='git revision to measure before the working tree')
+    parser.add_argument('--measure', metavar='HOSTS-FILE',
+            help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        print(json.dumps(measure(args.measure)))
+
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for host_cnt in map(int, args.host_cnt.split(',')):
+            hosts_file_path = os.path.join(tmp_dir, 'hosts_{}.yaml'.format(host_cnt))
+
+            make_hosts_file(hosts_file_path, host_cnt, args.shared_cnt)
+
+            if args.before is not None:
+                with bench_utils.exported_lib(args.before) as lib_dir:
+                    bench_utils.print_result(
+                        '{} hosts, {}'.format(host_cnt, args.before),
+                        bench_utils.measure_in_lib(lib_dir, __spec__.name, [hosts_file_path]),
+                    )
+
+            bench_utils.print_result(
+                '{} hosts, working tree'.format(host_cnt),
+                measure(hosts_file_path),
+            )
+
+if __name__ == '__main__':
+    main()
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,178 @@
+# a benchmark of ``upgrade.find_migr_way`` on a synthetic migration graph.
+#
+#   python3 -m benchmarks.migr_way --rev-cnt 5000
+#
+# the graph is a chain of revisions where every revision migrates from the
+# previous one and every tenth revision also migrates from the tenth before
+# it, so there is the only one shortest migration way from any revision.
+# the old search (before the migration index) is run on a smaller graph,
+# since it follows every way, not only the shortest ones
+
+import argparse
+import time
+import types
+from lib_pg_make_schemas import upgrade
+
+def rev_name(i):
+    return 'rev-{}'.format(i)
+
+def make_cluster_descr(comp_edge_list, target_rev):
+    # ``comp_edge_list`` is a list of ``(revision, compatible revision)``
+
+    compatible_map = {}
+    migration_list = []
+
+    for rev, comp_rev in comp_edge_list:
+        compatible_map.setdefault(rev, []).append(comp_rev)
+
+    for rev, comp_list in compatible_map.items():
+        migration_list.append(types.SimpleNamespace(revision=rev, compatible_list=comp_list))
+
+    return types.SimpleNamespace(
+        revision=target_rev,
+        migrations=types.SimpleNamespace(
+            migration_list=migration_list,
+            compatible_map=compatible_map,
+        ),
+    )
+
+def make_chain_cluster_descr(rev_cnt, skip=None):
+    if skip is None:
+        skip = 10
+
+    comp_edge_list = []
+
+    for i in range(1, rev_cnt):
+        comp_edge_list.append((rev_name(i), rev_name(i - 1)))
+
+        if i % skip == 0:
+            comp_edge_list.append((rev_name(i), rev_name(i - skip)))
+
+    return make_cluster_descr(comp_edge_list, rev_name(rev_cnt - 1))
+
+def make_random_cluster_descr(rev_cnt, edge_cnt, rnd):
+    # an acyclic graph: a revision migrates only from the older ones
+
+    comp_edge_set = set()
+
+    for i in range(1, rev_cnt):
+        comp_edge_set.add((rev_name(i), rev_name(rnd.randrange(i))))
+
+    while len(comp_edge_set) < edge_cnt:
+        i = rnd.randrange(1, rev_cnt)
+        comp_edge_set.add((rev_name(i), rev_name(rnd.randrange(i))))
+
+    return make_cluster_descr(sorted(comp_edge_set), rev_name(rev_cnt - 1))
+
+def old_find_migr_way(cluster_descr, host_type, var_rev):
+    # the search before the migration index, kept as it was for comparison
+
+    target_rev = cluster_descr.revision
+
+    if var_rev == target_rev:
+        return []
+
+    migrations_descr = cluster_descr.migrations
+
+    if migrations_descr is None:
+        return
+
+    comp_list_map = {}
+    migr_list_candidates = []
+
+    for migration_descr in migrations_descr.migration_list:
+        comp_list = comp_list_map.setdefault(migration_descr.revision, [])
+        comp_list.extend(migration_descr.compatible_list)
+
+        if migration_descr.revision != target_rev:
+            continue
+
+        for comp_rev in migration_descr.compatible_list:
+            migr_list_candidates.append([(target_rev, comp_rev)])
+
+    result_migr_list = None
+
+    while migr_list_candidates:
+        for migr_list in migr_list_candidates:
+            top_from_rev = migr_list[0][1]
+
+            if top_from_rev != var_rev:
+                continue
+
+            if result_migr_list is not None:
+                raise upgrade.AmbiguousUpgradeError(
+                    '{!r}, {!r}: ambiguous migration way'.format(
+                        result_migr_list,
+                        migr_list,
+                    ),
+                )
+
+            result_migr_list = migr_list
+
+        if result_migr_list is not None:
+            return result_migr_list
+
+        next = []
+
+        for migr_list in migr_list_candidates:
+            top_from_rev = migr_list[0][1]
+
+            comp_list = comp_list_map.get(top_from_rev)
+
+            if comp_list is None:
+                continue
+
+            for comp_rev in comp_list:
+                if (top_from_rev, comp_rev) in comp_list:
+                    continue
+
+                next.append([(top_from_rev, comp_rev)] + migr_list)
+
+        migr_list_candidates = next
+
+def try_find_migr_way(find_func, cluster_descr, var_rev):
+    try:
+        return find_func(cluster_descr, None, var_rev)
+    except upgrade.AmbiguousUpgradeError:
+        return 'ambiguous'
+
+def bench_find_migr_way(find_func, cluster_descr, var_rev_list):
+    start_time = time.perf_counter()
+
+    for var_rev in var_rev_list:
+        find_func(cluster_descr, None, var_rev)
+
+    return time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='a benchmark of finding migration ways on a synthetic graph',
+    )
+
+    parser.add_argument('--rev-cnt', type=int, default=5000,
+            help='count of revisions of the graph. default is 5000')
+    parser.add_argument('--old-rev-cnt', type=int, default=400,
+            help='count of revisions of the graph for the old search. default is 400')
+    parser.add_argument('--find-cnt', type=int, default=20,
+            help='count of searched ways. default is 20')
+
+    args = parser.parse_args()
+
+    for find_name, find_func, rev_cnt in (
+                ('old', old_find_migr_way, args.old_rev_cnt),
+                ('new', upgrade.find_migr_way, args.old_rev_cnt),
+                ('new', upgrade.find_migr_way, args.rev_cnt),
+            ):
+        cluster_descr = make_chain_cluster_descr(rev_cnt)
+        var_rev_list = [
+            rev_name(i * (rev_cnt - 1) // args.find_cnt)
+            for i in range(args.find_cnt)
+        ]
+        elapsed = bench_find_migr_way(find_func, cluster_descr, var_rev_list)
+
+        print('{}: {} revisions, {} ways: {:.3f}s'.format(find_name, rev_cnt, args.find_cnt, elapsed))
+
+if __name__ == '__main__':
+    main()
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,114 @@
+# a microbenchmark of ``LoadUtils.check_and_open_for_r`` over many files.
+#
+#   python3 -m benchmarks.open_files --file-cnt 10000 --before 77ba529
+#
+# the files are spread over ``--dir-cnt`` directories of the last of
+# ``--include-cnt`` include directories. every file is opened, read and closed,
+# directory by directory as the descriptors read them
+
+import argparse
+import json
+import os, os.path
+import tempfile
+import time
+from lib_pg_make_schemas import descr
+from . import bench_utils
+
+def make_file_tree(path, file_cnt, dir_cnt, include_cnt):
+    include_list = [
+        os.path.join(path, 'include_{}'.format(i))
+        for i in range(include_cnt)
+    ]
+    file_path_list = []
+
+    for include in include_list:
+        os.makedirs(include)
+
+    for i in range(file_cnt):
+        file_path = os.path.join(
+            include_list[-1],
+            'dir_{}'.format(i * dir_cnt // file_cnt),
+            'file_{}.sql'.format(i),
+        )
+
+        bench_utils.write_file(file_path, 'select {};\n'.format(i))
+        file_path_list.append(file_path)
+
+    return include_list, file_path_list
+
+def open_files(include_list, file_path_list):
+    load_utils = descr.LoadUtils()
+    size = 0
+
+    try:
+        for file_path in file_path_list:
+            with load_utils.check_and_open_for_r(file_path, include_list) as fd:
+                size += len(fd.read())
+    finally:
+        # the old ``LoadUtils`` keeps nothing to close
+
+        getattr(load_utils, 'close', lambda: None)()
+
+    return size
+
+def measure(include_list, file_path_list):
+    start_time = time.perf_counter()
+
+    with bench_utils.count_syscalls() as cnt_map:
+        open_files(include_list, file_path_list)
+
+    result = dict(cnt_map)
+    result['time'] = round(time.perf_counter() - start_time, 3)
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='a microbenchmark of the secure opening of many files',
+    )
+
+    parser.add_argument('--file-cnt', type=int, default=10000,
+            help='count of generated files. default is 10000')
+    parser.add_argument('--dir-cnt', type=int, default=100,
+            help='count of directories of the files. default is 100')
+    parser.add_argument('--include-cnt', type=int, default=8,
+            help='count of include directories. default is 8')
+    parser.add_argument('--before', metavar='REV',
+            help='git revision to measure before the working tree')
+    parser.add_argument('--measure', metavar='TREE-JSON',
+            help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        with open(args.measure, encoding='utf-8') as fd:
+            include_list, file_path_list = json.load(fd)
+
+        print(json.dumps(measure(include_list, file_path_list)))
+
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.realpath(tmp_dir)
+        include_list, file_path_list = make_file_tree(
+            os.path.join(path, 'tree'), args.file_cnt, args.dir_cnt, args.include_cnt,
+        )
+
+        if args.before is not None:
+            tree_file_path = os.path.join(path, 'tree.json')
+
+            with open(tree_file_path, 'w', encoding='utf-8') as fd:
+                json.dump([include_list, file_path_list], fd)
+
+            with bench_utils.exported_lib(args.before) as lib_dir:
+                bench_utils.print_result(
+                    args.before,
+                    bench_utils.measure_in_lib(lib_dir, __spec__.name, [tree_file_path]),
+                )
+
+        bench_utils.print_result('working tree', measure(include_list, file_path_list))
+
+if __name__ == '__main__':
+    main()
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,55 @@
+from . import pg_literal
+
+class CopyData:
+    # a data file which goes to its table by ``copy ... from stdin``.
+    # the file is not kept in memory. every use opens it again (with
+    # the same checks). the iteration gives an inline ``copy`` block
+    # for the output files
+
+    read_size = 1024 * 1024
+
+    def __init__(self, load_utils, file_path, include_list, copy_spec):
+        self._load_utils = load_utils
+        self.file_path = file_path
+        self.include_list = include_list
+        self.copy_spec = copy_spec
+
+    def copy_sql(self, pg_ident_quote_func=pg_literal.pg_ident_quote):
+        schema_name, table, column_list, copy_format, header = self.copy_spec
+
+        if schema_name is not None:
+            table_ident = '{}.{}'.format(pg_ident_quote_func(schema_name), pg_ident_quote_func(table))
+        else:
+            table_ident = pg_ident_quote_func(table)
+
+        return 'copy {} ({}) from stdin with (format {}{});'.format(
+            table_ident,
+            ', '.join(pg_ident_quote_func(column) for column in column_list),
+            copy_format,
+            ', header' if header else '',
+        )
+
+    def open(self):
+        return self._load_utils.check_and_open_for_r(self.file_path, self.include_list, binary=True)
+
+    def __iter__(self):
+        yield '{}\n'.format(self.copy_sql()).encode('utf-8')
+
+        last_data = b'\n'
+
+        with self.open() as fd:
+            while True:
+                data = fd.read(self.read_size)
+
+                if not data:
+                    break
+
+                last_data = data
+                yield data
+
+        if last_data.endswith(b'\n'):
+            yield b'\\.'
+        else:
+            yield b'\n\\.'
+
+# vi:ts=4:sw=4:et
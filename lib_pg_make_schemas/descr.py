@@ -1,53 +1,481 @@
 import os, os.path
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import json
 import yaml
 import re
+import threading
+from . import sql_stream
+from . import copy_data
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def _yaml_safe_load_content(content, name):
+    # it is run by the parsing processes. the stream keeps the name
+    # of the original stream for the error messages
+
+    if name is not None:
+        stream = io.StringIO(content)
+        stream.name = name
+    else:
+        stream = content
+
+    return yaml.load(stream, Loader=LoadUtils._yaml_safe_loader)
+
+class _DecompressedFile:
+    # a decompressing reader which closes its compressed file too
+
+    def __init__(self, reader, fd):
+        self._reader = reader
+        self._fd = fd
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class _ZstdReader:
+    # a decompressing reader of all frames of a zstd file. a file which
+    # ends in the middle of a frame is an error, not a shorter sql
+
+    read_size = 64 * 1024
+
+    def __init__(self, fd, file_path):
+        self._fd = fd
+        self._file_path = file_path
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._frame_obj = None
+        self._buf = bytearray()
+        self._eof = False
+
+    def _fill(self):
+        data = self._fd.read(self.read_size)
+
+        if not data:
+            if self._frame_obj is not None:
+                raise ValueError('{!r}: unexpected end of zstd frame'.format(self._file_path))
+
+            self._eof = True
+
+            return
+
+        while data:
+            if self._frame_obj is None:
+                self._frame_obj = self._decompressor.decompressobj()
+
+            self._buf += self._frame_obj.decompress(data)
+
+            if self._frame_obj.eof:
+                data = self._frame_obj.unused_data
+                self._frame_obj = None
+            else:
+                data = b''
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buf) < size):
+            self._fill()
+
+        if size is None or size < 0 or size >= len(self._buf):
+            data = bytes(self._buf)
+            self._buf.clear()
+        else:
+            data = bytes(self._buf[:size])
+            del self._buf[:size]
+
+        return data
+
+    def close(self):
+        self._buf.clear()
 
 class LoadUtils:
-    @classmethod
-    def check_and_open_for_r(cls, file_path, include_list):
+    _dir_fd_supported = os.open in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY')
+    _dir_fd_cache_size = 64
+    _proc_fd_supported = os.path.isdir('/proc/self/fd')
+    _yaml_safe_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    _sql_suffix_tuple = ('.sql', '.sql.gz', '.sql.zst')
+
+    def __init__(self, compiled_doc_path=None, jobs=None, read_ahead=None, read_ahead_size=None,
+            stream_size=None):
+        if jobs is None:
+            jobs = 1
+
+        if read_ahead is None:
+            read_ahead = 0
+
+        if read_ahead_size is None:
+            read_ahead_size = 16 * 1024 * 1024
+
+        if stream_size is None:
+            stream_size = 64 * 1024 * 1024
+
+        self._compiled_doc_path = compiled_doc_path
+        self._jobs = jobs
+        self._read_ahead = read_ahead
+        self._read_ahead_size = read_ahead_size
+        self._stream_size = stream_size
+
+        # an index of the scanned directories of source code. every directory
+        # is scanned only once and every its entry keeps its resolved path and
+        # its type, so the descriptors never need ``realpath`` and ``isfile``
+        # for the entries
+
+        self._dir_index_map = {}
+        self._path_is_dir_map = {}
+        self._dir_fd_map = collections.OrderedDict()
+
+        # the sibling descriptors are loaded ahead by the threads (one pool
+        # per nesting level, so a waiting parent never takes a thread of its
+        # children) and their documents are parsed by the processes
+
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._executor_map = {}
+        self._prefetch_map = {}
+        self._parse_executor = None
+        self._read_executor = None
+        self._read_ahead_reserved_size = 0
+
+    def _find_include(self, file_path, include_list):
         for include in include_list:
-            if os.path.commonpath((file_path, include)) == include:
-                break
+            if file_path == include or file_path.startswith(
+                        include if include.endswith('/') else include + '/'):
+                return include
+
+        raise ValueError(
+            '{!r}: this file is not in any directory which is included to allowed list'.format(
+                file_path,
+            ),
+        )
+
+    def _open_dir_fd(self, dir_path, include):
+        dir_fd = self._dir_fd_map.get(dir_path)
+
+        if dir_fd is not None:
+            self._dir_fd_map.move_to_end(dir_path)
+
+            return dir_fd
+
+        if dir_path == include:
+            dir_fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
         else:
-            raise ValueError(
-                '{!r}: this file is not in any directory which is included to allowed list'.format(
-                    file_path,
-                ),
+            parent_dir_path, dir_name = os.path.split(dir_path)
+            parent_dir_fd = self._open_dir_fd(parent_dir_path, include)
+            dir_fd = os.open(
+                dir_name,
+                os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW,
+                dir_fd=parent_dir_fd,
             )
 
+        self._dir_fd_map[dir_path] = dir_fd
+
+        while len(self._dir_fd_map) > self._dir_fd_cache_size:
+            _, old_dir_fd = self._dir_fd_map.popitem(last=False)
+
+            os.close(old_dir_fd)
+
+        return dir_fd
+
+    def _close_dir_fd_map(self):
+        while self._dir_fd_map:
+            _, dir_fd = self._dir_fd_map.popitem()
+
+            os.close(dir_fd)
+
+    def _open_in_dir_fd(self, file_path, include):
+        dir_path, file_name = os.path.split(file_path)
+
+        return os.open(
+            file_name,
+            os.O_RDONLY | os.O_NOFOLLOW,
+            dir_fd=self._open_dir_fd(dir_path, include),
+        )
+
+    def _check_opened_file(self, file_path, fileno, raise_error=None):
+        if raise_error is None:
+            raise_error = True
+
+        opened_file_path = os.readlink('/proc/self/fd/{}'.format(fileno))
+
+        if file_path == opened_file_path:
+            return True
+
+        if not raise_error:
+            return False
+
+        raise OSError(
+            '{!r}, {!r}: the opened file has unexpectedly changed to another'.format(
+                file_path,
+                opened_file_path,
+            ),
+        )
+
+    def check_and_open_for_r(self, file_path, include_list, binary=None):
+        if binary is None:
+            binary = False
+
+        include = self._find_include(file_path, include_list)
+
         fileno = None
         fd = None
 
         try:
-            fileno = os.open(file_path, os.O_NOFOLLOW)
+            if self._dir_fd_supported:
+                # every path component below the include directory is opened
+                # with ``O_NOFOLLOW`` relatively to the already opened parent
+                # directory, so the opened file is in the include directory
+                # even if the tree is changed concurrently.
+                # the directory descriptors are kept for the next files. a kept
+                # directory may be renamed or moved out of the include directory
+                # later, so the path of every opened file is checked again, and
+                # the directories are opened again when it has changed. without
+                # ``/proc`` the directory descriptors are not kept
+
+                with self._lock:
+                    fileno = self._open_in_dir_fd(file_path, include)
+
+                    if not self._proc_fd_supported:
+                        self._close_dir_fd_map()
+                    elif not self._check_opened_file(file_path, fileno, raise_error=False):
+                        os.close(fileno)
+                        fileno = None
+
+                        self._close_dir_fd_map()
+
+                        fileno = self._open_in_dir_fd(file_path, include)
+
+                        self._check_opened_file(file_path, fileno)
+            else:
+                fileno = os.open(file_path, os.O_NOFOLLOW)
 
-            if os.path.isdir('/proc'):
-                opened_file_path = os.readlink('/proc/self/fd/{}'.format(fileno))
+                if self._proc_fd_supported:
+                    self._check_opened_file(file_path, fileno)
 
-                if file_path != opened_file_path:
-                    raise OSError(
-                        '{!r}, {!r}: the opened file has unexpectedly changed to another'.format(
-                            file_path,
-                            opened_file_path,
-                        ),
-                    )
-
-            # XXX   portability issue:
-            #       we have no a full safe implementation here if there is no ``/proc``
+                # XXX   portability issue:
+                #       we have no a full safe implementation here if there is no ``/proc``
 
-            fd = os.fdopen(fileno, encoding='utf-8')
+            if binary:
+                fd = os.fdopen(fileno, 'rb')
+            else:
+                fd = os.fdopen(fileno, encoding='utf-8')
         finally:
             if fileno is not None and fd is None:
                 os.close(fileno)
 
         return fd
 
-    @classmethod
-    def yaml_safe_load(cls, fd):
-        return yaml.safe_load(fd)
+    def is_sql_file(self, file_path):
+        return file_path.endswith(self._sql_suffix_tuple)
+
+    def is_compressed_sql_file(self, file_path):
+        return file_path.endswith(self._sql_suffix_tuple[1:])
+
+    def open_sql_for_r(self, file_path, include_list):
+        # a compressed sql file is decompressed while it is read, so it
+        # is never kept in memory (or on disk) as a whole
+
+        if file_path.endswith('.sql.zst') and zstandard is None:
+            raise ValueError('{!r}: the ``zstandard`` module is needed for this file'.format(file_path))
+
+        fd = self.check_and_open_for_r(file_path, include_list, binary=True)
+
+        try:
+            if file_path.endswith('.sql.gz'):
+                return _DecompressedFile(gzip.GzipFile(fileobj=fd, mode='rb'), fd)
+
+            if file_path.endswith('.sql.zst'):
+                return _DecompressedFile(_ZstdReader(fd, file_path), fd)
+        except:
+            fd.close()
+
+            raise
+
+        return fd
+
+    def close(self):
+        for executor in self._executor_map.values():
+            executor.shutdown(cancel_futures=True)
+
+        self._executor_map.clear()
+        self._prefetch_map.clear()
+
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown(cancel_futures=True)
+
+            self._parse_executor = None
+
+        if self._read_executor is not None:
+            self._read_executor.shutdown(cancel_futures=True)
+
+            self._read_executor = None
+
+        self._close_dir_fd_map()
+
+    def yaml_safe_load(self, fd):
+        # libyaml parses faster than a document is passed to a process
+        # and back, so only the pure python parsing is given to the processes
+
+        if self._jobs <= 1 or self._yaml_safe_loader is not yaml.SafeLoader:
+            return yaml.load(fd, Loader=self._yaml_safe_loader)
+
+        if isinstance(fd, str):
+            content = fd
+            name = None
+        else:
+            content = fd.read()
+            name = getattr(fd, 'name', None)
+
+        with self._lock:
+            if self._parse_executor is None:
+                self._parse_executor = concurrent.futures.ProcessPoolExecutor(self._jobs)
+
+            parse_executor = self._parse_executor
+
+        return parse_executor.submit(_yaml_safe_load_content, content, name).result()
+
+    def _compiled_doc_file_path(self, content_hash):
+        return os.path.join(self._compiled_doc_path, content_hash[:2], '{}.json'.format(content_hash))
+
+    def _save_compiled_doc(self, content_hash, doc):
+        # a document which can not be kept in json as is (e.g. with dates
+        # or with non string keys) is not compiled
+
+        try:
+            compiled_content = json.dumps({'sha256': content_hash, 'doc': doc}, ensure_ascii=False)
+
+            if json.loads(compiled_content)['doc'] != doc:
+                return
+        except (TypeError, ValueError):
+            return
+
+        compiled_file_path = self._compiled_doc_file_path(content_hash)
+        tmp_file_path = '{}.{}.{}.tmp'.format(compiled_file_path, os.getpid(), threading.get_ident())
 
-    @classmethod
-    def resolve_include_ref(cls, include, include_ref_map):
+        try:
+            os.makedirs(os.path.dirname(compiled_file_path), exist_ok=True)
+
+            with open(tmp_file_path, 'w', encoding='utf-8') as fd:
+                fd.write(compiled_content)
+
+            os.replace(tmp_file_path, compiled_file_path)
+        except OSError:
+            # the directory might be read only. that is not an error
+
+            try:
+                os.unlink(tmp_file_path)
+            except OSError:
+                pass
+
+    def load_doc(self, file_path, include_list):
+        if self._compiled_doc_path is None:
+            with self.check_and_open_for_r(file_path, include_list) as fd:
+                return self.yaml_safe_load(fd)
+
+        # the compiled documents are named by the sha256 of the yaml
+        # content, so they are kept out of source code and are never
+        # out of date
+
+        with self.check_and_open_for_r(file_path, include_list) as fd:
+            content = fd.read()
+
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+        try:
+            with open(self._compiled_doc_file_path(content_hash), encoding='utf-8') as fd:
+                compiled = json.load(fd)
+        except (OSError, ValueError):
+            compiled = None
+
+        if isinstance(compiled, dict) and compiled.get('sha256') == content_hash and \
+                'doc' in compiled:
+            return compiled['doc']
+
+        # the stream keeps the file name for the error messages
+
+        stream = io.StringIO(content)
+        stream.name = file_path
+
+        doc = self.yaml_safe_load(stream)
+
+        self._save_compiled_doc(content_hash, doc)
+
+        return doc
+
+    def _load_descr_task(self, descr, file_path, include_list, include_ref_map, kwargs):
+        descr.load(file_path, include_list, include_ref_map, **kwargs)
+
+        return descr
+
+    def _finish_load_descr_task(self, result):
+        return result
+
+    def _run_load_descr_task(self, depth, descr, file_path, include_list, include_ref_map, kwargs):
+        self._local.depth = depth
+
+        return self._load_descr_task(descr, file_path, include_list, include_ref_map, kwargs)
+
+    def _prefetch_key(self, descr_class, file_path, include_list, kwargs):
+        return descr_class, file_path, tuple(include_list), tuple(sorted(kwargs.items()))
+
+    def prefetch_descr_list(self, prefetch_list, include_list, include_ref_map):
+        # the descriptors are only started here. they are taken by ``load_descr``
+        # in the order of the caller, so the ordering and the errors are the same
+        # as in the serial loading
+
+        if self._jobs <= 1 or len(prefetch_list) < 2:
+            return
+
+        depth = getattr(self._local, 'depth', 0) + 1
+
+        with self._lock:
+            executor = self._executor_map.get(depth)
+
+            if executor is None:
+                executor = self._executor_map[depth] = \
+                        concurrent.futures.ThreadPoolExecutor(self._jobs)
+
+        for descr_class, file_path, kwargs in prefetch_list:
+            prefetch_key = self._prefetch_key(descr_class, file_path, include_list, kwargs)
+
+            if prefetch_key in self._prefetch_map:
+                continue
+
+            self._prefetch_map[prefetch_key] = executor.submit(
+                self._run_load_descr_task,
+                depth,
+                descr_class(load_utils=self),
+                file_path, include_list, include_ref_map, kwargs,
+            )
+
+    def load_descr(self, descr, file_path, include_list, include_ref_map, **kwargs):
+        future = self._prefetch_map.pop(
+            self._prefetch_key(type(descr), file_path, include_list, kwargs),
+            None,
+        )
+
+        if future is not None:
+            return self._finish_load_descr_task(future.result())
+
+        return self._finish_load_descr_task(
+            self._load_descr_task(descr, file_path, include_list, include_ref_map, kwargs),
+        )
+
+    def resolve_include_ref(self, include, include_ref_map):
         m = re.fullmatch(
             r'(\$\{([A-Za-z0-9_]+)\}|\$([A-Za-z0-9_]+))(.*)',
             include,
@@ -69,8 +497,7 @@ class LoadUtils:
 
         return resolved_include
 
-    @classmethod
-    def check_include_elem(cls, include_elem, first_elem, last_elem):
+    def check_include_elem(self, include_elem, first_elem, last_elem):
         if include_elem is not None and not isinstance(include_elem, (list, str)):
             raise ValueError('not isinstance(include_elem, (list, str))')
 
@@ -80,9 +507,145 @@ class LoadUtils:
         if last_elem is not None and not isinstance(last_elem, (list, str)):
             raise ValueError('not isinstance(last_elem, (list, str))')
 
-    @classmethod
+    def load_copy_map(self, copy_elem):
+        # the data files are declared by their names together with their
+        # tables. they are ordered by ``first`` and ``last`` the same way
+        # as the sql files are
+
+        copy_map = {}
+
+        if copy_elem is None:
+            return copy_map
+
+        if not isinstance(copy_elem, dict):
+            raise ValueError('not isinstance(copy_elem, dict)')
+
+        for name, copy_item_elem in copy_elem.items():
+            if not isinstance(name, str):
+                raise ValueError('not isinstance(name, str)')
+
+            if name.endswith('.csv'):
+                copy_format = 'csv'
+            elif name.endswith('.tsv'):
+                copy_format = 'text'
+            else:
+                raise ValueError('{!r}: a data file must be ``.csv`` or ``.tsv``'.format(name))
+
+            if not isinstance(copy_item_elem, dict):
+                raise ValueError('not isinstance(copy_item_elem, dict)')
+
+            schema_name = copy_item_elem.get('schema')
+            table = copy_item_elem['table']
+            column_elem = copy_item_elem['columns']
+            header = copy_item_elem.get('header', False)
+
+            if schema_name is not None and not isinstance(schema_name, str):
+                raise ValueError('not isinstance(schema_name, str)')
+
+            if not isinstance(table, str):
+                raise ValueError('not isinstance(table, str)')
+
+            if not isinstance(column_elem, list) or not column_elem:
+                raise ValueError('{!r}: the columns must be a non-empty list'.format(name))
+
+            for column in column_elem:
+                if not isinstance(column, str):
+                    raise ValueError('not isinstance(column, str)')
+
+            if not isinstance(header, bool):
+                raise ValueError('not isinstance(header, bool)')
+
+            if header and copy_format != 'csv':
+                # the text format has no header before postgresql 15
+
+                raise ValueError('{!r}: a header is allowed for ``.csv`` files only'.format(name))
+
+            copy_map[name] = schema_name, table, tuple(column_elem), copy_format, header
+
+        return copy_map
+
+    def check_copy_map(self, copy_map, file_path_list, first_file_path_list, last_file_path_list):
+        used_name_set = set()
+
+        for path_list in (file_path_list, first_file_path_list, last_file_path_list):
+            used_name_set.update(os.path.basename(file_path) for file_path in path_list)
+
+        for name in copy_map:
+            if name not in used_name_set:
+                raise ValueError('{!r}: this file is not used'.format(name))
+
+    def _index_dir(self, path):
+        dir_index = self._dir_index_map.get(path)
+
+        if dir_index is not None:
+            return dir_index
+
+        dir_index = {}
+
+        with os.scandir(path) as dir_entry_iter:
+            for dir_entry in dir_entry_iter:
+                if dir_entry.is_symlink():
+                    entry_path = os.path.realpath(dir_entry.path)
+                    entry_is_dir = os.path.isdir(entry_path)
+                    entry_is_file = os.path.isfile(entry_path)
+                else:
+                    entry_path = dir_entry.path
+                    entry_is_dir = dir_entry.is_dir(follow_symlinks=False)
+                    entry_is_file = dir_entry.is_file(follow_symlinks=False)
+
+                dir_index[dir_entry.name] = entry_path, entry_is_dir, entry_is_file
+                self._path_is_dir_map[entry_path] = entry_is_dir
+
+        self._dir_index_map[path] = dir_index
+        self._path_is_dir_map[path] = True
+
+        return dir_index
+
+    def is_dir(self, path):
+        path_is_dir = self._path_is_dir_map.get(path)
+
+        if path_is_dir is None:
+            path_is_dir = os.path.isdir(path)
+            self._path_is_dir_map[path] = path_is_dir
+
+        return path_is_dir
+
+    def list_dir(self, path):
+        return sorted(self._index_dir(path))
+
+    def resolve_path(self, dir_path, name):
+        if '/' in name or name in ('', '.', '..') or not self.is_dir(dir_path):
+            return os.path.realpath(os.path.join(dir_path, name))
+
+        entry = self._index_dir(dir_path).get(name)
+
+        if entry is None:
+            return os.path.join(dir_path, name)
+
+        return entry[0]
+
+    def find_first_file(self, dir_path, descr_class_list):
+        for descr_class in descr_class_list:
+            file_path = self.find_file(dir_path, descr_class.file_name)
+
+            if file_path is not None:
+                return descr_class, file_path
+
+        return None, None
+
+    def find_file(self, dir_path, name):
+        if not self.is_dir(dir_path):
+            return
+
+        entry = self._index_dir(dir_path).get(name)
+
+        if entry is None or not entry[2]:
+            return
+
+        return entry[0]
+
     def load_file_path_list(
-                cls,
+                self,
                 file_dir,
                 include_elem, include_ref_map,
                 first_elem, last_elem, filt_func,
@@ -107,7 +670,7 @@ class LoadUtils:
                 if not isinstance(include_item_elem, str):
                     raise ValueError('not isinstance(include_item_elem, str)')
 
-                resolved_include = cls.resolve_include_ref(
+                resolved_include = self.resolve_include_ref(
                     include_item_elem,
                     include_ref_map,
                 )
@@ -122,8 +685,8 @@ class LoadUtils:
         path_list.append(file_dir)
 
         for path in path_list:
-            for f in sorted(d.name for d in os.scandir(path)):
-                file_path = os.path.realpath(os.path.join(path, f))
+            for f in self.list_dir(path):
+                file_path = self.resolve_path(path, f)
 
                 if not filt_func(file_path):
                     continue
@@ -146,71 +709,236 @@ class LoadUtils:
                     file_is_used = False
 
                     for path in path_list:
-                        file_path = os.path.realpath(os.path.join(
-                            path,
-                            ordered_item_elem,
-                        ))
+                        file_path = self.resolve_path(path, ordered_item_elem)
 
-                        if file_path not in file_path_list:
+                        if file_path not in file_path_set:
                             continue
 
                         file_is_used = True
-                        file_path_list.remove(file_path)
+                        file_path_set.remove(file_path)
                         ordered_file_path_list.append(file_path)
 
                     if not file_is_used:
                         raise ValueError('{!r}: this file is not used'.format(ordered_item_elem))
 
+        if first_file_path_list or last_file_path_list:
+            file_path_list = [x for x in file_path_list if x in file_path_set]
+
         return file_path_list, first_file_path_list, last_file_path_list
 
-    @classmethod
+    def _read_file(self, file_path, include_list):
+        # the content is kept as one buffer of utf-8 bytes, which goes
+        # as is to the output files and to the connections. it is checked
+        # and its newlines are translated the same way as the text reading does.
+        # a file larger than ``stream_size`` is not read here. it is read
+        # statement by statement while it is executed
+
+        with self.open_sql_for_r(file_path, include_list) as fd:
+            if self.is_compressed_sql_file(file_path):
+                # the size of a decompressed file is not known in advance
+
+                if self._stream_size:
+                    content = fd.read(self._stream_size + 1)
+
+                    if len(content) > self._stream_size:
+                        return sql_stream.SqlStream(self, file_path, include_list)
+                else:
+                    content = fd.read()
+            elif self._stream_size and os.fstat(fd.fileno()).st_size > self._stream_size:
+                return sql_stream.SqlStream(self, file_path, include_list)
+            else:
+                content = fd.read()
+
+        return sql_stream.check_sql_bytes(content)
+
+    def _get_read_ahead_reserve_size(self, file_path):
+        # the largest content which can be kept for the file. a file larger
+        # than ``stream_size`` is kept as a stream, and a compressed file
+        # is read up to ``stream_size``. the file is checked later by
+        # ``_read_file``
+
+        if self.is_compressed_sql_file(file_path):
+            return self._stream_size or self._read_ahead_size
+
+        try:
+            file_size = os.stat(file_path).st_size
+        except OSError:
+            return 0
+
+        if self._stream_size and file_size > self._stream_size:
+            return 0
+
+        return file_size
+
+    def _reserve_read_ahead(self, size, force=None):
+        if force is None:
+            force = False
+
+        with self._lock:
+            if not force and self._read_ahead_reserved_size + size > self._read_ahead_size:
+                return False
+
+            self._read_ahead_reserved_size += size
+
+            return True
+
+    def _release_read_ahead(self, size):
+        with self._lock:
+            self._read_ahead_reserved_size -= size
+
+    def _read_ahead_iter(self, content_item_list, include_list):
+        if self._read_ahead <= 0:
+            for file_path_type, file_path, content in content_item_list:
+                if content is None:
+                    content = self._read_file(file_path, include_list)
+
+                yield file_path_type, file_path, content
+
+            return
+
+        # the next files are read by the threads while the current content
+        # is executed. the files are still opened by ``check_and_open_for_r``
+        # and are taken in order, so a failed file fails at the same place.
+        # every file reserves its largest possible content when it is started
+        # and releases it when the content is taken. no more files are started
+        # while a new reservation would exceed ``read_ahead_size`` (for all
+        # iterations together), but the next file is always started when
+        # nothing is pending
+
+        with self._lock:
+            if self._read_executor is None:
+                self._read_executor = concurrent.futures.ThreadPoolExecutor(self._read_ahead)
+
+            read_executor = self._read_executor
+
+        content_item_iter = iter(content_item_list)
+        pending_list = collections.deque()
+        next_content_item = None
+
+        try:
+            while True:
+                while len(pending_list) < self._read_ahead:
+                    if next_content_item is None:
+                        next_content_item = next(content_item_iter, None)
+
+                        if next_content_item is None:
+                            break
+
+                    file_path_type, file_path, content = next_content_item
+
+                    if content is None:
+                        reserved_size = self._get_read_ahead_reserve_size(file_path)
+
+                        if not self._reserve_read_ahead(reserved_size, force=not pending_list):
+                            break
+
+                        try:
+                            future = read_executor.submit(self._read_file, file_path, include_list)
+                        except:
+                            self._release_read_ahead(reserved_size)
+
+                            raise
+
+                        pending_list.append((file_path_type, file_path, future, reserved_size))
+                    else:
+                        pending_list.append((file_path_type, file_path, content, 0))
+
+                    next_content_item = None
+
+                if not pending_list:
+                    break
+
+                file_path_type, file_path, future_or_content, reserved_size = pending_list.popleft()
+
+                try:
+                    if isinstance(future_or_content, concurrent.futures.Future):
+                        content = future_or_content.result()
+                    else:
+                        content = future_or_content
+                finally:
+                    self._release_read_ahead(reserved_size)
+
+                yield file_path_type, file_path, content
+        finally:
+            for _, _, future_or_content, reserved_size in pending_list:
+                if isinstance(future_or_content, concurrent.futures.Future):
+                    future_or_content.cancel()
+
+                    # a running read is not cancelled, so its reservation
+                    # is released when it is done
+
+                    future_or_content.add_done_callback(
+                        lambda _, reserved_size=reserved_size: self._release_read_ahead(reserved_size),
+                    )
+
     def read_content(
-                cls,
+                self,
                 file_path_list, first_file_path_list, last_file_path_list,
                 inline, inline_path,
                 include_list,
+                copy_map=None,
             ):
+        content_item_list = []
+
+        def make_content(file_path):
+            # a data file is not read here. it is streamed by ``copy``
+
+            if copy_map:
+                copy_spec = copy_map.get(os.path.basename(file_path))
+
+                if copy_spec is not None:
+                    return copy_data.CopyData(self, file_path, include_list, copy_spec)
+
         if first_file_path_list is not None:
             for file_path in first_file_path_list:
-                info = {
-                    'file_path': os.path.relpath(file_path, start=include_list[-1]),
-                    'file_path_type': 'first',
-                }
-
-                with cls.check_and_open_for_r(file_path, include_list) as fd:
-                    yield fd.read(), info
+                content_item_list.append(('first', file_path, make_content(file_path)))
 
         if file_path_list is not None:
             for file_path in file_path_list:
-                info = {
-                    'file_path': os.path.relpath(file_path, start=include_list[-1]),
-                    'file_path_type': 'regular',
-                }
-
-                with cls.check_and_open_for_r(file_path, include_list) as fd:
-                    yield fd.read(), info
+                content_item_list.append(('regular', file_path, make_content(file_path)))
 
         if inline is not None:
+            content_item_list.append(('inline', inline_path, inline))
+
+        if last_file_path_list is not None:
+            for file_path in last_file_path_list:
+                content_item_list.append(('last', file_path, make_content(file_path)))
+
+        for file_path_type, file_path, content in \
+                self._read_ahead_iter(content_item_list, include_list):
             info = {
-                'file_path': os.path.relpath(inline_path, start=include_list[-1])
-                        if inline_path is not None else None,
-                'file_path_type': 'inline',
+                'file_path': os.path.relpath(file_path, start=include_list[-1])
+                        if file_path is not None else None,
+                'file_path_type': file_path_type,
             }
 
-            yield inline, info
+            yield content, info
 
-        if last_file_path_list is not None:
-            for file_path in last_file_path_list:
-                info = {
-                    'file_path': os.path.relpath(file_path, start=include_list[-1]),
-                    'file_path_type': 'last',
-                }
+class BaseDescr:
+    # the descriptors have no ``__dict__``. there are a lot of them
+    # in a large source code, and they are kept for the whole run
+
+    __slots__ = (
+        '_load_utils',
+    )
 
-                with cls.check_and_open_for_r(file_path, include_list) as fd:
-                    yield fd.read(), info
+    _load_utils_class = LoadUtils
 
-class InitDescr:
-    _load_utils = LoadUtils
+    def __init__(self, load_utils=None):
+        if load_utils is None:
+            load_utils = self._load_utils_class()
+
+        self._load_utils = load_utils
+
+class InitDescr(BaseDescr):
+    __slots__ = (
+        'init_file_path',
+        'include_list',
+        'file_path_list',
+        'first_file_path_list',
+        'last_file_path_list',
+        'sql',
+    )
 
     file_name = 'init.yaml'
 
@@ -221,8 +949,7 @@ class InitDescr:
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(init_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(init_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -246,7 +973,7 @@ class InitDescr:
             raise ValueError('not isinstance(sql, str')
 
         def sql_filt_func(file_path):
-            return file_path.endswith('.sql')
+            return self._load_utils.is_sql_file(file_path)
 
         file_path_list, first_file_path_list, last_file_path_list = \
                 self._load_utils.load_file_path_list(
@@ -254,12 +981,11 @@ class InitDescr:
                     first_elem, last_elem, sql_filt_func,
                 )
 
-        self.virtual_doc = virtual_doc
         self.init_file_path = init_file_path
         self.include_list = include_list
-        self.file_path_list = file_path_list
-        self.first_file_path_list = first_file_path_list
-        self.last_file_path_list = last_file_path_list
+        self.file_path_list = tuple(file_path_list)
+        self.first_file_path_list = tuple(first_file_path_list)
+        self.last_file_path_list = tuple(last_file_path_list)
         self.sql = sql
 
     def read_sql(self):
@@ -271,8 +997,20 @@ class InitDescr:
             self.include_list,
         )
 
-class SchemaDescr:
-    _load_utils = LoadUtils
+class SchemaDescr(BaseDescr):
+    __slots__ = (
+        'schema_file_path',
+        'include_list',
+        'schema_name',
+        'schema_type',
+        'owner',
+        'grant_list',
+        'file_path_list',
+        'first_file_path_list',
+        'last_file_path_list',
+        'copy_map',
+        'sql',
+    )
 
     file_name = 'schema.yaml'
 
@@ -283,8 +1021,7 @@ class SchemaDescr:
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(schema_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(schema_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -304,6 +1041,7 @@ class SchemaDescr:
         include_elem = schema_elem.get('include')
         first_elem = schema_elem.get('first')
         last_elem = schema_elem.get('last')
+        copy_elem = schema_elem.get('copy')
         sql = schema_elem.get('sql')
 
         if not isinstance(schema_name, str):
@@ -336,8 +1074,11 @@ class SchemaDescr:
 
                 grant_list.append(grant)
 
+        copy_map = self._load_utils.load_copy_map(copy_elem)
+
         def sql_filt_func(file_path):
-            return file_path.endswith('.sql')
+            return self._load_utils.is_sql_file(file_path) or \
+                    os.path.basename(file_path) in copy_map
 
         file_path_list, first_file_path_list, last_file_path_list = \
                 self._load_utils.load_file_path_list(
@@ -345,16 +1086,20 @@ class SchemaDescr:
                     first_elem, last_elem, sql_filt_func,
                 )
 
-        self.virtual_doc = virtual_doc
+        self._load_utils.check_copy_map(
+            copy_map, file_path_list, first_file_path_list, last_file_path_list,
+        )
+
         self.schema_file_path = schema_file_path
         self.include_list = include_list
         self.schema_name = schema_name
         self.schema_type = schema_type
         self.owner = owner
         self.grant_list = grant_list
-        self.file_path_list = file_path_list
-        self.first_file_path_list = first_file_path_list
-        self.last_file_path_list = last_file_path_list
+        self.file_path_list = tuple(file_path_list)
+        self.first_file_path_list = tuple(first_file_path_list)
+        self.last_file_path_list = tuple(last_file_path_list)
+        self.copy_map = copy_map
         self.sql = sql
 
     def read_sql(self):
@@ -364,10 +1109,18 @@ class SchemaDescr:
             self.last_file_path_list,
             self.sql, self.schema_file_path,
             self.include_list,
+            copy_map=self.copy_map,
         )
 
-class LateDescr:
-    _load_utils = LoadUtils
+class LateDescr(BaseDescr):
+    __slots__ = (
+        'late_file_path',
+        'include_list',
+        'file_path_list',
+        'first_file_path_list',
+        'last_file_path_list',
+        'sql',
+    )
 
     file_name = 'late.yaml'
 
@@ -378,8 +1131,7 @@ class LateDescr:
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(late_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(late_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -403,7 +1155,7 @@ class LateDescr:
             raise ValueError('not isinstance(sql, str')
 
         def sql_filt_func(file_path):
-            return file_path.endswith('.sql')
+            return self._load_utils.is_sql_file(file_path)
 
         file_path_list, first_file_path_list, last_file_path_list = \
                 self._load_utils.load_file_path_list(
@@ -411,12 +1163,11 @@ class LateDescr:
                     first_elem, last_elem, sql_filt_func,
                 )
 
-        self.virtual_doc = virtual_doc
         self.late_file_path = late_file_path
         self.include_list = include_list
-        self.file_path_list = file_path_list
-        self.first_file_path_list = first_file_path_list
-        self.last_file_path_list = last_file_path_list
+        self.file_path_list = tuple(file_path_list)
+        self.first_file_path_list = tuple(first_file_path_list)
+        self.last_file_path_list = tuple(last_file_path_list)
         self.sql = sql
 
     def read_sql(self):
@@ -428,8 +1179,15 @@ class LateDescr:
             self.include_list,
         )
 
-class SafeguardDescr:
-    _load_utils = LoadUtils
+class SafeguardDescr(BaseDescr):
+    __slots__ = (
+        'safeguard_file_path',
+        'include_list',
+        'file_path_list',
+        'first_file_path_list',
+        'last_file_path_list',
+        'sql',
+    )
 
     file_name = 'safeguard.yaml'
 
@@ -440,8 +1198,7 @@ class SafeguardDescr:
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(safeguard_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(safeguard_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -465,7 +1222,7 @@ class SafeguardDescr:
             raise ValueError('not isinstance(sql, str')
 
         def sql_filt_func(file_path):
-            return file_path.endswith('.sql')
+            return self._load_utils.is_sql_file(file_path)
 
         file_path_list, first_file_path_list, last_file_path_list = \
                 self._load_utils.load_file_path_list(
@@ -473,12 +1230,11 @@ class SafeguardDescr:
                     first_elem, last_elem, sql_filt_func,
                 )
 
-        self.virtual_doc = virtual_doc
         self.safeguard_file_path = safeguard_file_path
         self.include_list = include_list
-        self.file_path_list = file_path_list
-        self.first_file_path_list = first_file_path_list
-        self.last_file_path_list = last_file_path_list
+        self.file_path_list = tuple(file_path_list)
+        self.first_file_path_list = tuple(first_file_path_list)
+        self.last_file_path_list = tuple(last_file_path_list)
         self.sql = sql
 
     def read_sql(self):
@@ -490,8 +1246,19 @@ class SafeguardDescr:
             self.include_list,
         )
 
-class SchemasDescr:
-    _load_utils = LoadUtils
+class SchemasDescr(BaseDescr):
+    __slots__ = (
+        'schemas_file_path',
+        'include_list',
+        'schemas_type',
+        'materialized',
+        'init',
+        'var_schema_list',
+        'late',
+        'func_schema_list',
+        'safeguard',
+    )
+
     _init_descr_class = InitDescr
     _schema_descr_class = SchemaDescr
     _late_descr_class = LateDescr
@@ -500,14 +1267,13 @@ class SchemasDescr:
     file_name = 'schemas.yaml'
 
     def load(self, schemas_file_path, include_list, include_ref_map,
-            virtual_doc=None, schemas_type=None):
+            virtual_doc=None, schemas_type=None, type_set=None):
         schemas_file_dir = os.path.dirname(schemas_file_path)
 
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(schemas_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(schemas_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -531,46 +1297,45 @@ class SchemasDescr:
         self._load_utils.check_include_elem(include_elem, first_elem, last_elem)
 
         def init_filt_func(file_path):
-            init_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._init_descr_class.file_name,
-            ))
-
-            return os.path.isfile(init_file_path)
+            ) is not None
 
         def schema_filt_func(file_path):
-            schema_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._schema_descr_class.file_name,
-            ))
-
-            return os.path.isfile(schema_file_path)
+            ) is not None
 
         def late_filt_func(file_path):
-            late_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._late_descr_class.file_name,
-            ))
-
-            return os.path.isfile(late_file_path)
+            ) is not None
 
         def safeguard_filt_func(file_path):
-            safeguard_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._safeguard_descr_class.file_name,
-            ))
-
-            return os.path.isfile(safeguard_file_path)
+            ) is not None
 
         def filt_func(file_path):
             return init_filt_func(file_path) or schema_filt_func(file_path) or \
                     late_filt_func(file_path) or safeguard_filt_func(file_path)
 
-        file_path_list, first_file_path_list, last_file_path_list = \
-                self._load_utils.load_file_path_list(
-                    schemas_file_dir, include_elem, include_ref_map,
-                    first_elem, last_elem, filt_func,
-                )
+        # only the header is loaded when there is no targeted host of this type
+
+        materialized = type_set is None or schemas_type in type_set
+
+        if materialized:
+            file_path_list, first_file_path_list, last_file_path_list = \
+                    self._load_utils.load_file_path_list(
+                        schemas_file_dir, include_elem, include_ref_map,
+                        first_elem, last_elem, filt_func,
+                    )
+        else:
+            file_path_list, first_file_path_list, last_file_path_list = [], [], []
 
         init = None
         var_schema_list = []
@@ -579,6 +1344,19 @@ class SchemasDescr:
         safeguard = None
         schema_name_set = set()
 
+        self._load_utils.prefetch_descr_list(
+            [
+                self._load_utils.find_first_file(file_path, (
+                    self._init_descr_class,
+                    self._schema_descr_class,
+                    self._late_descr_class,
+                    self._safeguard_descr_class,
+                )) + ({},)
+                for file_path in first_file_path_list + file_path_list + last_file_path_list
+            ],
+            include_list, include_ref_map,
+        )
+
         for file_path in first_file_path_list + file_path_list + last_file_path_list:
             if init_filt_func(file_path):
                 if init is not None:
@@ -588,15 +1366,16 @@ class SchemasDescr:
                         ),
                     )
 
-                init_file_path = os.path.realpath(os.path.join(
+                init_file_path = self._load_utils.find_file(
                     file_path,
                     self._init_descr_class.file_name,
-                ))
-
-                init_descr = self._init_descr_class()
+                )
 
                 try:
-                    init_descr.load(init_file_path, include_list, include_ref_map)
+                    init_descr = self._load_utils.load_descr(
+                        self._init_descr_class(load_utils=self._load_utils),
+                        init_file_path, include_list, include_ref_map,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(init_file_path, type(e), e)) from e
                 except OSError as e:
@@ -604,15 +1383,16 @@ class SchemasDescr:
 
                 init = init_descr
             elif schema_filt_func(file_path):
-                schema_file_path = os.path.realpath(os.path.join(
+                schema_file_path = self._load_utils.find_file(
                     file_path,
                     self._schema_descr_class.file_name,
-                ))
-
-                schema_descr = self._schema_descr_class()
+                )
 
                 try:
-                    schema_descr.load(schema_file_path, include_list, include_ref_map)
+                    schema_descr = self._load_utils.load_descr(
+                        self._schema_descr_class(load_utils=self._load_utils),
+                        schema_file_path, include_list, include_ref_map,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(schema_file_path, type(e), e)) from e
                 except OSError as e:
@@ -647,15 +1427,16 @@ class SchemasDescr:
                         ),
                     )
 
-                late_file_path = os.path.realpath(os.path.join(
+                late_file_path = self._load_utils.find_file(
                     file_path,
                     self._late_descr_class.file_name,
-                ))
-
-                late_descr = self._late_descr_class()
+                )
 
                 try:
-                    late_descr.load(late_file_path, include_list, include_ref_map)
+                    late_descr = self._load_utils.load_descr(
+                        self._late_descr_class(load_utils=self._load_utils),
+                        late_file_path, include_list, include_ref_map,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(late_file_path, type(e), e)) from e
                 except OSError as e:
@@ -670,15 +1451,16 @@ class SchemasDescr:
                         ),
                     )
 
-                safeguard_file_path = os.path.realpath(os.path.join(
+                safeguard_file_path = self._load_utils.find_file(
                     file_path,
                     self._safeguard_descr_class.file_name,
-                ))
-
-                safeguard_descr = self._safeguard_descr_class()
+                )
 
                 try:
-                    safeguard_descr.load(safeguard_file_path, include_list, include_ref_map)
+                    safeguard_descr = self._load_utils.load_descr(
+                        self._safeguard_descr_class(load_utils=self._load_utils),
+                        safeguard_file_path, include_list, include_ref_map,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(safeguard_file_path, type(e), e)) from e
                 except OSError as e:
@@ -688,30 +1470,38 @@ class SchemasDescr:
             else:
                 raise AssertionError
 
-        self.virtual_doc = virtual_doc
         self.schemas_file_path = schemas_file_path
         self.include_list = include_list
         self.schemas_type = schemas_type
+        self.materialized = materialized
         self.init = init
         self.var_schema_list = var_schema_list
         self.late = late
         self.func_schema_list = func_schema_list
         self.safeguard = safeguard
 
-class SettingsDescr:
-    _load_utils = LoadUtils
+class SettingsDescr(BaseDescr):
+    __slots__ = (
+        'settings_file_path',
+        'include_list',
+        'settings_type',
+        'materialized',
+        'file_path_list',
+        'first_file_path_list',
+        'last_file_path_list',
+        'sql',
+    )
 
     file_name = 'settings.yaml'
 
     def load(self, settings_file_path, include_list, include_ref_map,
-            virtual_doc=None, settings_type=None):
+            virtual_doc=None, settings_type=None, type_set=None):
         settings_file_dir = os.path.dirname(settings_file_path)
 
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(settings_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(settings_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -739,21 +1529,28 @@ class SettingsDescr:
             raise ValueError('not isinstance(sql, str')
 
         def sql_filt_func(file_path):
-            return file_path.endswith('.sql')
+            return self._load_utils.is_sql_file(file_path)
 
-        file_path_list, first_file_path_list, last_file_path_list = \
-                self._load_utils.load_file_path_list(
-                    settings_file_dir, include_elem, include_ref_map,
-                    first_elem, last_elem, sql_filt_func,
-                )
+        # only the header is loaded when there is no targeted host of this type
+
+        materialized = type_set is None or settings_type in type_set
+
+        if materialized:
+            file_path_list, first_file_path_list, last_file_path_list = \
+                    self._load_utils.load_file_path_list(
+                        settings_file_dir, include_elem, include_ref_map,
+                        first_elem, last_elem, sql_filt_func,
+                    )
+        else:
+            file_path_list, first_file_path_list, last_file_path_list = [], [], []
 
-        self.virtual_doc = virtual_doc
         self.settings_file_path = settings_file_path
         self.include_list = include_list
         self.settings_type = settings_type
-        self.file_path_list = file_path_list
-        self.first_file_path_list = first_file_path_list
-        self.last_file_path_list = last_file_path_list
+        self.materialized = materialized
+        self.file_path_list = tuple(file_path_list)
+        self.first_file_path_list = tuple(first_file_path_list)
+        self.last_file_path_list = tuple(last_file_path_list)
         self.sql = sql
 
     def read_sql(self):
@@ -765,20 +1562,29 @@ class SettingsDescr:
             self.include_list,
         )
 
-class UpgradeDescr:
-    _load_utils = LoadUtils
+class UpgradeDescr(BaseDescr):
+    __slots__ = (
+        'upgrade_file_path',
+        'include_list',
+        'upgrade_type',
+        'materialized',
+        'file_path_list',
+        'first_file_path_list',
+        'last_file_path_list',
+        'copy_map',
+        'sql',
+    )
 
     file_name = 'upgrade.yaml'
 
     def load(self, upgrade_file_path, include_list, include_ref_map,
-            virtual_doc=None):
+            virtual_doc=None, type_set=None):
         upgrade_file_dir = os.path.dirname(upgrade_file_path)
 
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(upgrade_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(upgrade_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -795,6 +1601,7 @@ class UpgradeDescr:
         include_elem = upgrade_elem.get('include')
         first_elem = upgrade_elem.get('first')
         last_elem = upgrade_elem.get('last')
+        copy_elem = upgrade_elem.get('copy')
         sql = upgrade_elem.get('sql')
 
         if not isinstance(upgrade_type, str):
@@ -805,22 +1612,37 @@ class UpgradeDescr:
         if sql is not None and not isinstance(sql, str):
             raise ValueError('not isinstance(sql, str')
 
+        copy_map = self._load_utils.load_copy_map(copy_elem)
+
         def sql_filt_func(file_path):
-            return file_path.endswith('.sql')
+            return self._load_utils.is_sql_file(file_path) or \
+                    os.path.basename(file_path) in copy_map
 
-        file_path_list, first_file_path_list, last_file_path_list = \
-                self._load_utils.load_file_path_list(
-                    upgrade_file_dir, include_elem, include_ref_map,
-                    first_elem, last_elem, sql_filt_func,
-                )
+        # only the header is loaded when there is no targeted host of this type
+
+        materialized = type_set is None or upgrade_type in type_set
+
+        if materialized:
+            file_path_list, first_file_path_list, last_file_path_list = \
+                    self._load_utils.load_file_path_list(
+                        upgrade_file_dir, include_elem, include_ref_map,
+                        first_elem, last_elem, sql_filt_func,
+                    )
+
+            self._load_utils.check_copy_map(
+                copy_map, file_path_list, first_file_path_list, last_file_path_list,
+            )
+        else:
+            file_path_list, first_file_path_list, last_file_path_list = [], [], []
 
-        self.virtual_doc = virtual_doc
         self.upgrade_file_path = upgrade_file_path
         self.include_list = include_list
         self.upgrade_type = upgrade_type
-        self.file_path_list = file_path_list
-        self.first_file_path_list = first_file_path_list
-        self.last_file_path_list = last_file_path_list
+        self.materialized = materialized
+        self.file_path_list = tuple(file_path_list)
+        self.first_file_path_list = tuple(first_file_path_list)
+        self.last_file_path_list = tuple(last_file_path_list)
+        self.copy_map = copy_map
         self.sql = sql
 
     def read_sql(self):
@@ -830,23 +1652,31 @@ class UpgradeDescr:
             self.last_file_path_list,
             self.sql, self.upgrade_file_path,
             self.include_list,
+            copy_map=self.copy_map,
         )
 
-class MigrationDescr:
-    _load_utils = LoadUtils
+class MigrationDescr(BaseDescr):
+    __slots__ = (
+        'migration_file_path',
+        'include_list',
+        'migration_type',
+        'revision',
+        'compatible_list',
+        'upgrade_map',
+    )
+
     _upgrade_descr_class = UpgradeDescr
 
     file_name = 'migration.yaml'
 
     def load(self, migration_file_path, include_list, include_ref_map,
-            virtual_doc=None, migration_type=None):
+            virtual_doc=None, migration_type=None, type_set=None):
         migration_file_dir = os.path.dirname(migration_file_path)
 
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(migration_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(migration_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -889,7 +1719,7 @@ class MigrationDescr:
 
         self._load_utils.check_include_elem(include_elem, first_elem, last_elem)
 
-        upgrade_list = []
+        upgrade_map = {}
 
         if migration_type is not None:
             upgrade_sql = migration_elem.get('sql')
@@ -901,29 +1731,29 @@ class MigrationDescr:
                     'include': include_elem,
                     'first': first_elem,
                     'last': last_elem,
+                    'copy': migration_elem.get('copy'),
                     'sql': upgrade_sql,
                 }
             }
 
-            upgrade_descr = self._upgrade_descr_class()
+            upgrade_descr = self._upgrade_descr_class(load_utils=self._load_utils)
 
             try:
                 upgrade_descr.load(upgrade_file_path, include_list,
-                        include_ref_map, virtual_doc=upgrade_virtual_doc)
+                        include_ref_map, virtual_doc=upgrade_virtual_doc, type_set=type_set)
             except (LookupError, ValueError) as e:
                 raise ValueError('{!r}: {!r}: {}'.format(upgrade_file_path, type(e), e)) from e
             except OSError as e:
                 raise OSError('{!r}: {!r}: {}'.format(upgrade_file_path, type(e), e)) from e
 
-            upgrade_list.append(upgrade_descr)
+            if upgrade_descr.materialized:
+                upgrade_map[upgrade_descr.upgrade_type] = upgrade_descr
         else:
             def upgrade_filt_func(file_path):
-                upgrade_file_path = os.path.realpath(os.path.join(
+                return self._load_utils.find_file(
                     file_path,
                     self._upgrade_descr_class.file_name,
-                ))
-
-                return os.path.isfile(upgrade_file_path)
+                ) is not None
 
             file_path_list, first_file_path_list, last_file_path_list = \
                     self._load_utils.load_file_path_list(
@@ -933,16 +1763,33 @@ class MigrationDescr:
 
             upgrade_type_set = set()
 
+            self._load_utils.prefetch_descr_list(
+                [
+                    (
+                        self._upgrade_descr_class,
+                        self._load_utils.find_file(
+                            file_path,
+                            self._upgrade_descr_class.file_name,
+                        ),
+                        {'type_set': type_set},
+                    )
+                    for file_path in first_file_path_list + file_path_list + last_file_path_list
+                ],
+                include_list, include_ref_map,
+            )
+
             for file_path in first_file_path_list + file_path_list + last_file_path_list:
-                upgrade_file_path = os.path.realpath(os.path.join(
+                upgrade_file_path = self._load_utils.find_file(
                     file_path,
                     self._upgrade_descr_class.file_name,
-                ))
-
-                upgrade_descr = self._upgrade_descr_class()
+                )
 
                 try:
-                    upgrade_descr.load(upgrade_file_path, include_list, include_ref_map)
+                    upgrade_descr = self._load_utils.load_descr(
+                        self._upgrade_descr_class(load_utils=self._load_utils),
+                        upgrade_file_path, include_list, include_ref_map,
+                        type_set=type_set,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(upgrade_file_path, type(e), e)) from e
                 except OSError as e:
@@ -957,31 +1804,39 @@ class MigrationDescr:
                     )
 
                 upgrade_type_set.add(upgrade_descr.upgrade_type)
-                upgrade_list.append(upgrade_descr)
 
-        self.virtual_doc = virtual_doc
+                if upgrade_descr.materialized:
+                    upgrade_map[upgrade_descr.upgrade_type] = upgrade_descr
+
         self.migration_file_path = migration_file_path
         self.include_list = include_list
         self.migration_type = migration_type
         self.revision = revision
         self.compatible_list = compatible_list
-        self.upgrade_list = upgrade_list
+        self.upgrade_map = upgrade_map
+
+class MigrationsDescr(BaseDescr):
+    __slots__ = (
+        'migrations_file_path',
+        'include_list',
+        'migrations_type',
+        'migration_list',
+        'migration_way_map',
+        'compatible_map',
+    )
 
-class MigrationsDescr:
-    _load_utils = LoadUtils
     _migration_descr_class = MigrationDescr
 
     file_name = 'migrations.yaml'
 
     def load(self, migrations_file_path, include_list, include_ref_map,
-            virtual_doc=None, migrations_type=None):
+            virtual_doc=None, migrations_type=None, type_set=None):
         migrations_file_dir = os.path.dirname(migrations_file_path)
 
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(migrations_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(migrations_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -1005,12 +1860,10 @@ class MigrationsDescr:
         self._load_utils.check_include_elem(include_elem, first_elem, last_elem)
 
         def migration_filt_func(file_path):
-            migration_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._migration_descr_class.file_name,
-            ))
-
-            return os.path.isfile(migration_file_path)
+            ) is not None
 
         file_path_list, first_file_path_list, last_file_path_list = \
                 self._load_utils.load_file_path_list(
@@ -1019,19 +1872,37 @@ class MigrationsDescr:
                 )
 
         migration_list = []
-        migration_way_set = set()
+        migration_way_map = {}
+        compatible_map = {}
+
+        self._load_utils.prefetch_descr_list(
+            [
+                (
+                    self._migration_descr_class,
+                    self._load_utils.find_file(
+                        file_path,
+                        self._migration_descr_class.file_name,
+                    ),
+                    {'migration_type': migrations_type, 'type_set': type_set},
+                )
+                for file_path in first_file_path_list + file_path_list + last_file_path_list
+            ],
+            include_list, include_ref_map,
+        )
 
         for file_path in first_file_path_list + file_path_list + last_file_path_list:
-            migration_file_path = os.path.realpath(os.path.join(
+            migration_file_path = self._load_utils.find_file(
                 file_path,
                 self._migration_descr_class.file_name,
-            ))
-
-            migration_descr = self._migration_descr_class()
+            )
 
             try:
-                migration_descr.load(migration_file_path, include_list,
-                        include_ref_map, migration_type=migrations_type)
+                migration_descr = self._load_utils.load_descr(
+                    self._migration_descr_class(load_utils=self._load_utils),
+                    migration_file_path, include_list, include_ref_map,
+                    migration_type=migrations_type,
+                    type_set=type_set,
+                )
             except (LookupError, ValueError) as e:
                 raise ValueError('{!r}: {!r}: {}'.format(migration_file_path, type(e), e)) from e
             except OSError as e:
@@ -1049,7 +1920,7 @@ class MigrationsDescr:
             for compatible in migration_descr.compatible_list:
                 migration_way = migration_descr.revision, compatible
 
-                if migration_way in migration_way_set:
+                if migration_way in migration_way_map:
                     raise ValueError(
                         '{!r}, {!r}: non unique migration_way'.format(
                             migration_way,
@@ -1057,18 +1928,31 @@ class MigrationsDescr:
                         ),
                     )
 
-                migration_way_set.add(migration_way)
+                migration_way_map[migration_way] = migration_descr
+                compatible_map.setdefault(migration_descr.revision, []).append(compatible)
 
             migration_list.append(migration_descr)
 
-        self.virtual_doc = virtual_doc
         self.migrations_file_path = migrations_file_path
         self.include_list = include_list
         self.migrations_type = migrations_type
         self.migration_list = migration_list
+        self.migration_way_map = migration_way_map
+        self.compatible_map = compatible_map
+
+class ClusterDescr(BaseDescr):
+    __slots__ = (
+        'cluster_file_path',
+        'include_list',
+        'application',
+        'cluster_type',
+        'revision',
+        'compatible_list',
+        'schemas_map',
+        'migrations',
+        'settings_map',
+    )
 
-class ClusterDescr:
-    _load_utils = LoadUtils
     _schemas_descr_class = SchemasDescr
     _settings_descr_class = SettingsDescr
     _migrations_descr_class = MigrationsDescr
@@ -1076,7 +1960,7 @@ class ClusterDescr:
     file_name = 'cluster.yaml'
 
     def load(self, cluster_file_path, include_list, include_ref_map,
-            virtual_doc=None, cluster_type=None, settings_mode=None):
+            virtual_doc=None, cluster_type=None, settings_mode=None, type_set=None):
         if settings_mode is None:
             settings_mode = False
 
@@ -1085,8 +1969,7 @@ class ClusterDescr:
         if virtual_doc is not None:
             doc = virtual_doc
         else:
-            with self._load_utils.check_and_open_for_r(cluster_file_path, include_list) as fd:
-                doc = self._load_utils.yaml_safe_load(fd)
+            doc = self._load_utils.load_doc(cluster_file_path, include_list)
 
         if not isinstance(doc, dict):
             raise ValueError('not isinstance(doc, dict)')
@@ -1142,28 +2025,22 @@ class ClusterDescr:
         self._load_utils.check_include_elem(include_elem, first_elem, last_elem)
 
         def schemas_filt_func(file_path):
-            schemas_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._schemas_descr_class.file_name,
-            ))
-
-            return os.path.isfile(schemas_file_path)
+            ) is not None
 
         def settings_filt_func(file_path):
-            settings_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._settings_descr_class.file_name,
-            ))
-
-            return os.path.isfile(settings_file_path)
+            ) is not None
 
         def migrations_filt_func(file_path):
-            migrations_file_path = os.path.realpath(os.path.join(
+            return self._load_utils.find_file(
                 file_path,
                 self._migrations_descr_class.file_name,
-            ))
-
-            return os.path.isfile(migrations_file_path)
+            ) is not None
 
         if settings_mode:
             def filt_func(file_path):
@@ -1178,24 +2055,43 @@ class ClusterDescr:
                     first_elem, last_elem, filt_func,
                 )
 
-        schemas_list = []
-        settings_list = []
+        schemas_map = {}
+        settings_map = {}
         migrations = None
         schemas_type_set = set()
         settings_type_set = set()
+        kwargs_map = {
+            self._schemas_descr_class: {'schemas_type': cluster_type, 'type_set': type_set},
+            self._settings_descr_class: {'settings_type': cluster_type, 'type_set': type_set},
+            self._migrations_descr_class: {'migrations_type': cluster_type, 'type_set': type_set},
+        }
+        prefetch_list = []
+
+        for file_path in first_file_path_list + file_path_list + last_file_path_list:
+            descr_class, descr_file_path = self._load_utils.find_first_file(file_path, (
+                self._schemas_descr_class,
+                self._settings_descr_class,
+                self._migrations_descr_class,
+            ))
+
+            prefetch_list.append((descr_class, descr_file_path, kwargs_map[descr_class]))
+
+        self._load_utils.prefetch_descr_list(prefetch_list, include_list, include_ref_map)
 
         for file_path in first_file_path_list + file_path_list + last_file_path_list:
             if schemas_filt_func(file_path):
-                schemas_file_path = os.path.realpath(os.path.join(
+                schemas_file_path = self._load_utils.find_file(
                     file_path,
                     self._schemas_descr_class.file_name,
-                ))
-
-                schemas_descr = self._schemas_descr_class()
+                )
 
                 try:
-                    schemas_descr.load(schemas_file_path, include_list,
-                            include_ref_map, schemas_type=cluster_type)
+                    schemas_descr = self._load_utils.load_descr(
+                        self._schemas_descr_class(load_utils=self._load_utils),
+                        schemas_file_path, include_list, include_ref_map,
+                        schemas_type=cluster_type,
+                        type_set=type_set,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(schemas_file_path, type(e), e)) from e
                 except OSError as e:
@@ -1219,18 +2115,22 @@ class ClusterDescr:
                     )
 
                 schemas_type_set.add(schemas_descr.schemas_type)
-                schemas_list.append(schemas_descr)
+
+                if schemas_descr.materialized:
+                    schemas_map[schemas_descr.schemas_type] = schemas_descr
             elif settings_filt_func(file_path):
-                settings_file_path = os.path.realpath(os.path.join(
+                settings_file_path = self._load_utils.find_file(
                     file_path,
                     self._settings_descr_class.file_name,
-                ))
-
-                settings_descr = self._settings_descr_class()
+                )
 
                 try:
-                    settings_descr.load(settings_file_path, include_list,
-                            include_ref_map, settings_type=cluster_type)
+                    settings_descr = self._load_utils.load_descr(
+                        self._settings_descr_class(load_utils=self._load_utils),
+                        settings_file_path, include_list, include_ref_map,
+                        settings_type=cluster_type,
+                        type_set=type_set,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(settings_file_path, type(e), e)) from e
                 except OSError as e:
@@ -1254,7 +2154,9 @@ class ClusterDescr:
                     )
 
                 settings_type_set.add(settings_descr.settings_type)
-                settings_list.append(settings_descr)
+
+                if settings_descr.materialized:
+                    settings_map[settings_descr.settings_type] = settings_descr
             elif migrations_filt_func(file_path):
                 if migrations is not None:
                     raise ValueError(
@@ -1263,16 +2165,18 @@ class ClusterDescr:
                         ),
                     )
 
-                migrations_file_path = os.path.realpath(os.path.join(
+                migrations_file_path = self._load_utils.find_file(
                     file_path,
                     self._migrations_descr_class.file_name,
-                ))
-
-                migrations_descr = self._migrations_descr_class()
+                )
 
                 try:
-                    migrations_descr.load(migrations_file_path, include_list,
-                            include_ref_map, migrations_type=cluster_type)
+                    migrations_descr = self._load_utils.load_descr(
+                        self._migrations_descr_class(load_utils=self._load_utils),
+                        migrations_file_path, include_list, include_ref_map,
+                        migrations_type=cluster_type,
+                        type_set=type_set,
+                    )
                 except (LookupError, ValueError) as e:
                     raise ValueError('{!r}: {!r}: {}'.format(migrations_file_path, type(e), e)) from e
                 except OSError as e:
@@ -1291,19 +2195,29 @@ class ClusterDescr:
             else:
                 raise AssertionError
 
-        self.virtual_doc = virtual_doc
         self.cluster_file_path = cluster_file_path
         self.include_list = include_list
         self.application = application
         self.cluster_type = cluster_type
         self.revision = revision
         self.compatible_list = compatible_list
-        self.schemas_list = schemas_list
+        self.schemas_map = schemas_map
         self.migrations = migrations
-        self.settings_list = settings_list
+        self.settings_map = settings_map
+
+class HostsDescr(BaseDescr):
+    __slots__ = (
+        'hosts_file_path',
+        'host_list',
+        'host_map',
+        'shared',
+        '_shared_dump_map',
+    )
 
-class HostsDescr:
-    _load_utils = LoadUtils
+    def __init__(self, load_utils=None):
+        super().__init__(load_utils=load_utils)
+
+        self._shared_dump_map = {}
 
     def _open(self, hosts_file_path):
         return open(hosts_file_path, encoding='utf-8')
@@ -1324,7 +2238,7 @@ class HostsDescr:
             raise ValueError('not isinstance(hosts_elem, list)')
 
         host_list = []
-        host_name_set = set()
+        host_map = {}
         shared = None
 
         for host_elem in hosts_elem:
@@ -1364,7 +2278,7 @@ class HostsDescr:
             if host_params is not None and not isinstance(host_params, dict):
                 raise ValueError('not isinstance(host_params, dict)')
 
-            if host_name in host_name_set:
+            if host_name in host_map:
                 raise ValueError(
                     '{!r}, {!r}: non unique host_name'.format(
                         host_name,
@@ -1372,33 +2286,54 @@ class HostsDescr:
                     ),
                 )
 
-            host_name_set.add(host_name)
-            host_list.append({
+            host = {
                 'name': host_name,
                 'type': host_type,
                 'conninfo': host_conninfo,
                 'params': host_params,
-            })
+            }
+
+            host_list.append(host)
+            host_map[host_name] = host
 
         self.hosts_file_path = hosts_file_path
         self.host_list = host_list
+        self.host_map = host_map
         self.shared = shared
+        self._shared_dump_map.clear()
 
     def load_pseudo(self, cluster_descr):
         host_list = []
+        host_map = {}
 
-        for schemas in cluster_descr.schemas_list:
-            host_name = schemas.schemas_type
-
-            host_list.append({
+        for host_name in cluster_descr.schemas_map:
+            host = {
                 'name': host_name,
                 'type': host_name,
                 'conninfo': None,
                 'params': None,
-            })
+            }
+
+            host_list.append(host)
+            host_map[host_name] = host
 
         self.hosts_file_path = '<pseudo-hosts>'
         self.host_list = host_list
+        self.host_map = host_map
         self.shared = None
+        self._shared_dump_map.clear()
+
+    def dump_shared(self, json_dumps_func):
+        # ``shared`` is the same for every host, so it is dumped
+        # only once for every dumping function
+
+        try:
+            return self._shared_dump_map[json_dumps_func]
+        except KeyError:
+            pass
+
+        shared_dump = self._shared_dump_map[json_dumps_func] = json_dumps_func(self.shared)
+
+        return shared_dump
 
 # vi:ts=4:sw=4:et
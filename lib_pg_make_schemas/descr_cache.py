@@ -0,0 +1,328 @@
+import os, os.path
+import marshal
+from . import descr
+
+class DescrCache:
+    _format_version = 3
+
+    def __init__(self, cache_file_path):
+        self.cache_file_path = cache_file_path
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+        self._entry_map = {}
+        self._used_key_set = set()
+        self._changed = False
+
+    def load(self):
+        try:
+            with open(self.cache_file_path, 'rb') as fd:
+                doc = marshal.load(fd)
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, ValueError, TypeError):
+            # an unreadable cache is not an error. it will be rebuilt
+
+            self._changed = True
+
+            return
+
+        if not isinstance(doc, dict) or \
+                doc.get('version') != self._format_version or \
+                not isinstance(doc.get('entries'), dict):
+            self._changed = True
+
+            return
+
+        self._entry_map = doc['entries']
+
+    def save(self):
+        if not self._changed and self._used_key_set == self._entry_map.keys():
+            return
+
+        # the entries which are not used any more (including the entries
+        # of renamed or removed files) are not saved
+
+        doc = {
+            'version': self._format_version,
+            'entries': {
+                key: self._entry_map[key]
+                for key in self._used_key_set
+                if key in self._entry_map
+            },
+        }
+
+        tmp_file_path = '{}.{}.tmp'.format(self.cache_file_path, os.getpid())
+
+        fileno = os.open(tmp_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+
+        try:
+            with os.fdopen(fileno, 'wb') as fd:
+                marshal.dump(doc, fd)
+
+            os.replace(tmp_file_path, self.cache_file_path)
+        except:
+            try:
+                os.unlink(tmp_file_path)
+            except OSError:
+                pass
+
+            raise
+
+    def _use(self, key):
+        if key in self._used_key_set:
+            return
+
+        self._used_key_set.add(key)
+
+        entry = self._entry_map.get(key)
+
+        if entry is not None:
+            for child_key in entry[1]:
+                self._use(child_key)
+
+    def look(self, key, stat_func, decode_func):
+        entry = self._entry_map.get(key)
+
+        if entry is None:
+            self.miss_cnt += 1
+
+            return
+
+        dep_map, child_key_list, payload = entry
+
+        for path, stat_key in dep_map.items():
+            if stat_func(path) != stat_key:
+                self.miss_cnt += 1
+
+                return
+
+        try:
+            value = decode_func(payload)
+        except (LookupError, ValueError, TypeError):
+            # a descriptor class has been renamed or changed
+
+            self.miss_cnt += 1
+
+            return
+
+        self.hit_cnt += 1
+        self._use(key)
+
+        return dep_map, value
+
+    def put(self, key, dep_map, child_key_list, payload):
+        self._entry_map[key] = dep_map, child_key_list, payload
+        self._changed = True
+        self._use(key)
+
+class CachedLoadUtils(descr.LoadUtils):
+    def __init__(self, descr_cache, compiled_doc_path=None, jobs=None,
+            read_ahead=None, read_ahead_size=None, stream_size=None):
+        super().__init__(compiled_doc_path=compiled_doc_path, jobs=jobs,
+                read_ahead=read_ahead, read_ahead_size=read_ahead_size,
+                stream_size=stream_size)
+
+        self._descr_cache = descr_cache
+        self._stat_key_map = {}
+        self._descr_class_map = None
+        self._descr_attr_list_map = {}
+
+    def _get_frame_list(self):
+        # every loading thread has its own stack of the dependency frames.
+        # the frame of a descriptor loaded by another thread is merged to
+        # the parent frame when the parent takes the descriptor
+
+        try:
+            return self._local.frame_list
+        except AttributeError:
+            frame_list = self._local.frame_list = []
+
+            return frame_list
+
+    def _stat_key(self, path):
+        try:
+            return self._stat_key_map[path]
+        except KeyError:
+            pass
+
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except FileNotFoundError:
+            stat_key = None
+        else:
+            stat_key = st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns
+
+        self._stat_key_map[path] = stat_key
+
+        return stat_key
+
+    def _record(self, path):
+        # the stat is taken before the reading, so a change made
+        # during the reading is seen as a change by the next run
+
+        frame_list = self._get_frame_list()
+
+        if frame_list:
+            frame_list[-1][0][path] = self._stat_key(path)
+        else:
+            self._stat_key(path)
+
+    def _merge(self, key, dep_map):
+        frame_list = self._get_frame_list()
+
+        if frame_list:
+            parent_dep_map, parent_child_key_list = frame_list[-1]
+
+            parent_dep_map.update(dep_map)
+            parent_child_key_list.append(key)
+
+    def _get_descr_class_map(self):
+        if self._descr_class_map is None:
+            descr_class_map = {}
+            descr_class_list = [descr.BaseDescr]
+
+            while descr_class_list:
+                descr_class = descr_class_list.pop()
+
+                descr_class_map['{}.{}'.format(
+                    descr_class.__module__,
+                    descr_class.__qualname__,
+                )] = descr_class
+                descr_class_list.extend(descr_class.__subclasses__())
+
+            self._descr_class_map = descr_class_map
+
+        return self._descr_class_map
+
+    def _get_descr_attr_list(self, descr_class):
+        try:
+            return self._descr_attr_list_map[descr_class]
+        except KeyError:
+            pass
+
+        descr_attr_list = []
+
+        for mro_class in reversed(descr_class.__mro__):
+            slots = mro_class.__dict__.get('__slots__', ())
+
+            if isinstance(slots, str):
+                slots = slots,
+
+            descr_attr_list.extend(k for k in slots if not k.startswith('_'))
+
+        self._descr_attr_list_map[descr_class] = descr_attr_list
+
+        return descr_attr_list
+
+    def _encode(self, value):
+        if isinstance(value, descr.BaseDescr):
+            return 'descr', '{}.{}'.format(
+                type(value).__module__,
+                type(value).__qualname__,
+            ), {
+                k: self._encode(getattr(value, k))
+                for k in self._get_descr_attr_list(type(value))
+                if hasattr(value, k)
+            }
+
+        if isinstance(value, list):
+            return 'list', [self._encode(x) for x in value]
+
+        if isinstance(value, tuple):
+            return 'tuple', [self._encode(x) for x in value]
+
+        if isinstance(value, dict):
+            return 'dict', [(self._encode(k), self._encode(v)) for k, v in value.items()]
+
+        return 'value', value
+
+    def _decode(self, value):
+        value_kind = value[0]
+
+        if value_kind == 'descr':
+            descr_obj = self._get_descr_class_map()[value[1]](load_utils=self)
+
+            for k, v in value[2].items():
+                setattr(descr_obj, k, self._decode(v))
+
+            return descr_obj
+
+        if value_kind == 'list':
+            return [self._decode(x) for x in value[1]]
+
+        if value_kind == 'tuple':
+            return tuple(self._decode(x) for x in value[1])
+
+        if value_kind == 'dict':
+            return {self._decode(k): self._decode(v) for k, v in value[1]}
+
+        return value[1]
+
+    def load_doc(self, file_path, include_list):
+        self._record(file_path)
+
+        return super().load_doc(file_path, include_list)
+
+    def list_dir(self, path):
+        self._record(path)
+
+        return super().list_dir(path)
+
+    def find_file(self, dir_path, name):
+        # the listing of a directory also depends on what is inside of
+        # the listed directories (e.g. ``schema.yaml`` files)
+
+        if self.is_dir(dir_path):
+            self._record(dir_path)
+
+        return super().find_file(dir_path, name)
+
+    def _load_descr_task(self, descr_obj, file_path, include_list, include_ref_map, kwargs):
+        key = (
+            '{}.{}'.format(type(descr_obj).__module__, type(descr_obj).__qualname__),
+            file_path,
+            tuple(include_list),
+            tuple(sorted(include_ref_map.items())),
+            tuple(sorted(kwargs.items())),
+        )
+
+        with self._lock:
+            entry = self._descr_cache.look(key, self._stat_key, self._decode)
+
+        if entry is not None:
+            dep_map, descr_obj = entry
+
+            return key, dep_map, descr_obj
+
+        frame_list = self._get_frame_list()
+
+        frame_list.append(({}, []))
+
+        try:
+            descr_obj.load(file_path, include_list, include_ref_map, **kwargs)
+        finally:
+            dep_map, child_key_list = frame_list.pop()
+
+        payload = self._encode(descr_obj)
+
+        try:
+            marshal.dumps(payload)
+        except ValueError:
+            # something in the descriptor can not be cached (e.g. a strange
+            # yaml value in a virtual document), so it is loaded every time
+
+            pass
+        else:
+            with self._lock:
+                self._descr_cache.put(key, dep_map, child_key_list, payload)
+
+        return key, dep_map, descr_obj
+
+    def _finish_load_descr_task(self, result):
+        key, dep_map, descr_obj = result
+
+        self._merge(key, dep_map)
+
+        return descr_obj
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,60 @@
+import os, os.path
+import contextlib
+from . import verbose
+from . import stream_archive
+
+class ExportCmdError(Exception):
+    pass
+
+def export_cmd(args_ctx, print_func, err_print_func):
+    verb = verbose.make_verbose(print_func, err_print_func, args_ctx.verbose)
+
+    archive_path = os.path.realpath(args_ctx.archive)
+    output = args_ctx.output
+
+    if output is None:
+        if not archive_path.endswith('.archive'):
+            raise ExportCmdError(
+                '{!r}: unable to guess output prefix for archive without ``.archive`` suffix'.format(
+                    archive_path,
+                ),
+            )
+
+        output = archive_path[:-len('.archive')]
+
+    with contextlib.closing(stream_archive.ArchiveReader(archive_path)) as reader:
+        name_list = reader.name_list()
+
+        verb.prepare_export(archive_path, reader.complete)
+
+        if args_ctx.name_list is not None:
+            name_set = frozenset(name_list)
+
+            for name in args_ctx.name_list:
+                if name not in name_set:
+                    raise ExportCmdError('{!r}, {!r}: no such output file in archive'.format(
+                        name,
+                        archive_path,
+                    ))
+
+            name_list = args_ctx.name_list
+
+        for name in name_list:
+            if not name or os.sep in name or (os.altsep and os.altsep in name):
+                raise ExportCmdError('{!r}, {!r}: invalid name of output file'.format(
+                    name,
+                    archive_path,
+                ))
+
+            if args_ctx.list_only:
+                print_func(name)
+
+                continue
+
+            output_path = '{}.{}'.format(output, name)
+
+            verb.export_file(name, output_path)
+
+            reader.export(name, output_path)
+
+# vi:ts=4:sw=4:et
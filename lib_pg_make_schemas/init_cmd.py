@@ -2,9 +2,11 @@ import os, os.path
 import contextlib
 from . import verbose
 from . import descr
+from . import descr_cache
 from . import revision_sql
 from . import receivers
 from . import pg_role_path
+from . import render_cache
 from . import scr_env
 from . import init_sql
 
@@ -20,6 +22,42 @@ def init_cmd(args_ctx, print_func, err_print_func):
 
         hosts_descr.load(hosts_path)
 
+        # the descriptors of other host types are loaded as headers only
+
+        type_set = frozenset(host['type'] for host in hosts_descr.host_list)
+    else:
+        type_set = None
+
+    if args_ctx.compiled_descr is not None:
+        compiled_doc_path = os.path.realpath(args_ctx.compiled_descr)
+    else:
+        compiled_doc_path = None
+
+    if args_ctx.descr_cache is not None:
+        cache = descr_cache.DescrCache(os.path.realpath(args_ctx.descr_cache))
+
+        cache.load()
+
+        load_utils = descr_cache.CachedLoadUtils(
+            cache,
+            compiled_doc_path=compiled_doc_path,
+            jobs=args_ctx.load_jobs,
+            read_ahead=args_ctx.read_ahead,
+            read_ahead_size=args_ctx.read_ahead_size,
+            stream_size=args_ctx.stream_size,
+        )
+    else:
+        cache = None
+        load_utils = descr.LoadUtils(
+            compiled_doc_path=compiled_doc_path,
+            jobs=args_ctx.load_jobs,
+            read_ahead=args_ctx.read_ahead,
+            read_ahead_size=args_ctx.read_ahead_size,
+            stream_size=args_ctx.stream_size,
+        )
+
+    rend = render_cache.RenderCache(max_size=args_ctx.render_cache_size)
+
     include_list = []
     include_ref_map = {}
 
@@ -35,10 +73,16 @@ def init_cmd(args_ctx, print_func, err_print_func):
         descr.ClusterDescr.file_name,
     ))
     source_code_include_list = include_list + [os.path.dirname(source_code_file_path)]
-    source_code_cluster_descr = descr.ClusterDescr()
+    source_code_cluster_descr = load_utils.load_descr(
+        descr.ClusterDescr(load_utils=load_utils),
+        source_code_file_path, source_code_include_list, include_ref_map,
+        type_set=type_set,
+    )
+
+    if cache is not None:
+        cache.save()
 
-    source_code_cluster_descr.load(
-            source_code_file_path, source_code_include_list, include_ref_map)
+        verb.descr_cache(cache.cache_file_path, cache.hit_cnt, cache.miss_cnt)
 
     if args_ctx.hosts is None:
         hosts_descr.load_pseudo(source_code_cluster_descr)
@@ -51,11 +95,19 @@ def init_cmd(args_ctx, print_func, err_print_func):
         None,
     )
 
-    with contextlib.closing(
+    with contextlib.closing(load_utils), contextlib.closing(
                 receivers.Receivers(
                     args_ctx.execute,
                     args_ctx.pretend,
                     args_ctx.output,
+                    jobs=args_ctx.jobs,
+                    batch_size=args_ctx.batch_size,
+                    lazy_role_path=args_ctx.lazy_role_path,
+                    output_buffer_size=args_ctx.output_buffer_size,
+                    output_flush=args_ctx.output_flush,
+                    output_fsync=args_ctx.output_fsync,
+                    output_dedup=args_ctx.output_dedup,
+                    output_archive=args_ctx.output_archive,
                 ),
             ) as recv:
         for host in hosts_descr.host_list:
@@ -66,7 +118,7 @@ def init_cmd(args_ctx, print_func, err_print_func):
 
             recv.begin_host(hosts_descr, host)
 
-            recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+            recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
             verb.scr_env(host_name, recv.look_fragment_i(host_name))
 
@@ -77,21 +129,23 @@ def init_cmd(args_ctx, print_func, err_print_func):
             recv.execute(host_name, rev_sql.ensure_revision_structs(host_type))
 
             for i, sql in enumerate(
-                        init_sql.read_init_sql(source_code_cluster_descr, host_type),
+                        rend.render_sql(
+                            ('init_sql', source_code_cluster_descr, host_type),
+                            init_sql.read_init_sql(source_code_cluster_descr, host_type),
+                            None, None,
+                        ),
                     ):
                 if not i:
                     verb.execute_sql(
                             host_name, 'init_sql', recv.look_fragment_i(host_name))
 
-                sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                 verb.execute_sql(
                         host_name, 'init_sql', recv.look_fragment_i(host_name),
                         sql=sql)
 
                 recv.execute(host_name, sql)
 
-            recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+            recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
             verb.clean_scr_env(host_name, recv.look_fragment_i(host_name))
 
@@ -101,4 +155,8 @@ def init_cmd(args_ctx, print_func, err_print_func):
 
             recv.finish_host(hosts_descr, host)
 
+        recv.wait()
+
+        verb.render_cache(rend.hit_cnt, rend.miss_cnt)
+
 # vi:ts=4:sw=4:et
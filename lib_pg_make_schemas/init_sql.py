@@ -1,13 +1,14 @@
 def read_init_sql(cluster_descr, host_type):
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
 
-        init_descr = schemas_descr.init
+    if schemas_descr is None:
+        return
 
-        if init_descr is None:
-            continue
+    init_descr = schemas_descr.init
 
-        yield from init_descr.read_sql()
+    if init_descr is None:
+        return
+
+    yield from init_descr.read_sql()
 
 # vi:ts=4:sw=4:et
@@ -1,25 +1,17 @@
 def var_schemas(cluster_descr, host_type):
-    schemas = []
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
 
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    if schemas_descr is None:
+        return []
 
-        for schema_descr in schemas_descr.var_schema_list:
-            schemas.append(schema_descr.schema_name)
-
-    return schemas
+    return [schema_descr.schema_name for schema_descr in schemas_descr.var_schema_list]
 
 def func_schemas(cluster_descr, host_type):
-    schemas = []
-
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
 
-        for schema_descr in schemas_descr.func_schema_list:
-            schemas.append(schema_descr.schema_name)
+    if schemas_descr is None:
+        return []
 
-    return schemas
+    return [schema_descr.schema_name for schema_descr in schemas_descr.func_schema_list]
 
 # vi:ts=4:sw=4:et
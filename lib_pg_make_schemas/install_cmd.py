@@ -2,12 +2,14 @@ import os, os.path
 import contextlib
 from . import verbose
 from . import descr
+from . import descr_cache
 from . import revision_sql
 from . import comment
 from . import receivers
 from . import install
 from . import settings
 from . import pg_role_path
+from . import render_cache
 from . import scr_env
 from . import init_sql
 from . import install_sql
@@ -32,6 +34,42 @@ def install_cmd(args_ctx, print_func, err_print_func):
 
         hosts_descr.load(hosts_path)
 
+        # the descriptors of other host types are loaded as headers only
+
+        type_set = frozenset(host['type'] for host in hosts_descr.host_list)
+    else:
+        type_set = None
+
+    if args_ctx.compiled_descr is not None:
+        compiled_doc_path = os.path.realpath(args_ctx.compiled_descr)
+    else:
+        compiled_doc_path = None
+
+    if args_ctx.descr_cache is not None:
+        cache = descr_cache.DescrCache(os.path.realpath(args_ctx.descr_cache))
+
+        cache.load()
+
+        load_utils = descr_cache.CachedLoadUtils(
+            cache,
+            compiled_doc_path=compiled_doc_path,
+            jobs=args_ctx.load_jobs,
+            read_ahead=args_ctx.read_ahead,
+            read_ahead_size=args_ctx.read_ahead_size,
+            stream_size=args_ctx.stream_size,
+        )
+    else:
+        cache = None
+        load_utils = descr.LoadUtils(
+            compiled_doc_path=compiled_doc_path,
+            jobs=args_ctx.load_jobs,
+            read_ahead=args_ctx.read_ahead,
+            read_ahead_size=args_ctx.read_ahead_size,
+            stream_size=args_ctx.stream_size,
+        )
+
+    rend = render_cache.RenderCache(max_size=args_ctx.render_cache_size)
+
     include_list = []
     include_ref_map = {}
 
@@ -47,15 +85,19 @@ def install_cmd(args_ctx, print_func, err_print_func):
         descr.ClusterDescr.file_name,
     ))
     source_code_include_list = include_list + [os.path.dirname(source_code_file_path)]
-    source_code_cluster_descr = descr.ClusterDescr()
-
-    source_code_cluster_descr.load(
-            source_code_file_path, source_code_include_list, include_ref_map)
+    source_code_cluster_descr = load_utils.load_descr(
+        descr.ClusterDescr(load_utils=load_utils),
+        source_code_file_path, source_code_include_list, include_ref_map,
+        type_set=type_set,
+    )
 
     if args_ctx.hosts is None:
         hosts_descr.load_pseudo(source_code_cluster_descr)
 
-    rev_sql = revision_sql.RevisionSql(source_code_cluster_descr.application)
+    rev_sql = revision_sql.RevisionSql(
+        source_code_cluster_descr.application,
+        lock_budget=args_ctx.lock_budget,
+    )
 
     settings_cluster_descr_list = []
 
@@ -78,13 +120,13 @@ def install_cmd(args_ctx, print_func, err_print_func):
             descr.ClusterDescr.file_name,
         ))
         settings_include_list = include_list + [os.path.dirname(settings_file_path)]
-        settings_cluster_descr = descr.ClusterDescr()
-
-        settings_cluster_descr.load(
+        settings_cluster_descr = load_utils.load_descr(
+            descr.ClusterDescr(load_utils=load_utils),
             settings_file_path,
             settings_include_list,
             include_ref_map,
             settings_mode=True,
+            type_set=type_set,
         )
 
         settings.check_settings_compatibility(
@@ -94,17 +136,30 @@ def install_cmd(args_ctx, print_func, err_print_func):
 
         settings_cluster_descr_list.append(settings_cluster_descr)
 
+    if cache is not None:
+        cache.save()
+
+        verb.descr_cache(cache.cache_file_path, cache.hit_cnt, cache.miss_cnt)
+
     verb.source_code_revision(
         source_code_cluster_descr.application,
         source_code_cluster_descr.revision,
         com,
     )
 
-    with contextlib.closing(
+    with contextlib.closing(load_utils), contextlib.closing(
                 receivers.Receivers(
                     args_ctx.execute,
                     args_ctx.pretend,
                     args_ctx.output,
+                    jobs=args_ctx.jobs,
+                    batch_size=args_ctx.batch_size,
+                    lazy_role_path=args_ctx.lazy_role_path,
+                    output_buffer_size=args_ctx.output_buffer_size,
+                    output_flush=args_ctx.output_flush,
+                    output_fsync=args_ctx.output_fsync,
+                    output_dedup=args_ctx.output_dedup,
+                    output_archive=args_ctx.output_archive,
                 ),
             ) as recv:
         recv.begin(hosts_descr, begin_host_verb_func=verb.begin_host)
@@ -116,7 +171,7 @@ def install_cmd(args_ctx, print_func, err_print_func):
             var_schemas = install.var_schemas(source_code_cluster_descr, host_type)
             func_schemas = install.func_schemas(source_code_cluster_descr, host_type)
 
-            recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+            recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
             verb.scr_env(host_name, recv.look_fragment_i(host_name))
 
@@ -154,24 +209,30 @@ def install_cmd(args_ctx, print_func, err_print_func):
 
             recv.execute(host_name, rev_sql.guard_func_revision(host_type, None))
 
+        recv.wait()
+
         if args_ctx.init:
             for host in hosts_descr.host_list:
                 host_name = host['name']
                 host_type = host['type']
 
                 for i, sql in enumerate(
-                            init_sql.read_init_sql(source_code_cluster_descr, host_type),
+                            rend.render_sql(
+                                ('init_sql', source_code_cluster_descr, host_type),
+                                init_sql.read_init_sql(source_code_cluster_descr, host_type),
+                                None, None,
+                            ),
                         ):
                     if not i:
                         verb.execute_sql(host_name, 'init_sql', recv.look_fragment_i(host_name))
 
-                    sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                     verb.execute_sql(host_name, 'init_sql', recv.look_fragment_i(host_name),
                             sql=sql)
 
                     recv.execute(host_name, sql)
 
+            recv.wait()
+
         if not args_ctx.reinstall_func:
             for host in hosts_descr.host_list:
                 host_name = host['name']
@@ -179,7 +240,7 @@ def install_cmd(args_ctx, print_func, err_print_func):
 
                 for schema_name, owner, grant_list, sql_iter in \
                         install_sql.read_var_install_sql(source_code_cluster_descr, host_type):
-                    recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+                    recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
                     verb.create_schema(host_name, schema_name, recv.look_fragment_i(host_name))
 
@@ -188,13 +249,17 @@ def install_cmd(args_ctx, print_func, err_print_func):
                         install_sql.create_schema(schema_name, owner, grant_list),
                     )
 
-                    for i, sql in enumerate(sql_iter):
+                    for i, sql in enumerate(
+                                rend.render_sql(
+                                    ('var_install_sql', source_code_cluster_descr, host_type, schema_name),
+                                    sql_iter,
+                                    owner, schema_name,
+                                ),
+                            ):
                         if not i:
                             verb.execute_sql(
                                     host_name, 'var_install_sql', recv.look_fragment_i(host_name))
 
-                        sql = pg_role_path.apply_pg_role_path(sql, owner, schema_name)
-
                         verb.execute_sql(
                                 host_name, 'var_install_sql', recv.look_fragment_i(host_name),
                                 sql=sql)
@@ -202,47 +267,55 @@ def install_cmd(args_ctx, print_func, err_print_func):
                         recv.execute(host_name, sql)
 
                 for i, sql in enumerate(
-                            install_sql.read_late_sql(source_code_cluster_descr, host_type),
+                            rend.render_sql(
+                                ('late_install_sql', source_code_cluster_descr, host_type),
+                                install_sql.read_late_sql(source_code_cluster_descr, host_type),
+                                None, None,
+                            ),
                         ):
                     if not i:
                         verb.execute_sql(
                                 host_name, 'late_install_sql', recv.look_fragment_i(host_name))
 
-                    sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                     verb.execute_sql(
                             host_name, 'late_install_sql', recv.look_fragment_i(host_name),
                             sql=sql)
 
                     recv.execute(host_name, sql)
 
+            recv.wait()
+
         for settings_cluster_descr in settings_cluster_descr_list:
             for host in hosts_descr.host_list:
                 host_name = host['name']
                 host_type = host['type']
 
                 for i, sql in enumerate(
-                            settings_sql.read_settings_sql(settings_cluster_descr, host_type),
+                            rend.render_sql(
+                                ('settings_sql', settings_cluster_descr, host_type),
+                                settings_sql.read_settings_sql(settings_cluster_descr, host_type),
+                                None, None,
+                            ),
                         ):
                     if not i:
                         verb.execute_sql(
                                 host_name, 'settings_sql', recv.look_fragment_i(host_name))
 
-                    sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                     verb.execute_sql(
                             host_name, 'settings_sql', recv.look_fragment_i(host_name),
                             sql=sql)
 
                     recv.execute(host_name, sql)
 
+            recv.wait()
+
         for host in hosts_descr.host_list:
             host_name = host['name']
             host_type = host['type']
 
             for schema_name, owner, grant_list, sql_iter in \
                     install_sql.read_func_install_sql(source_code_cluster_descr, host_type):
-                recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+                recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
                 verb.create_schema(host_name, schema_name, recv.look_fragment_i(host_name))
 
@@ -251,38 +324,48 @@ def install_cmd(args_ctx, print_func, err_print_func):
                     install_sql.create_schema(schema_name, owner, grant_list),
                 )
 
-                for i, sql in enumerate(sql_iter):
+                for i, sql in enumerate(
+                            rend.render_sql(
+                                ('func_install_sql', source_code_cluster_descr, host_type, schema_name),
+                                sql_iter,
+                                owner, schema_name,
+                            ),
+                        ):
                     if not i:
                         verb.execute_sql(
                                 host_name, 'func_install_sql', recv.look_fragment_i(host_name))
 
-                    sql = pg_role_path.apply_pg_role_path(sql, owner, schema_name)
-
                     verb.execute_sql(
                             host_name, 'func_install_sql', recv.look_fragment_i(host_name),
                             sql=sql)
 
                     recv.execute(host_name, sql)
 
+        recv.wait()
+
         for host in hosts_descr.host_list:
             host_name = host['name']
             host_type = host['type']
 
             for i, sql in enumerate(
-                        safeguard_sql.read_safeguard_sql(source_code_cluster_descr, host_type),
+                        rend.render_sql(
+                            ('safeguard_sql', source_code_cluster_descr, host_type),
+                            safeguard_sql.read_safeguard_sql(source_code_cluster_descr, host_type),
+                            None, None,
+                        ),
                     ):
                 if not i:
                     verb.execute_sql(
                             host_name, 'safeguard_sql', recv.look_fragment_i(host_name))
 
-                sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                 verb.execute_sql(
                         host_name, 'safeguard_sql', recv.look_fragment_i(host_name),
                         sql=sql)
 
                 recv.execute(host_name, sql)
 
+        recv.wait()
+
         for host in hosts_descr.host_list:
             host_name = host['name']
             host_type = host['type']
@@ -290,29 +373,26 @@ def install_cmd(args_ctx, print_func, err_print_func):
             var_schemas = install.var_schemas(source_code_cluster_descr, host_type)
             func_schemas = install.func_schemas(source_code_cluster_descr, host_type)
 
-            recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+            recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
+
+            schema_acl_list = []
 
             if not args_ctx.reinstall_func:
                 for schema_name, owner, grant_list, sql_iter in \
                         install_sql.read_var_install_sql(source_code_cluster_descr, host_type):
-                    verb.guard_acls(host_name, schema_name,
-                            args_ctx.weak_guard_acls, recv.look_fragment_i(host_name))
-
-                    recv.execute(
-                        host_name,
-                        install_sql.guard_acls(schema_name, owner, grant_list,
-                                args_ctx.weak_guard_acls),
-                    )
+                    schema_acl_list.append((schema_name, owner, grant_list))
 
             for schema_name, owner, grant_list, sql_iter in \
                     install_sql.read_func_install_sql(source_code_cluster_descr, host_type):
-                verb.guard_acls(host_name, schema_name,
+                schema_acl_list.append((schema_name, owner, grant_list))
+
+            if schema_acl_list:
+                verb.guard_acls(host_name, [x[0] for x in schema_acl_list],
                         args_ctx.weak_guard_acls, recv.look_fragment_i(host_name))
 
                 recv.execute(
                     host_name,
-                    install_sql.guard_acls(schema_name, owner, grant_list,
-                            args_ctx.weak_guard_acls),
+                    install_sql.guard_acls(schema_acl_list, args_ctx.weak_guard_acls),
                 )
 
             if not args_ctx.reinstall_func:
@@ -338,4 +418,6 @@ def install_cmd(args_ctx, print_func, err_print_func):
 
         recv.finish(hosts_descr, finish_host_verb_func=verb.finish_host)
 
+        verb.render_cache(rend.hit_cnt, rend.miss_cnt)
+
 # vi:ts=4:sw=4:et
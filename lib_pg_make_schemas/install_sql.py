@@ -2,93 +2,96 @@ from . import pg_literal
 
 GUARD_ACLS_SQL = '''\
 declare
-_create_list text[] := {q_create_list}::text[];
-_usage_list text[] := {q_usage_list}::text[];
-_grantor text;
-_grantee text;
-_privilege_type text;
-_is_grantable boolean;
+_schema text;
+_unexpected_list text[];
+_missing_list text[];
 begin
-perform 1 from pg_namespace ns
-where ns.nspname = {q_schema} and ns.nspacl is null;
-if found then
-execute format ($revoke$revoke all on schema %I from public$revoke$, {q_schema});
-end if;
-for _grantor, _grantee, _privilege_type, _is_grantable in
-select case when acl.grantor = 0 then 'public'
-else (select r.rolname from pg_roles r where oid = acl.grantor) end grantor,
-case when acl.grantee = 0 then 'public'
-else (select r.rolname from pg_roles r where oid = acl.grantee) end grantee,
-acl.privilege_type,
-acl.is_grantable
-from (
-select (aclexplode (ns.nspacl)).*
+for _schema in
+select ns.nspname
 from pg_namespace ns
-where ns.nspname = {q_schema}
-) acl
+where ns.nspname = any ({q_schema_list}::text[]) and ns.nspacl is null
 loop
-if _grantor = {q_owner} and _grantee = any ({q_create_list}::text[])
-and _privilege_type = 'CREATE' and _is_grantable = false then
-_create_list := array_remove (_create_list, _grantee);
-elsif _grantor = {q_owner} and _grantee = any ({q_usage_list}::text[])
-and _privilege_type = 'USAGE' and _is_grantable = false then
-_usage_list := array_remove (_usage_list, _grantee);
-elsif {q_weak} then
-raise notice 'unexpected acl: % % % % %',
-quote_nullable ({q_schema}), quote_nullable (_grantor), quote_nullable (_grantee),
-quote_nullable (_privilege_type), quote_nullable (_is_grantable);
-else
-raise 'unexpected acl: % % % % %',
-quote_nullable ({q_schema}), quote_nullable (_grantor), quote_nullable (_grantee),
-quote_nullable (_privilege_type), quote_nullable (_is_grantable);
-end if;
+execute format ($revoke$revoke all on schema %I from public$revoke$, _schema);
 end loop;
-if not array_length (_create_list, 1) is null then
-raise 'missing create acls: % %', quote_nullable ({q_schema}), quote_nullable (_create_list);
+with expected_acl (schema_name, grantor, grantee, privilege_type, is_grantable) as (
+select distinct * from (values {q_expected_acl_list}
+) v
+), actual_acl as (
+select ns.nspname::text schema_name,
+case when acl.grantor = 0 then 'public' else gr.rolname::text end grantor,
+case when acl.grantee = 0 then 'public' else ge.rolname::text end grantee,
+acl.privilege_type,
+acl.is_grantable
+from pg_namespace ns
+cross join lateral aclexplode (ns.nspacl) acl
+left join pg_roles gr on gr.oid = acl.grantor
+left join pg_roles ge on ge.oid = acl.grantee
+where ns.nspname = any ({q_schema_list}::text[])
+)
+select array_agg (format ('%s %s %s %s %s',
+quote_nullable (a.schema_name), quote_nullable (a.grantor), quote_nullable (a.grantee),
+quote_nullable (a.privilege_type), quote_nullable (a.is_grantable)))
+filter (where e.schema_name is null),
+array_agg (format ('%s %s %s',
+quote_nullable (e.schema_name), quote_nullable (e.privilege_type), quote_nullable (e.grantee)))
+filter (where a.schema_name is null)
+into _unexpected_list, _missing_list
+from actual_acl a
+full join expected_acl e on a.schema_name = e.schema_name and a.grantor = e.grantor
+and a.grantee = e.grantee and a.privilege_type = e.privilege_type
+and a.is_grantable = e.is_grantable;
+if {q_weak} and _unexpected_list is not null then
+raise notice 'unexpected acls: %', array_to_string (_unexpected_list, ', ');
+_unexpected_list := null;
 end if;
-if not array_length (_usage_list, 1) is null then
-raise 'missing usage acls: % %', quote_nullable ({q_schema}), quote_nullable (_usage_list);
+if _unexpected_list is not null or _missing_list is not null then
+raise '%', concat_ws ('; ',
+'unexpected acls: ' || array_to_string (_unexpected_list, ', '),
+'missing acls: ' || array_to_string (_missing_list, ', '));
 end if;
 end\
 '''
 
 def read_var_install_sql(cluster_descr, host_type):
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
 
-        for schema_descr in schemas_descr.var_schema_list:
-            schema_name = schema_descr.schema_name
-            owner = schema_descr.owner
-            grant_list = schema_descr.grant_list
-            sql_iter = schema_descr.read_sql()
+    if schemas_descr is None:
+        return
 
-            yield schema_name, owner, grant_list, sql_iter
+    for schema_descr in schemas_descr.var_schema_list:
+        schema_name = schema_descr.schema_name
+        owner = schema_descr.owner
+        grant_list = schema_descr.grant_list
+        sql_iter = schema_descr.read_sql()
+
+        yield schema_name, owner, grant_list, sql_iter
 
 def read_late_sql(cluster_descr, host_type):
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
+
+    if schemas_descr is None:
+        return
 
-        late_descr = schemas_descr.late
+    late_descr = schemas_descr.late
 
-        if late_descr is None:
-            continue
+    if late_descr is None:
+        return
 
-        yield from late_descr.read_sql()
+    yield from late_descr.read_sql()
 
 def read_func_install_sql(cluster_descr, host_type):
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
 
-        for schema_descr in schemas_descr.func_schema_list:
-            schema_name = schema_descr.schema_name
-            owner = schema_descr.owner
-            grant_list = schema_descr.grant_list
-            sql_iter = schema_descr.read_sql()
+    if schemas_descr is None:
+        return
 
-            yield schema_name, owner, grant_list, sql_iter
+    for schema_descr in schemas_descr.func_schema_list:
+        schema_name = schema_descr.schema_name
+        owner = schema_descr.owner
+        grant_list = schema_descr.grant_list
+        sql_iter = schema_descr.read_sql()
+
+        yield schema_name, owner, grant_list, sql_iter
 
 def create_schema(
             schema_name,
@@ -121,38 +124,52 @@ def create_schema(
     return '\n'.join(sql_list)
 
 def guard_acls(
-            schema_name,
-            owner,
-            grant_list,
+            schema_acl_list,
             weak,
             guard_acls_sql=GUARD_ACLS_SQL,
             pg_quote_func=pg_literal.pg_quote,
             pg_dollar_quote_func=pg_literal.pg_dollar_quote,
         ):
-    create_list = [owner]
-
-    if grant_list is not None:
-        usage_list = [owner] + grant_list
-    else:
-        usage_list = [owner]
-
-    q_create_list = 'array[{}\n]'.format(
-        ','.join('\n{}'.format(pg_quote_func(x)) for x in create_list),
-    )
-    q_usage_list = 'array[{}\n]'.format(
-        ','.join('\n{}'.format(pg_quote_func(x)) for x in usage_list),
+    schema_name_list = []
+    expected_acl_list = []
+
+    for schema_name, owner, grant_list in schema_acl_list:
+        create_list = [owner]
+
+        if grant_list is not None:
+            usage_list = [owner] + grant_list
+        else:
+            usage_list = [owner]
+
+        schema_name_list.append(schema_name)
+
+        for privilege_type, grantee_list in (
+                    ('CREATE', create_list),
+                    ('USAGE', usage_list),
+                ):
+            for grantee in grantee_list:
+                expected_acl_list.append(
+                    '({}, {}, {}, {}, false)'.format(
+                        pg_quote_func(schema_name),
+                        pg_quote_func(owner),
+                        pg_quote_func(grantee),
+                        pg_quote_func(privilege_type),
+                    ),
+                )
+
+    q_schema_list = 'array[{}\n]'.format(
+        ','.join('\n{}'.format(pg_quote_func(x)) for x in schema_name_list),
     )
+    q_expected_acl_list = ','.join('\n{}'.format(x) for x in expected_acl_list)
 
     q_weak = pg_quote_func('true') if weak else pg_quote_func('false')
 
-    drop_schemas_body = guard_acls_sql.format(
-        q_schema=pg_quote_func(schema_name),
-        q_owner=pg_quote_func(owner),
-        q_create_list=q_create_list,
-        q_usage_list=q_usage_list,
+    guard_acls_body = guard_acls_sql.format(
+        q_schema_list=q_schema_list,
+        q_expected_acl_list=q_expected_acl_list,
         q_weak=q_weak,
     )
 
-    return 'do {};'.format(pg_dollar_quote_func('do', drop_schemas_body))
+    return 'do {};'.format(pg_dollar_quote_func('do', guard_acls_body))
 
 # vi:ts=4:sw=4:et
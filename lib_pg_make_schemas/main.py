@@ -20,6 +20,11 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
     upgrade_cmd.upgrade_cmd(args_ctx, print_func, err_print_func)
 
+def export_cmd(args_ctx, print_func, err_print_func):
+    from . import export_cmd
+
+    export_cmd.export_cmd(args_ctx, print_func, err_print_func)
+
 def try_print(*args, **kwargs):
     kwargs.setdefault('flush', True)
 
@@ -67,6 +72,13 @@ def main():
         description='upgrading schemas from one of previous revisions',
     )
 
+    export_parser = subparsers.add_parser(
+        'export',
+        help='write output SQL (and notices) files from an output archive',
+        description='write output SQL (and notices) files from an output archive. '
+                'see ``--output-archive`` option',
+    )
+
     for sub_parser in (init_parser, install_parser, upgrade_parser):
         sub_parser.add_argument(
             '-v',
@@ -104,6 +116,151 @@ def main():
                     'the output code is less smart and it can be more dangerous',
         )
 
+        sub_parser.add_argument(
+            '--output-buffer-size',
+            type=int,
+            default=1024,
+            help='size in KiB of the buffer of every output SQL (and notices) file. '
+                    'the files are written by background threads when the buffer '
+                    'is full or once a second. it does not apply to ``--output-dedup`` option. '
+                    'by default it is 1024',
+        )
+
+        sub_parser.add_argument(
+            '--output-flush',
+            action='store_true',
+            help='flush output SQL (and notices) files after every fragment. '
+                    'it does not apply to ``--output-dedup`` option, which writes '
+                    'the fragments when they are cut and output SQL files when their host is finished. '
+                    'by default they are flushed by size and time only',
+        )
+
+        sub_parser.add_argument(
+            '--output-fsync',
+            action='store_true',
+            help='fsync every output SQL (and notices) file when its host is finished. '
+                    'with ``--output-dedup`` option every new fragment is synced too. '
+                    'by default the files are not synced',
+        )
+
+        output_mode_group = sub_parser.add_mutually_exclusive_group()
+
+        output_mode_group.add_argument(
+            '--output-dedup',
+            action='store_true',
+            help='keep every distinct fragment only once, in ``<prefix>.objects`` '
+                    'directory under the name of its content hash, and make output SQL files '
+                    'small manifests which include the fragments by psql\'s ``\\ir``. '
+                    'the existing fragments and the unchanged manifests are not rewritten. '
+                    'the fragments of the previous runs are not removed',
+        )
+
+        output_mode_group.add_argument(
+            '--output-archive',
+            action='store_true',
+            help='write all output SQL (and notices) files into one append-only '
+                    '``<prefix>.archive`` file instead of a file per host, so '
+                    'the number of open files does not grow with the number of hosts. '
+                    'use ``export`` command to get the files from the archive',
+        )
+
+        del output_mode_group
+
+        sub_parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            help='number of hosts which are served concurrently. '
+                    'every host still gets its fragments in the same order and '
+                    'the phases still go one after another for all hosts. '
+                    'by default hosts are served one at a time',
+        )
+
+        sub_parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            help='join consecutive fragments into one multi-statement query '
+                    'of about this size (in characters) to save round trips. '
+                    'a failed query is undone and its fragments are repeated '
+                    'one by one to show the failed fragment. '
+                    'by default every fragment is sent alone',
+        )
+
+        sub_parser.add_argument(
+            '--lazy-role-path',
+            action='store_true',
+            help='skip setting role, search_path and check_function_bodies '
+                    'when they are the same as for the previous script. '
+                    'warning(!) make sure your scripts do not change these settings '
+                    'by themselves',
+        )
+
+        sub_parser.add_argument(
+            '--render-cache-size',
+            type=int,
+            default=64,
+            help='size in MiB of the rendered SQL which is kept for the next hosts '
+                    'of the same type, so the SQL files are read once for all such hosts. '
+                    'the least recently used SQL is dropped when the size is exceeded. '
+                    '``0`` disables this cache. '
+                    'by default it is 64',
+        )
+
+        sub_parser.add_argument(
+            '--descr-cache',
+            help='path to a descriptor cache file. the parsed yaml files and '
+                    'the directory listings of source code are kept there '
+                    'and are used again while the files and directories are unchanged. '
+                    'the file is created when it does not exist',
+        )
+
+        sub_parser.add_argument(
+            '--compiled-descr',
+            help='path to a directory of compiled yaml files. every parsed yaml file '
+                    'of source code is kept there as a json file named by the sha256 '
+                    'of its content, and the json file is used instead of parsing '
+                    'the same content again. the directory is created when it does not exist. '
+                    'the source code directories are never written',
+        )
+
+        sub_parser.add_argument(
+            '--load-jobs',
+            type=int,
+            help='number of threads which load the sibling descriptors of source code '
+                    'concurrently (and the number of processes which parse yaml files). '
+                    'the descriptors are still taken in the same order, so the result '
+                    'and the errors are the same. '
+                    'by default source code is loaded by one thread',
+        )
+
+        sub_parser.add_argument(
+            '--read-ahead',
+            type=int,
+            help='number of the next SQL files of source code which are read by '
+                    'the background threads while the current SQL is executed. '
+                    'by default every SQL file is read right before it is used',
+        )
+
+        sub_parser.add_argument(
+            '--read-ahead-size',
+            type=int,
+            default=16,
+            help='size in MiB of the read ahead SQL which is not used yet. '
+                    'no more files are read ahead while it is exceeded. '
+                    'by default it is 16',
+        )
+
+        sub_parser.add_argument(
+            '--stream-size',
+            type=int,
+            default=64,
+            help='size in MiB of SQL files which are not read into memory as a whole. '
+                    'such a file is read and executed by pieces of whole statements '
+                    '(the dollar quotes, the comments and the literals are respected). '
+                    '``0`` disables it. by default it is 64',
+        )
+
         sub_parser.add_argument(
             '-i',
             '--include',
@@ -160,6 +317,17 @@ def main():
                     'you understand what you do and understand possible consequences'
         )
 
+        sub_parser.add_argument(
+            '--lock-budget',
+            type=int,
+            help='refuse dropping schemas when the locks held by all sessions '
+                    'together with the estimated locks for dropping would exceed this number. '
+                    'the estimate is a lower bound, it counts the objects of the schemas '
+                    'and their direct dependents only. '
+                    'by default it is the size of the shared lock table, i.e. '
+                    '``max_locks_per_transaction * (max_connections + max_prepared_transactions)``',
+        )
+
         sub_parser.add_argument(
             '-A',
             '--weak-acls',
@@ -231,6 +399,41 @@ def main():
 
         del arg_help
 
+    export_parser.add_argument(
+        '-v',
+        '--verbose',
+        action='count',
+        help='be verbose. there will be every exported file shown',
+    )
+
+    export_parser.add_argument(
+        '-o',
+        '--output',
+        help='prefix to output SQL files. '
+                'by default it is the path to the archive without ``.archive`` suffix',
+    )
+
+    export_parser.add_argument(
+        '-n',
+        '--name',
+        action='append',
+        help='export only this file, e.g. ``<host>.<type>.sql``. '
+                'you can use this option many times. '
+                'by default all files of the archive are exported',
+    )
+
+    export_parser.add_argument(
+        '-l',
+        '--list',
+        action='store_true',
+        help='do nothing except showing names of files in the archive',
+    )
+
+    export_parser.add_argument(
+        'archive',
+        help='path to the output archive',
+    )
+
     args = parser.parse_args()
 
     if args.command is None:
@@ -242,12 +445,40 @@ def main():
 
     args_ctx.command = args.command
 
+    if args.command in ('init', 'install', 'upgrade') and args.output is None:
+        if args.output_dedup:
+            subparsers.choices[args.command].error('argument --output-dedup: requires --output')
+
+        if args.output_archive:
+            subparsers.choices[args.command].error('argument --output-archive: requires --output')
+
+    if args.command in ('init', 'install', 'upgrade') and args.output_buffer_size < 1:
+        subparsers.choices[args.command].error('argument --output-buffer-size: must be at least 1')
+
+    if args.command in ('init', 'install', 'upgrade') and args.render_cache_size < 0:
+        subparsers.choices[args.command].error('argument --render-cache-size: must not be negative')
+
     if args_ctx.command in ('init', 'install', 'upgrade'):
         args_ctx.verbose = args.verbose
         args_ctx.execute = args.execute
         args_ctx.pretend = args.pretend
         args_ctx.output = args.output
         args_ctx.hosts = args.hosts
+        args_ctx.jobs = args.jobs
+        args_ctx.batch_size = args.batch_size
+        args_ctx.lazy_role_path = args.lazy_role_path
+        args_ctx.output_buffer_size = args.output_buffer_size * 1024
+        args_ctx.output_flush = args.output_flush
+        args_ctx.output_fsync = args.output_fsync
+        args_ctx.output_dedup = args.output_dedup
+        args_ctx.output_archive = args.output_archive
+        args_ctx.descr_cache = args.descr_cache
+        args_ctx.compiled_descr = args.compiled_descr
+        args_ctx.load_jobs = args.load_jobs
+        args_ctx.render_cache_size = args.render_cache_size * 1024 * 1024
+        args_ctx.read_ahead = args.read_ahead
+        args_ctx.read_ahead_size = args.read_ahead_size * 1024 * 1024
+        args_ctx.stream_size = args.stream_size * 1024 * 1024
 
         if args_ctx.pretend or args_ctx.output is None:
             args_ctx.execute = True
@@ -260,6 +491,21 @@ def main():
         args_ctx.pretend = False
         args_ctx.output = None
         args_ctx.hosts = None
+        args_ctx.jobs = None
+        args_ctx.batch_size = None
+        args_ctx.lazy_role_path = False
+        args_ctx.output_buffer_size = None
+        args_ctx.output_flush = False
+        args_ctx.output_fsync = False
+        args_ctx.output_dedup = False
+        args_ctx.output_archive = False
+        args_ctx.descr_cache = None
+        args_ctx.compiled_descr = None
+        args_ctx.load_jobs = None
+        args_ctx.render_cache_size = None
+        args_ctx.read_ahead = None
+        args_ctx.read_ahead_size = None
+        args_ctx.stream_size = None
 
     args_ctx.include_list = []
     args_ctx.include_ref_map = {}
@@ -291,6 +537,7 @@ def main():
         args_ctx.init = args.init
         args_ctx.cascade = args.cascade
         args_ctx.weak_guard_acls = args.weak_acls
+        args_ctx.lock_budget = args.lock_budget
 
         args_ctx.comment_path = os.environ.get('PG_MAKE_SCHEMAS_COMMENT')
 
@@ -301,8 +548,20 @@ def main():
         args_ctx.init = False
         args_ctx.cascade = None
         args_ctx.weak_guard_acls = None
+        args_ctx.lock_budget = None
         args_ctx.comment_path = None
 
+    if args_ctx.command == 'export':
+        args_ctx.verbose = args.verbose
+        args_ctx.output = args.output
+        args_ctx.archive = args.archive
+        args_ctx.name_list = args.name
+        args_ctx.list_only = args.list
+    else:
+        args_ctx.archive = None
+        args_ctx.name_list = None
+        args_ctx.list_only = False
+
     if args_ctx.command == 'upgrade':
         args_ctx.show_rev = args.show_rev
         args_ctx.change_rev = args.change_rev
@@ -326,6 +585,7 @@ def main():
         'init': init_cmd,
         'install': install_cmd,
         'upgrade': upgrade_cmd,
+        'export': export_cmd,
     }
 
     cmd_func = cmd_func_map[args_ctx.command]
@@ -0,0 +1,268 @@
+import os, os.path
+import hashlib
+import itertools
+import threading
+import zlib
+
+_tmp_file_cnt = itertools.count()
+
+def _tmp_file_path(file_path):
+    # every call gets its own name, even on the same thread
+
+    return '{}.{}.{}.tmp'.format(file_path, os.getpid(), next(_tmp_file_cnt))
+
+def _fsync_dir(dir_path):
+    # a replaced file is durable only when its directory entry is synced too
+
+    fd = os.open(dir_path, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class _ObjectBuilder:
+    # an object which is being written. its data is kept in memory until
+    # it becomes large (e.g. a streamed file), then it goes to a temporary
+    # file, because the name of the object is not known yet
+
+    def __init__(self, store):
+        self._store = store
+        self._hash = hashlib.sha256()
+        self._data_list = []
+        self._spill_fd = None
+        self._spill_file_path = None
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+
+        if self._spill_fd is not None:
+            self._spill_fd.write(data)
+
+            return
+
+        self._data_list.append(data)
+
+        if self.size > self._store.spill_size:
+            os.makedirs(self._store.store_path, exist_ok=True)
+
+            # the builders of all hosts are open at the same time on the same
+            # thread, so every spill file is created with its own unique name
+
+            self._spill_file_path = _tmp_file_path(os.path.join(self._store.store_path, 'spill'))
+            self._spill_fd = open(self._spill_file_path, 'xb')
+
+            for spill_data in self._data_list:
+                self._spill_fd.write(spill_data)
+
+            self._data_list = None
+
+    def discard(self):
+        if self._spill_fd is not None:
+            self._spill_fd.close()
+            self._spill_fd = None
+
+        if self._spill_file_path is not None:
+            try:
+                os.unlink(self._spill_file_path)
+            except OSError:
+                pass
+
+            self._spill_file_path = None
+
+    def finish(self):
+        object_path = self._store.object_path(self._hash.hexdigest())
+
+        try:
+            if os.path.exists(object_path):
+                self._store.count(False)
+
+                return object_path
+
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+
+            if self._spill_fd is not None:
+                if self._store.durable:
+                    self._spill_fd.flush()
+                    os.fsync(self._spill_fd.fileno())
+
+                self._spill_fd.close()
+                self._spill_fd = None
+
+                os.replace(self._spill_file_path, object_path)
+                self._spill_file_path = None
+            else:
+                tmp_file_path = _tmp_file_path(object_path)
+
+                try:
+                    with open(tmp_file_path, 'wb') as fd:
+                        for data in self._data_list:
+                            fd.write(data)
+
+                        if self._store.durable:
+                            fd.flush()
+                            os.fsync(fd.fileno())
+
+                    os.replace(tmp_file_path, object_path)
+                except:
+                    try:
+                        os.unlink(tmp_file_path)
+                    except OSError:
+                        pass
+
+                    raise
+
+            if self._store.durable:
+                _fsync_dir(os.path.dirname(object_path))
+
+            self._store.count(True)
+
+            return object_path
+        finally:
+            self.discard()
+
+class ContentStore:
+    # the objects are named by the sha256 of their content, so an object
+    # is kept only once for all hosts, and an existing object (e.g. from
+    # the last run) is never written again. ``durable`` makes every new
+    # object fsynced before it gets its name
+
+    spill_size = 16 * 1024 * 1024
+
+    def __init__(self, store_path, durable=None):
+        if durable is None:
+            durable = False
+
+        self.store_path = store_path
+        self.durable = durable
+        self.new_cnt = 0
+        self.reuse_cnt = 0
+        self._lock = threading.Lock()
+
+    def object_path(self, content_hash):
+        return os.path.join(self.store_path, content_hash[:2], '{}.sql'.format(content_hash))
+
+    def count(self, new):
+        with self._lock:
+            if new:
+                self.new_cnt += 1
+            else:
+                self.reuse_cnt += 1
+
+    def new_object(self):
+        return _ObjectBuilder(self)
+
+class ManifestWriter:
+    # the output file of one host. the written sql is cut into objects of
+    # the store, and the file only includes them by psql's ``\ir``.
+    # a cut is made at a fragment boundary (``flush()``) chosen by
+    # the content of the last fragment, so the hosts which get the same
+    # fragments get the same objects even after a fragment of their own.
+    # the file is not rewritten when its content is the same as before.
+    # everything is written by the executing thread: an object when it is
+    # cut, the file itself at ``close()`` only, so there is nothing to flush
+    # after a fragment. ``durable`` makes ``close()`` fsync the file
+
+    cut_modulus = 32
+
+    def __init__(self, output_path, store, durable=None):
+        if durable is None:
+            durable = False
+
+        self.output_path = output_path
+        self._store = store
+        self._durable = durable
+        self._include_list = []
+        self._builder = None
+        self._piece_crc = 0
+        self._piece_size = 0
+        self._closed = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        if not data:
+            return
+
+        if self._builder is None:
+            self._builder = self._store.new_object()
+
+        self._builder.write(data)
+        self._piece_crc = zlib.crc32(data, self._piece_crc)
+        self._piece_size += len(data)
+
+    def _cut(self):
+        builder = self._builder
+        self._builder = None
+
+        if builder is None:
+            return
+
+        object_path = builder.finish()
+
+        self._include_list.append('\\ir \'{}\'\n'.format(
+            os.path.relpath(
+                object_path,
+                start=os.path.dirname(os.path.abspath(self.output_path)),
+            ).replace('\'', '\'\''),
+        ))
+
+    def flush(self):
+        # a fragment boundary
+
+        if self._piece_size and not self._piece_crc % self.cut_modulus:
+            self._cut()
+
+        self._piece_crc = 0
+        self._piece_size = 0
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._cut()
+
+        content = ''.join(self._include_list).encode('utf-8')
+
+        try:
+            with open(self.output_path, 'rb') as fd:
+                unchanged = fd.read(len(content) + 1) == content
+        except FileNotFoundError:
+            unchanged = False
+
+        if unchanged:
+            return
+
+        tmp_file_path = _tmp_file_path(self.output_path)
+
+        try:
+            with open(tmp_file_path, 'wb') as fd:
+                fd.write(content)
+
+                if self._durable:
+                    fd.flush()
+                    os.fsync(fd.fileno())
+
+            os.replace(tmp_file_path, self.output_path)
+        except:
+            try:
+                os.unlink(tmp_file_path)
+            except OSError:
+                pass
+
+            raise
+
+        if self._durable:
+            _fsync_dir(os.path.dirname(os.path.abspath(self.output_path)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,167 @@
+import os
+import threading
+
+class OutputWriter:
+    # a buffered output file which is written by its own background thread,
+    # so the executing thread never waits for the disk (unless the thread
+    # is too far behind). the buffer goes to the disk when it exceeds
+    # ``buffer_size``, when ``flush_interval`` seconds have passed, and at
+    # ``flush()`` only when ``fragment_flush`` is asked. ``durable`` makes
+    # ``close()`` fsync the file
+
+    flush_interval = 1.0
+
+    def __init__(self, output_path, buffer_size=None, fragment_flush=None, durable=None):
+        if buffer_size is None:
+            buffer_size = 1024 * 1024
+
+        if fragment_flush is None:
+            fragment_flush = False
+
+        if durable is None:
+            durable = False
+
+        if buffer_size < 1:
+            raise ValueError('{!r}: buffer_size must be at least 1'.format(buffer_size))
+
+        self.output_path = output_path
+        self._buffer_size = buffer_size
+        self._max_pending_size = 4 * buffer_size
+        self._fragment_flush = fragment_flush
+        self._durable = durable
+
+        self._cond = threading.Condition(threading.Lock())
+        self._pending_list = []
+        self._pending_size = 0
+        self._writing_size = 0
+        self._flush_requested = False
+        self._closed = False
+        self._error = None
+
+        self._fd = open(output_path, 'wb', buffering=0)
+
+        try:
+            self._thread = threading.Thread(
+                target=self._run,
+                name='output-writer {!r}'.format(output_path),
+                daemon=True,
+            )
+            self._thread.start()
+        except:
+            self._fd.close()
+
+            raise
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise OSError('{!r}: {!r}: {}'.format(
+                self.output_path,
+                type(self._error),
+                self._error,
+            )) from self._error
+
+    def _write_all(self, data):
+        view = memoryview(data)
+
+        while view:
+            view = view[self._fd.write(view):]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._flush_requested or
+                            self._pending_size >= self._buffer_size,
+                    timeout=self.flush_interval,
+                )
+
+                pending_list = self._pending_list
+                closed = self._closed
+
+                self._pending_list = []
+                self._writing_size = self._pending_size
+                self._pending_size = 0
+                self._flush_requested = False
+
+            try:
+                if pending_list and self._error is None:
+                    self._write_all(b''.join(pending_list))
+            except Exception as e:
+                self._error = e
+
+            with self._cond:
+                self._writing_size = 0
+                self._cond.notify_all()
+
+            if closed:
+                return
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        if not data:
+            return
+
+        with self._cond:
+            self._raise_error()
+
+            if self._closed:
+                raise ValueError('{!r}: the writer is closed'.format(self.output_path))
+
+            if self._pending_size + self._writing_size >= self._max_pending_size:
+                # a slow disk makes the executing thread wait here, so a large
+                # streamed file never piles up in memory
+
+                self._cond.wait_for(
+                    lambda: self._error is not None or
+                            self._pending_size + self._writing_size < self._max_pending_size,
+                )
+
+                self._raise_error()
+
+            pending_size = self._pending_size + len(data)
+
+            self._pending_list.append(data)
+            self._pending_size = pending_size
+
+            if pending_size >= self._buffer_size and pending_size - len(data) < self._buffer_size:
+                self._cond.notify_all()
+
+    def flush(self):
+        # a fragment boundary
+
+        if not self._fragment_flush:
+            return
+
+        with self._cond:
+            self._raise_error()
+
+            self._flush_requested = True
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._cond.notify_all()
+
+        self._thread.join()
+
+        try:
+            self._raise_error()
+
+            if self._durable:
+                os.fsync(self._fd.fileno())
+        finally:
+            self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# vi:ts=4:sw=4:et
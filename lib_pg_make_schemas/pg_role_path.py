@@ -1,4 +1,6 @@
 from . import pg_literal
+from . import sql_stream
+from . import copy_data
 
 def pg_role_path(
             role,
@@ -27,6 +29,24 @@ def pg_role_path(
 
     return '\n'.join(set_list)
 
+def pg_role_path_fragment(
+            role,
+            schema_name,
+            pg_role_path_func=pg_role_path,
+            pg_ident_quote_func=pg_literal.pg_ident_quote,
+        ):
+    sql_str_list = [
+        pg_role_path_func(role, schema_name, pg_ident_quote_func=pg_ident_quote_func),
+    ]
+
+    sql_info = {
+        'pg_role': role,
+        'pg_search_path': schema_name,
+        'pg_role_path': (role, schema_name),
+    }
+
+    return sql_str_list, sql_info
+
 def apply_pg_role_path(
             sql,
             role,
@@ -38,11 +58,11 @@ def apply_pg_role_path(
         sql_list_or_str, sql_info = sql
         if isinstance(sql_list_or_str, list):
             sql_str_list = sql_list_or_str
-        elif isinstance(sql_list_or_str, str):
+        elif isinstance(sql_list_or_str, (str, bytes, sql_stream.SqlStream, copy_data.CopyData)):
             sql_str_list = [sql_list_or_str]
         else:
             raise TypeError
-    elif isinstance(sql, str):
+    elif isinstance(sql, (str, bytes)):
         sql_str, sql_info = sql, {}
         sql_str_list = [sql_str]
     else:
@@ -51,16 +71,39 @@ def apply_pg_role_path(
     if not sql_str_list:
         return sql_str_list, sql_info
 
+    last_sql_str = sql_str_list[-1]
+
+    if isinstance(last_sql_str, copy_data.CopyData):
+        # the ``copy`` block is ended by its own terminator
+
+        pass
+    elif isinstance(last_sql_str, sql_stream.SqlStream):
+        # the stream strips its last piece itself
+
+        last_sql_str = last_sql_str.with_suffix(b'\n\n;')
+    elif isinstance(last_sql_str, bytes):
+        # the read sql is copied only once here, by joining it with
+        # the terminator
+
+        last_sql_str = b''.join((
+            memoryview(last_sql_str)[:sql_stream.rstrip_len(last_sql_str)],
+            b'\n\n;',
+        ))
+    else:
+        last_sql_str = '{}\n\n;'.format(last_sql_str.rstrip())
+
     new_sql_str_list = [
         '{}\n\n'.format(
             pg_role_path_func(role, schema_name, pg_ident_quote_func=pg_ident_quote_func),
         )
-    ] + sql_str_list[:-1] + ['{}\n\n;'.format(sql_str_list[-1].rstrip())]
+    ] + sql_str_list[:-1] + [last_sql_str]
 
     new_sql_info = sql_info.copy()
     new_sql_info.update({
         'pg_role': role,
         'pg_search_path': schema_name,
+        # the first item of the list is a statement for this state
+        'pg_role_path': (role, schema_name),
     })
 
     return new_sql_str_list, new_sql_info
@@ -1,6 +1,14 @@
 import itertools
+import collections
+import threading
+import concurrent.futures
 import psycopg2
 from . import pg_notices
+from . import sql_stream
+from . import copy_data
+from . import output_writer
+from . import output_store
+from . import stream_archive
 
 class ReceiversError(Exception):
     pass
@@ -17,18 +25,24 @@ class SqlFileUtils:
             fragment_list_or_str, fragment_info = fragment
             if isinstance(fragment_list_or_str, list):
                 fragment_str_list = fragment_list_or_str
-            elif isinstance(fragment_list_or_str, str):
+            elif isinstance(fragment_list_or_str, (str, bytes, sql_stream.SqlStream, copy_data.CopyData)):
                 fragment_str_list = [fragment_list_or_str]
             else:
                 raise TypeError
-        elif isinstance(fragment, str):
+        elif isinstance(fragment, (str, bytes)):
             fragment_str, fragment_info = fragment, {}
             fragment_str_list = [fragment_str]
         else:
             raise TypeError
 
         for fragment_str in fragment_str_list:
-            fd.write(fragment_str)
+            if isinstance(fragment_str, (sql_stream.SqlStream, copy_data.CopyData)):
+                for piece in fragment_str:
+                    fd.write(piece)
+            else:
+                # the read sql (bytes) is written as is, without encoding it again
+
+                fd.write(fragment_str)
         fd.write('\n\n')
         fd.flush()
 
@@ -65,19 +79,81 @@ class SqlFileUtils:
 class Receivers:
     _sql_file_utils = SqlFileUtils
 
+    _batch_savepoint = 'pg_make_schemas_batch'
+
+    # a host's queue of tasks which is not drained yet is limited, so
+    # the rendered sql of a whole phase does not pile up in memory
+    _max_queue_len = 1024
+    _max_queue_size = 16 * 1024 * 1024
+
     con_error = psycopg2.Error
 
-    def __init__(self, execute, pretend, output):
+    def __init__(self, execute, pretend, output, jobs=None, batch_size=None,
+            lazy_role_path=None, output_buffer_size=None, output_flush=None,
+            output_fsync=None, output_dedup=None, output_archive=None):
+        if lazy_role_path is None:
+            lazy_role_path = False
+
+        if output_dedup is None:
+            output_dedup = False
+
+        if output_archive is None:
+            output_archive = False
+
         self._execute = execute
         self._pretend = pretend
         self._output = output
+        self._batch_size = batch_size
+        self._lazy_role_path = lazy_role_path
+        self._output_buffer_size = output_buffer_size
+        self._output_flush = output_flush
+        self._output_fsync = output_fsync
+
+        if output_dedup and output is not None:
+            self._output_store = output_store.ContentStore(
+                '{}.objects'.format(output),
+                durable=output_fsync,
+            )
+        else:
+            self._output_store = None
+
+        if output_archive and output is not None:
+            self._output_archive = stream_archive.ArchiveWriter(
+                '{}.archive'.format(output),
+                buffer_size=output_buffer_size,
+                fragment_flush=output_flush,
+                durable=output_fsync,
+            )
+        else:
+            self._output_archive = None
+
+        self._host_name_list = []
         self._con_map = {}
         self._fd_map = {}
         self._nfd_map = {}
         self._frag_cnt_map = {}
+        self._batch_map = {}
+        self._batch_len_map = {}
+        self._role_path_map = {}
 
         self._notices = self._execute and self._output is not None
 
+        if jobs is not None and jobs > 1:
+            # every host has its own queue of tasks. a queue is drained by
+            # one worker at a time, so the tasks of a host keep their order,
+            # but different hosts are served concurrently
+
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        else:
+            self._executor = None
+
+        self._cond = threading.Condition()
+        self._queue_map = {}
+        self._queue_size_map = {}
+        self._drain_set = set()
+        self._error_map = {}
+        self._cancelled = False
+
     def _connect(self, conninfo):
         con = psycopg2.connect(conninfo)
 
@@ -92,8 +168,24 @@ class Receivers:
 
         return con
 
-    def _open(self, output_path):
-        return open(output_path, 'w', encoding='utf-8', newline='\n')
+    def _open(self, output_name):
+        if self._output_archive is not None:
+            # the output file is a stream of the archive, so no file handle
+            # is held for it
+
+            return self._output_archive.open_stream(output_name)
+
+        output_path = '{}.{}'.format(self._output, output_name)
+
+        # the output files are written by their background threads, so
+        # the execution does not wait for the disk
+
+        return output_writer.OutputWriter(
+            output_path,
+            buffer_size=self._output_buffer_size,
+            fragment_flush=self._output_flush,
+            durable=self._output_fsync,
+        )
 
     def _make_counter(self, restore_value=None):
         if restore_value is None:
@@ -101,13 +193,117 @@ class Receivers:
 
         return itertools.count(restore_value)
 
+    def _raise_error(self, host_name=None):
+        with self._cond:
+            if host_name is not None:
+                e = self._error_map.get(host_name)
+            else:
+                e = next(iter(self._error_map.values()), None)
+
+        if e is not None:
+            raise e
+
+    def _submit(self, host_name, func, *args, size=None):
+        if self._executor is None:
+            func(*args)
+
+            return
+
+        if size is None:
+            size = 0
+
+        self._raise_error()
+
+        with self._cond:
+            queue = self._queue_map.setdefault(host_name, collections.deque())
+
+            if len(queue) >= self._max_queue_len or \
+                    self._queue_size_map.get(host_name, 0) >= self._max_queue_size:
+                # the host is too far behind. the queue is being drained,
+                # because a queue is never left full without its worker
+
+                self._cond.wait_for(
+                    lambda: self._cancelled or host_name in self._error_map or (
+                        len(queue) < self._max_queue_len and
+                        self._queue_size_map.get(host_name, 0) < self._max_queue_size
+                    ),
+                )
+
+                if host_name in self._error_map:
+                    raise self._error_map[host_name]
+
+            queue.append((func, args, size))
+            self._queue_size_map[host_name] = self._queue_size_map.get(host_name, 0) + size
+
+            if host_name in self._drain_set:
+                return
+
+            self._drain_set.add(host_name)
+
+        self._executor.submit(self._drain, host_name)
+
+    def _drain(self, host_name):
+        while True:
+            with self._cond:
+                queue = self._queue_map[host_name]
+
+                if not queue or self._cancelled or host_name in self._error_map:
+                    queue.clear()
+                    self._queue_size_map[host_name] = 0
+                    self._drain_set.discard(host_name)
+                    self._cond.notify_all()
+
+                    return
+
+                func, args, size = queue.popleft()
+                self._queue_size_map[host_name] -= size
+
+                if len(queue) + 1 == self._max_queue_len or size:
+                    self._cond.notify_all()
+
+            try:
+                func(*args)
+            except Exception as e:
+                with self._cond:
+                    self._error_map.setdefault(host_name, e)
+
+    def _flush_batches(self):
+        if not self._execute or self._batch_size is None:
+            return
+
+        for host_name in self._host_name_list:
+            self._submit(host_name, self._flush_batch, host_name)
+
+    def wait_host(self, host_name):
+        if self._executor is None:
+            return
+
+        with self._cond:
+            self._cond.wait_for(lambda: host_name not in self._drain_set)
+
+        self._raise_error(host_name=host_name)
+
+    def wait(self):
+        self._flush_batches()
+
+        if self._executor is None:
+            return
+
+        with self._cond:
+            self._cond.wait_for(lambda: not self._drain_set)
+
+        self._raise_error()
+
+    def _connect_host(self, host_name, conninfo):
+        self._con_map[host_name] = self._connect(conninfo)
+
     def begin_host(self, hosts_descr, host):
         host_name = host['name']
         host_type = host['type']
         conninfo = host['conninfo']
 
         if self._execute:
-            if host_name in self._con_map:
+            if host_name in self._con_map or host_name in self._queue_map:
                 raise ValueError(
                     '{!r}, {!r}: non unique host_name'.format(
                         host_name,
@@ -123,8 +319,8 @@ class Receivers:
                     ),
                 )
 
-            con = self._connect(conninfo)
-            self._con_map[host_name] = con
+            self._host_name_list.append(host_name)
+            self._submit(host_name, self._connect_host, host_name, conninfo)
 
         if self._output is not None:
             if host_name in self._fd_map:
@@ -135,13 +331,20 @@ class Receivers:
                     ),
                 )
 
-            output_path = '{}.{}.{}.sql'.format(
-                self._output,
+            output_name = '{}.{}.sql'.format(
                 host_name.replace('/', '-').replace('.', '-'),
                 host_type.replace('/', '-').replace('.', '-'),
             )
 
-            fd = self._open(output_path)
+            if self._output_store is not None:
+                fd = output_store.ManifestWriter(
+                    '{}.{}'.format(self._output, output_name),
+                    self._output_store,
+                    durable=self._output_fsync,
+                )
+            else:
+                fd = self._open(output_name)
+
             self._fd_map[host_name] = fd
             self._frag_cnt_map[host_name] = self._make_counter()
 
@@ -156,13 +359,12 @@ class Receivers:
                     ),
                 )
 
-            notices_output_path = '{}.{}.{}.notices'.format(
-                self._output,
+            notices_output_name = '{}.{}.notices'.format(
                 host_name.replace('/', '-').replace('.', '-'),
                 host_type.replace('/', '-').replace('.', '-'),
             )
 
-            self._nfd_map[host_name] = self._open(notices_output_path)
+            self._nfd_map[host_name] = self._open(notices_output_name)
 
     def begin(self, hosts_descr, begin_host_verb_func=None):
         for host in hosts_descr.host_list:
@@ -173,8 +375,38 @@ class Receivers:
 
             self.begin_host(hosts_descr, host)
 
+    def submit_con_func(self, host_name, func, *args):
+        # ``func(con, *args)`` is called in turn with the fragments of
+        # the host, so the calls for all hosts are done concurrently.
+        # its result is taken by ``con_func_result()``
+
+        future = concurrent.futures.Future()
+
+        def call():
+            if self._batch_size is not None:
+                self._flush_batch(host_name)
+
+            try:
+                future.set_result(func(self._con_map[host_name], *args))
+            except Exception as e:
+                future.set_exception(e)
+
+        self._submit(host_name, call)
+
+        return future
+
+    def con_func_result(self, host_name, future):
+        self.wait_host(host_name)
+
+        return future.result()
+
     def get_con(self, host_name):
         if self._execute:
+            if self._batch_size is not None:
+                self._submit(host_name, self._flush_batch, host_name)
+
+            self.wait_host(host_name)
+
             return self._con_map[host_name]
 
     def look_fragment_i(self, host_name):
@@ -189,6 +421,14 @@ class Receivers:
 
         return fragment_i
 
+    def _next_fragment_i(self, host_name):
+        frag_cnt = self._frag_cnt_map.get(host_name)
+
+        if frag_cnt is None:
+            return
+
+        return next(frag_cnt)
+
     def write_fragment(self, host_name, fragment):
         if self._output is not None:
             fd = self._fd_map[host_name]
@@ -202,12 +442,9 @@ class Receivers:
 
            self._sql_file_utils.write_notices(nfd, notices)
 
-    def write_fragment_ok_notice(self, host_name):
+    def write_fragment_ok_notice(self, host_name, fragment_i):
         if self._output is not None:
             fd = self._fd_map[host_name]
-            frag_cnt = self._frag_cnt_map[host_name]
-
-            fragment_i = next(frag_cnt)
 
             self._sql_file_utils.write_fragment_ok_notice(fd, fragment_i)
 
@@ -215,42 +452,254 @@ class Receivers:
                 nfd = self._nfd_map[host_name]
                 self._sql_file_utils.write_ok_notice(nfd, fragment_i)
 
-    def execute(self, host_name, fragment):
+    def _split_fragment(self, fragment):
+        if isinstance(fragment, tuple):
+            fragment_list_or_str, fragment_info = fragment
+            if isinstance(fragment_list_or_str, list):
+                fragment_str_list = fragment_list_or_str
+            elif isinstance(fragment_list_or_str, (str, bytes, sql_stream.SqlStream, copy_data.CopyData)):
+                fragment_str_list = [fragment_list_or_str]
+            else:
+                raise TypeError
+        elif isinstance(fragment, (str, bytes)):
+            fragment_str, fragment_info = fragment, {}
+            fragment_str_list = [fragment_str]
+        else:
+            raise TypeError
+
+        return fragment_str_list, fragment_info
+
+    def _make_query(self, con, query_str_list):
+        # the utf-8 bytes of the read sql go to the connection as is when
+        # the connection uses utf-8. a single string is not joined at all
+
+        if con.encoding != 'UTF8':
+            return '\n;\n'.join(
+                query_str.decode('utf-8') if isinstance(query_str, bytes) else query_str
+                for query_str in query_str_list
+            )
+
+        if len(query_str_list) == 1:
+            return query_str_list[0]
+
+        return b'\n;\n'.join(
+            query_str if isinstance(query_str, bytes) else query_str.encode('utf-8')
+            for query_str in query_str_list
+        )
+
+    def _execute_fragment_now(self, host_name, fragment, fragment_i):
         self.write_fragment(host_name, fragment)
 
         if self._execute:
             con = self._con_map[host_name]
-
-            if isinstance(fragment, tuple):
-                fragment_list_or_str, fragment_info = fragment
-                if isinstance(fragment_list_or_str, list):
-                    fragment_str_list = fragment_list_or_str
-                elif isinstance(fragment_list_or_str, str):
-                    fragment_str_list = [fragment_list_or_str]
-                else:
-                    raise TypeError
-            elif isinstance(fragment, str):
-                fragment_str, fragment_info = fragment, {}
-                fragment_str_list = [fragment_str]
-            else:
-                raise TypeError
+            fragment_str_list, fragment_info = self._split_fragment(fragment)
 
             try:
                 with con.cursor() as cur:
                     for fragment_str in fragment_str_list:
-                        cur.execute(fragment_str)
+                        if isinstance(fragment_str, sql_stream.SqlStream):
+                            # a large file goes by pieces of whole statements,
+                            # so only one piece is kept in memory
+
+                            for piece in fragment_str:
+                                cur.execute(self._make_query(con, [piece]))
+                        elif isinstance(fragment_str, copy_data.CopyData):
+                            with fragment_str.open() as data_fd:
+                                cur.copy_expert(
+                                    fragment_str.copy_sql(),
+                                    data_fd,
+                                    size=fragment_str.read_size,
+                                )
+                        else:
+                            cur.execute(self._make_query(con, [fragment_str]))
             except self.con_error as e:
                 raise ReceiversError(
                         '{!r}: {!r}: {!r}: {}'.format(host_name, fragment_info, type(e), e)) from e
             finally:
                 self.write_notices(host_name, con)
 
-        self.write_fragment_ok_notice(host_name)
+        self.write_fragment_ok_notice(host_name, fragment_i)
 
-    def finish_host(self, hosts_descr, host):
+    def _batch_marker(self, batch_i):
+        return '{}: end of fragment {}'.format(self._batch_savepoint, int(batch_i))
+
+    def _batch_marker_sql(self, batch_i):
+        return 'do $do$begin raise notice \'{}\'; end$do$;'.format(self._batch_marker(batch_i))
+
+    def _flush_batch(self, host_name):
+        batch = self._batch_map.pop(host_name, None)
+        self._batch_len_map.pop(host_name, None)
+
+        if not batch:
+            return
+
+        if len(batch) == 1:
+            fragment, fragment_i = batch[0]
+
+            self._execute_fragment_now(host_name, fragment, fragment_i)
+
+            return
+
+        con = self._con_map[host_name]
+        batch_str_list = []
+
+        for batch_i, (fragment, fragment_i) in enumerate(batch):
+            fragment_str_list, fragment_info = self._split_fragment(fragment)
+
+            batch_str_list.extend(fragment_str_list)
+
+            if self._notices:
+                # a marker notice after every fragment, so the notices
+                # are written next to their fragments
+
+                batch_str_list.append(self._batch_marker_sql(batch_i))
+
+        batch_str_list.append('release savepoint {};'.format(self._batch_savepoint))
+
+        try:
+            with con.cursor() as cur:
+                # the savepoint goes alone, because the server parses the
+                # whole query before executing it. a lonely semicolon is
+                # an empty statement, it ensures every fragment string is terminated
+
+                cur.execute('savepoint {};'.format(self._batch_savepoint))
+                cur.execute(self._make_query(con, batch_str_list))
+        except self.con_error:
+            # the batch has failed somewhere. it is undone and its fragments
+            # are executed one by one to report the failed fragment properly
+
+            try:
+                with con.cursor() as cur:
+                    cur.execute('rollback to savepoint {};'.format(self._batch_savepoint))
+                    cur.execute('release savepoint {};'.format(self._batch_savepoint))
+            except self.con_error as e:
+                raise ReceiversError('{!r}: {!r}: {}'.format(host_name, type(e), e)) from e
+
+            if self._notices:
+                con.notices.pop_all()
+
+            for fragment, fragment_i in batch:
+                self._execute_fragment_now(host_name, fragment, fragment_i)
+
+            return
+
+        # the output is the same as the output of the fragments
+        # which are executed one by one
+
+        if self._notices:
+            notice_list = con.notices.pop_all()
+        else:
+            notice_list = []
+
+        for batch_i, (fragment, fragment_i) in enumerate(batch):
+            self.write_fragment(host_name, fragment)
+
+            if self._notices:
+                marker = self._batch_marker(batch_i)
+                marker_i = next(
+                    (i for i, notice in enumerate(notice_list) if marker in notice),
+                    None,
+                )
+
+                if marker_i is None or batch_i + 1 == len(batch):
+                    fragment_notice_list = [notice for notice in notice_list if marker not in notice]
+                    notice_list = []
+                else:
+                    fragment_notice_list = notice_list[:marker_i]
+                    notice_list = notice_list[marker_i + 1:]
+
+                self._sql_file_utils.write_notices(self._nfd_map[host_name], fragment_notice_list)
+
+            self.write_fragment_ok_notice(host_name, fragment_i)
+
+    def _execute_fragment(self, host_name, fragment, fragment_i):
+        if not self._execute or self._batch_size is None:
+            self._execute_fragment_now(host_name, fragment, fragment_i)
+
+            return
+
+        fragment_str_list, fragment_info = self._split_fragment(fragment)
+
+        if any(
+                    isinstance(fragment_str, (sql_stream.SqlStream, copy_data.CopyData))
+                    for fragment_str in fragment_str_list
+                ):
+            # a streamed file (or a data file) is never put in a batch
+
+            self._flush_batch(host_name)
+            self._execute_fragment_now(host_name, fragment, fragment_i)
+
+            return
+
+        fragment_len = sum(len(fragment_str) for fragment_str in fragment_str_list)
+        batch_len = self._batch_len_map.get(host_name, 0)
+
+        if batch_len and batch_len + fragment_len > self._batch_size:
+            self._flush_batch(host_name)
+
+            batch_len = 0
+
+        self._batch_map.setdefault(host_name, []).append((fragment, fragment_i))
+        self._batch_len_map[host_name] = batch_len + fragment_len
+
+    def _skip_pg_role_path(self, host_name, fragment):
+        # the session state is not read from the server. it is the state
+        # which the last ``pg_role_path`` tagged fragment has set, and
+        # the sql of the tagged fragments is trusted not to change it.
+        # any other fragment might change it, so the state is forgotten
+        # after such a fragment and the next tagged fragment sets it again
+
+        fragment_str_list, fragment_info = self._split_fragment(fragment)
+        role_path = fragment_info.get('pg_role_path')
+
+        if role_path is None:
+            if fragment_str_list:
+                self._role_path_map.pop(host_name, None)
+
+            return fragment
+
+        if not fragment_str_list:
+            return fragment
+
+        if self._role_path_map.get(host_name) != role_path:
+            self._role_path_map[host_name] = role_path
+
+            return fragment
+
+        if len(fragment_str_list) == 1:
+            return
+
+        return fragment_str_list[1:], fragment_info
+
+    def execute(self, host_name, fragment):
+        if self._lazy_role_path:
+            # a redundant ``pg_role_path`` statement is skipped.
+            # a skipped fragment takes no number, so the numbers
+            # of the output have no gaps
+
+            fragment = self._skip_pg_role_path(host_name, fragment)
+
+            if fragment is None:
+                return
+
+        fragment_i = self._next_fragment_i(host_name)
+
+        fragment_str_list, _ = self._split_fragment(fragment)
+        fragment_size = sum(
+            len(fragment_str)
+            for fragment_str in fragment_str_list
+            if isinstance(fragment_str, (str, bytes))
+        )
+
+        self._submit(host_name, self._execute_fragment, host_name, fragment, fragment_i,
+                size=fragment_size)
+
+    def _finish_host(self, hosts_descr, host):
         host_name = host['name']
 
         if self._execute:
+            self._flush_batch(host_name)
+
             con = self._con_map[host_name]
 
             try:
@@ -281,16 +730,31 @@ class Receivers:
             con.close()
             del self._con_map[host_name]
 
+    def finish_host(self, hosts_descr, host):
+        host_name = host['name']
+
+        self._submit(host_name, self._finish_host, hosts_descr, host)
+
     def finish(self, hosts_descr, finish_host_verb_func=None):
+        # all hosts have to complete their work before the first commit
+
+        self.wait()
+
         for host in hosts_descr.host_list:
             if finish_host_verb_func is not None:
                 host_name = host['name']
 
                 finish_host_verb_func(host_name)
 
-            self.finish_host(hosts_descr, host)
+            self._finish_host(hosts_descr, host)
 
     def close(self):
+        if self._executor is not None:
+            with self._cond:
+                self._cancelled = True
+
+            self._executor.shutdown(wait=True)
+
         for host_name, nfd in reversed(list(self._nfd_map.items())):
             nfd.close()
             del self._nfd_map[host_name]
@@ -303,4 +767,7 @@ class Receivers:
             con.close()
             del self._con_map[host_name]
 
+        if self._output_archive is not None:
+            self._output_archive.close()
+
 # vi:ts=4:sw=4:et
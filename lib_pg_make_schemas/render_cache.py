@@ -0,0 +1,83 @@
+import collections
+from . import pg_role_path
+
+class RenderCache:
+    def __init__(self, max_size=None):
+        # ``max_size`` is the total length of the kept SQL strings.
+        # ``None`` means no limit and ``0`` disables the cache
+
+        self.max_size = max_size
+        self.size = 0
+        self.hit_cnt = 0
+        self.miss_cnt = 0
+        self._value_map = collections.OrderedDict()
+
+    def _value_size(self, value):
+        sql_str_list, sql_info = value
+
+        # a streamed file keeps only its path
+
+        return sum(
+            len(sql_str)
+            for sql_str in sql_str_list
+            if isinstance(sql_str, (str, bytes))
+        )
+
+    def _put(self, key, value_list, value_size):
+        self._value_map[key] = value_list, value_size
+        self.size += value_size
+
+        while self._value_map and self.max_size is not None and self.size > self.max_size:
+            _, (_, old_value_size) = self._value_map.popitem(last=False)
+
+            self.size -= old_value_size
+
+    def render(self, key, value_iter):
+        # the values are passed through while they are rendered for
+        # the first time, so the errors come at the same moment as without
+        # the cache. only a fully rendered sequence is kept
+
+        cached = self._value_map.get(key)
+
+        if cached is not None:
+            self._value_map.move_to_end(key)
+            self.hit_cnt += 1
+
+            yield from cached[0]
+
+            return
+
+        self.miss_cnt += 1
+
+        if self.max_size == 0:
+            yield from value_iter
+
+            return
+
+        value_list = []
+        value_size = 0
+
+        for value in value_iter:
+            if value_list is not None:
+                value_size += self._value_size(value)
+
+                if self.max_size is not None and value_size > self.max_size:
+                    value_list = None
+                else:
+                    value_list.append(value)
+
+            yield value
+
+        if value_list is not None:
+            self._put(key, value_list, value_size)
+
+    def render_sql(self, key, sql_iter, role, schema_name):
+        # ``sql_iter`` is not started when the fragments are taken
+        # from the cache, so the files are not read again
+
+        yield from self.render(key, (
+            pg_role_path.apply_pg_role_path(sql, role, schema_name)
+            for sql in sql_iter
+        ))
+
+# vi:ts=4:sw=4:et
@@ -30,44 +30,128 @@ schemas text[]
 );\
 '''
 
-FETCH_REVISION_SQL ='''\
-select rev.revision, rev.comment
-from {q_revision_schema_ident}.{q_revision_ident} rev
-where rev.application = %(application)s and rev.schemas_type = %(schemas_type)s
-for update\
-'''
-
-GUARD_REVISION_SQL ='''\
+# helper functions are never replaced once created: a change of the body
+# of one of them must come with a new ``_vN`` name, so that an older
+# pg-make-schemas still running against the same database keeps working
+
+GUARD_REVISION_FUNCTION_SQL = '''\
+create function {q_revision_schema_ident}.guard_revision_v1 (
+_revision_table regclass,
+_application text,
+_schemas_type text,
+_expected_revision text
+) returns void language plpgsql as $function$
 declare
 _revision text;
 begin
-select rev.revision
+execute format ($select$select rev.revision from %s rev
+where rev.application = $1 and rev.schemas_type = $2
+for update$select$, _revision_table)
 into _revision
-from {q_revision_schema_ident}.{q_revision_ident} rev
-where rev.application = {q_application} and rev.schemas_type = {q_schemas_type}
-for update;
-if _revision is distinct from {q_revision} then
-raise 'unexpected revision: % %', quote_nullable (_revision), quote_nullable ({q_revision});
+using _application, _schemas_type;
+if _revision is distinct from _expected_revision then
+raise 'unexpected revision: % %', quote_nullable (_revision), quote_nullable (_expected_revision);
 end if;
-end\
+end
+$function$\
 '''
 
-CLEAN_REVISION_SQL ='''\
-delete from {q_revision_schema_ident}.{q_revision_ident} rev
-where rev.application = {q_application} and rev.schemas_type = {q_schemas_type};\
+FETCH_REVISION_FUNCTION_SQL = '''\
+create function {q_revision_schema_ident}.fetch_revision_v1 (
+_revision_table regclass,
+_application text,
+_schemas_type text,
+out revision text,
+out comment text
+) language plpgsql as $function$
+begin
+execute format ($select$select rev.revision, rev.comment from %s rev
+where rev.application = $1 and rev.schemas_type = $2
+for update$select$, _revision_table)
+into revision, comment
+using _application, _schemas_type;
+end
+$function$\
 '''
 
-PUSH_REVISION_SQL ='''\
-with ins_rev as (
-insert into {q_revision_schema_ident}.{q_revision_ident}
+CLEAN_REVISION_FUNCTION_SQL = '''\
+create function {q_revision_schema_ident}.clean_revision_v1 (
+_revision_table regclass,
+_application text,
+_schemas_type text
+) returns void language plpgsql as $function$
+begin
+execute format ($delete$delete from %s rev
+where rev.application = $1 and rev.schemas_type = $2$delete$, _revision_table)
+using _application, _schemas_type;
+end
+$function$\
+'''
+
+PUSH_REVISION_FUNCTION_SQL = '''\
+create function {q_revision_schema_ident}.push_revision_v1 (
+_revision_table regclass,
+_revision_history_table regclass,
+_application text,
+_schemas_type text,
+_revision text,
+_comment text,
+_schemas text[]
+) returns void language plpgsql as $function$
+begin
+execute format ($insert$with ins_rev as (
+insert into %s
 (application, schemas_type, datetime, revision, comment, schemas)
-values ({q_application}, {q_schemas_type}, now (), {q_revision}, {q_comment}, {q_schemas}::text[])
+values ($1, $2, now (), $3, $4, $5)
 returning *
 )
-insert into {q_revision_schema_ident}.{q_revision_history_ident}
+insert into %s
 (application, schemas_type, datetime, revision, comment, schemas)
 select rev.application, rev.schemas_type, rev.datetime, rev.revision, rev.comment, rev.schemas
-from ins_rev rev;\
+from ins_rev rev$insert$, _revision_table, _revision_history_table)
+using _application, _schemas_type, _revision, _comment, _schemas;
+end
+$function$\
+'''
+
+LOCK_REVISION_STRUCTS_SQL = '''\
+begin
+perform pg_advisory_xact_lock ('pg_namespace'::regclass::integer, hashtext ({q_revision_schema}));
+end\
+'''
+
+CREATE_REVISION_FUNCTION_SQL = '''\
+if not exists (
+select 1 from pg_proc pr
+where pr.pronamespace = (select ns.oid from pg_namespace ns where ns.nspname = {q_revision_schema})
+and pr.proname = {q_function}
+) then
+execute {q_create_function};
+end if;\
+'''
+
+FETCH_REVISION_SQL ='''\
+select var_rev.revision, var_rev.comment, func_rev.revision, func_rev.comment
+from {q_revision_schema_ident}.fetch_revision_v1 (
+%(var_revision_table)s::regclass, %(application)s, %(schemas_type)s) var_rev,
+{q_revision_schema_ident}.fetch_revision_v1 (
+%(func_revision_table)s::regclass, %(application)s, %(schemas_type)s) func_rev\
+'''
+
+GUARD_REVISION_SQL ='''\
+select {q_revision_schema_ident}.guard_revision_v1 (
+{q_revision_table}, {q_application}, {q_schemas_type}, {q_revision});\
+'''
+
+CLEAN_REVISION_SQL ='''\
+select {q_revision_schema_ident}.clean_revision_v1 (
+{q_revision_table}, {q_application}, {q_schemas_type});\
+'''
+
+PUSH_REVISION_SQL ='''\
+select {q_revision_schema_ident}.push_revision_v1 (
+{q_revision_table}, {q_revision_history_table}, {q_application}, {q_schemas_type},
+{q_revision}, {q_comment}, {q_schemas}::text[]);\
 '''
 
 DROP_SCHEMAS_CASCADE_SQL ='''\
@@ -89,9 +173,22 @@ end\
 DROP_SCHEMAS_SAFE_SQL ='''\
 declare
 _schema text;
-_func text;
-_args text;
+_kind text;
+_chunk_size integer;
+_routine_list text[];
+_routine text;
+_i integer;
 begin
+if current_setting ('server_version_num')::integer < 110000 then
+_kind := 'function';
+else
+_kind := 'routine';
+end if;
+if current_setting ('server_version_num')::integer < 100000 then
+_chunk_size := 1;
+else
+_chunk_size := {q_chunk_size};
+end if;
 for _schema in
 select unnest (rev.schemas)
 from {q_revision_schema_ident}.{q_revision_ident} rev
@@ -99,22 +196,98 @@ where rev.application = {q_application} and rev.schemas_type = {q_schemas_type}
 union
 select unnest ({q_schemas}::text[])
 loop
-for _func, _args in
-select pr.proname, pg_get_function_identity_arguments (pr.oid)
+select array_agg (format ($routine$%I.%I (%s)$routine$,
+_schema, pr.proname, pg_get_function_identity_arguments (pr.oid)) order by pr.oid)
+into _routine_list
 from pg_proc pr
-where pr.pronamespace = (select ns.oid from pg_namespace ns where ns.nspname = _schema)
-loop
-if version () ~ '^PostgreSQL\ (8|9|10)\.' then
-execute format ($drop$drop function %I.%I (%s)$drop$, _schema, _func, _args);
-else
-execute format ($drop$drop routine %I.%I (%s)$drop$, _schema, _func, _args);
-end if;
+where pr.pronamespace = (select ns.oid from pg_namespace ns where ns.nspname = _schema);
+_i := 1;
+while _i <= coalesce (array_length (_routine_list, 1), 0) loop
+begin
+execute format ($drop$drop %s %s$drop$, _kind,
+array_to_string (_routine_list[_i:_i + _chunk_size - 1], ', '));
+exception when others then
+foreach _routine in array _routine_list[_i:_i + _chunk_size - 1] loop
+begin
+execute format ($drop$drop %s %s$drop$, _kind, _routine);
+exception when others then
+raise 'unable to drop routine %: %', _routine, sqlerrm using errcode = sqlstate;
+end;
+end loop;
+end;
+_i := _i + _chunk_size;
 end loop;
 execute format ($drop$drop schema if exists %I$drop$, _schema);
 end loop;
 end\
 '''
 
+GUARD_DROP_LOCKS_SQL ='''\
+declare
+_budget bigint := {q_lock_budget};
+_held bigint;
+_estimate bigint;
+_report text;
+begin
+if _budget is null then
+_budget := current_setting ('max_locks_per_transaction')::bigint *
+(current_setting ('max_connections')::bigint +
+current_setting ('max_prepared_transactions')::bigint);
+end if;
+select count (*) into _held
+from pg_locks lo
+where not lo.fastpath;
+with target_schema as (
+select ns.oid, ns.nspname
+from pg_namespace ns
+where ns.nspname in (
+select unnest (rev.schemas)
+from {q_revision_schema_ident}.{q_revision_ident} rev
+where rev.application = {q_application} and rev.schemas_type = {q_schemas_type}
+union
+select unnest ({q_schemas}::text[])
+)
+), target_object as (
+select 'pg_proc'::regclass classid, pr.oid objid, pr.pronamespace nspoid
+from pg_proc pr
+where pr.pronamespace in (select sc.oid from target_schema sc)
+union all
+select 'pg_class'::regclass, cl.oid, cl.relnamespace
+from pg_class cl
+where cl.relnamespace in (select sc.oid from target_schema sc)
+union all
+select 'pg_type'::regclass, ty.oid, ty.typnamespace
+from pg_type ty
+where ty.typnamespace in (select sc.oid from target_schema sc)
+), dependent_object as (
+select distinct dep.classid, dep.objid, ob.nspoid
+from pg_depend dep
+join target_object ob on ob.classid = dep.refclassid and ob.objid = dep.refobjid
+where dep.deptype <> 'p' and not exists (
+select 1
+from target_object tob
+where tob.classid = dep.classid and tob.objid = dep.objid
+)
+), schema_estimate as (
+select sc.nspname,
+(select count (*) from target_object ob where ob.nspoid = sc.oid) object_count,
+(select count (*) from dependent_object ob where ob.nspoid = sc.oid) dependent_count
+from target_schema sc
+)
+select sum (1 + es.object_count + es.dependent_count),
+string_agg (format ('%s (%s objects, %s dependent objects)',
+quote_ident (es.nspname), es.object_count, es.dependent_count), ', '
+order by es.object_count + es.dependent_count desc)
+into _estimate, _report
+from schema_estimate es;
+if _held + coalesce (_estimate, 0) > _budget then
+raise 'too many locks for dropping schemas: % already in the lock table and at least % needed, but the budget is %: %',
+_held, _estimate, _budget, _report
+using hint = 'drop the biggest schemas by a separate deploy or increase the budget';
+end if;
+end\
+'''
+
 class RevisionSqlError(Exception):
     pass
 
@@ -147,16 +320,27 @@ class RevisionSql:
     _create_revision_schema_sql = CREATE_REVISION_SCHEMA_SQL
     _create_revision_table_sql = CREATE_REVISION_TABLE_SQL
     _create_revision_history_table_sql = CREATE_REVISION_HISTORY_TABLE_SQL
+    _lock_revision_structs_sql = LOCK_REVISION_STRUCTS_SQL
+    _create_revision_function_sql = CREATE_REVISION_FUNCTION_SQL
+    _revision_function_sql_map = {
+        'guard_revision_v1': GUARD_REVISION_FUNCTION_SQL,
+        'fetch_revision_v1': FETCH_REVISION_FUNCTION_SQL,
+        'clean_revision_v1': CLEAN_REVISION_FUNCTION_SQL,
+        'push_revision_v1': PUSH_REVISION_FUNCTION_SQL,
+    }
     _fetch_revision_sql = FETCH_REVISION_SQL
     _guard_revision_sql = GUARD_REVISION_SQL
     _clean_revision_sql = CLEAN_REVISION_SQL
     _push_revision_sql = PUSH_REVISION_SQL
     _drop_schemas_cascade_sql = DROP_SCHEMAS_CASCADE_SQL
     _drop_schemas_safe_sql = DROP_SCHEMAS_SAFE_SQL
+    _guard_drop_locks_sql = GUARD_DROP_LOCKS_SQL
+    _drop_routines_chunk_size = 1000
     _revision_sql_utils = RevisionSqlUtils
 
-    def __init__(self, application):
+    def __init__(self, application, lock_budget=None):
         self._application = application
+        self._lock_budget = lock_budget
 
     def _pg_quote(self, value):
         return pg_literal.pg_quote(value)
@@ -167,52 +351,30 @@ class RevisionSql:
     def _pg_dollar_quote(self, tag, value):
         return pg_literal.pg_dollar_quote(tag, value)
 
-    def _fetch_revision(self, recv, host_name, revision_schema_ident, revision_ident, host_type):
-        con = recv.get_con(host_name)
-
-        try:
-            with con.cursor() as cur:
-                cur.execute(
-                    self._fetch_revision_sql.format(
-                        q_revision_schema_ident=self._pg_ident_quote(
-                            revision_schema_ident,
-                        ).replace('%', '%%'),
-                        q_revision_ident=self._pg_ident_quote(
-                            revision_ident,
-                        ).replace('%', '%%'),
-                    ),
-                    {
-                        'application': self._application,
-                        'schemas_type': host_type,
-                    },
-                )
-
-                row = cur.fetchone()
-
-                if row is None:
-                    return None, None
-
-                revision, comment = row
+    def _revision_table(self, revision_schema_ident, revision_ident):
+        return '{}.{}'.format(
+            self._pg_ident_quote(revision_schema_ident),
+            self._pg_ident_quote(revision_ident),
+        )
 
-                return revision, comment
-        except recv.con_error as e:
-            raise RevisionSqlError('{!r}: {!r}: {}'.format(host_name, type(e), e)) from e
+    def _q_revision_table(self, revision_schema_ident, revision_ident):
+        return '{}::regclass'.format(
+            self._pg_quote(self._revision_table(revision_schema_ident, revision_ident)),
+        )
 
     def _guard_revision(self, revision_schema_ident, revision_ident, host_type, revision):
-        guard_revision_body = self._guard_revision_sql.format(
+        return self._guard_revision_sql.format(
             q_revision_schema_ident=self._pg_ident_quote(revision_schema_ident),
-            q_revision_ident=self._pg_ident_quote(revision_ident),
+            q_revision_table=self._q_revision_table(revision_schema_ident, revision_ident),
             q_application=self._pg_quote(self._application),
             q_schemas_type=self._pg_quote(host_type),
             q_revision=self._pg_quote(revision),
         )
 
-        return 'do {};'.format(self._pg_dollar_quote('do', guard_revision_body))
-
     def _clean_revision(self, revision_schema_ident, revision_ident, host_type):
         return self._clean_revision_sql.format(
             q_revision_schema_ident=self._pg_ident_quote(revision_schema_ident),
-            q_revision_ident=self._pg_ident_quote(revision_ident),
+            q_revision_table=self._q_revision_table(revision_schema_ident, revision_ident),
             q_application=self._pg_quote(self._application),
             q_schemas_type=self._pg_quote(host_type),
         )
@@ -236,8 +398,9 @@ class RevisionSql:
 
         return self._push_revision_sql.format(
             q_revision_schema_ident=self._pg_ident_quote(revision_schema_ident),
-            q_revision_ident=self._pg_ident_quote(revision_ident),
-            q_revision_history_ident=self._pg_ident_quote(revision_history_ident),
+            q_revision_table=self._q_revision_table(revision_schema_ident, revision_ident),
+            q_revision_history_table=self._q_revision_table(
+                revision_schema_ident, revision_history_ident),
             q_application=self._pg_quote(self._application),
             q_schemas_type=self._pg_quote(host_type),
             q_revision=self._pg_quote(revision),
@@ -277,18 +440,58 @@ class RevisionSql:
             q_application=self._pg_quote(self._application),
             q_schemas_type=self._pg_quote(host_type),
             q_schemas=q_schemas,
+            q_chunk_size=int(self._drop_routines_chunk_size),
         )
 
         return 'do {};'.format(self._pg_dollar_quote('do', drop_schemas_safe_body))
 
+    def _guard_drop_locks(self, revision_schema_ident, revision_ident, host_type, schemas):
+        # the lock table is shared by all sessions of the cluster, so all their
+        # locks are counted (but the fast path locks, which are not kept there).
+        # the estimate is a lower bound: the objects of the schemas and
+        # their direct dependents
+
+        if schemas is not None:
+            q_schemas = 'array[{}\n]'.format(
+                ','.join('\n{}'.format(self._pg_quote(x)) for x in schemas),
+            )
+        else:
+            q_schemas = 'null'
+
+        if self._lock_budget is not None:
+            q_lock_budget = int(self._lock_budget)
+        else:
+            q_lock_budget = 'null'
+
+        guard_drop_locks_body = self._guard_drop_locks_sql.format(
+            q_revision_schema_ident=self._pg_ident_quote(revision_schema_ident),
+            q_revision_ident=self._pg_ident_quote(revision_ident),
+            q_application=self._pg_quote(self._application),
+            q_schemas_type=self._pg_quote(host_type),
+            q_schemas=q_schemas,
+            q_lock_budget=q_lock_budget,
+        )
+
+        return 'do {};'.format(self._pg_dollar_quote('do', guard_drop_locks_body))
+
     def ensure_revision_structs(self, host_type):
         application_ident = self._revision_sql_utils.make_ident(self._application)
         host_type_ident = self._revision_sql_utils.make_ident(host_type)
         q_revision_schema_ident = self._pg_ident_quote(
             self._revision_sql_utils.revision_schema_ident(application_ident),
         )
+        q_revision_schema = self._pg_quote(
+            self._revision_sql_utils.revision_schema_ident(application_ident),
+        )
+
+        # the checks of the structs and their creations are not atomic, so
+        # the concurrent deploys to one database take a transaction lock
+        # first, and the second one sees the structs of the first one
 
         create_list = [
+            'do {};'.format(self._pg_dollar_quote('do', self._lock_revision_structs_sql.format(
+                q_revision_schema=q_revision_schema,
+            ))),
             self._create_revision_schema_sql.format(
                 q_revision_schema_ident=q_revision_schema_ident,
             ),
@@ -316,27 +519,63 @@ class RevisionSql:
                     self._revision_sql_utils.func_revision_history_ident(host_type_ident),
                 ),
             ),
+            'do {};'.format(self._pg_dollar_quote('do', 'begin\n{}\nend'.format(
+                '\n'.join(
+                    self._create_revision_function_sql.format(
+                        q_revision_schema=q_revision_schema,
+                        q_function=self._pg_quote(function),
+                        q_create_function=self._pg_dollar_quote(
+                            'create',
+                            function_sql.format(
+                                q_revision_schema_ident=q_revision_schema_ident,
+                            ),
+                        ),
+                    )
+                    for function, function_sql in self._revision_function_sql_map.items()
+                ),
+            ))),
         ]
 
         return '\n\n'.join(create_list)
 
-    def fetch_var_revision(self, recv, host_name, host_type):
+    def _fetch_revision(self, con, recv, host_name, host_type):
         application_ident = self._revision_sql_utils.make_ident(self._application)
         host_type_ident = self._revision_sql_utils.make_ident(host_type)
         revision_schema_ident = self._revision_sql_utils.revision_schema_ident(application_ident)
-        revision_ident = self._revision_sql_utils.var_revision_ident(host_type_ident)
 
-        return self._fetch_revision(
-                recv, host_name, revision_schema_ident, revision_ident, host_type)
+        try:
+            with con.cursor() as cur:
+                cur.execute(
+                    self._fetch_revision_sql.format(
+                        q_revision_schema_ident=self._pg_ident_quote(
+                            revision_schema_ident,
+                        ).replace('%', '%%'),
+                    ),
+                    {
+                        'var_revision_table': self._revision_table(
+                            revision_schema_ident,
+                            self._revision_sql_utils.var_revision_ident(host_type_ident),
+                        ),
+                        'func_revision_table': self._revision_table(
+                            revision_schema_ident,
+                            self._revision_sql_utils.func_revision_ident(host_type_ident),
+                        ),
+                        'application': self._application,
+                        'schemas_type': host_type,
+                    },
+                )
+
+                var_revision, var_comment, func_revision, func_comment = cur.fetchone()
 
-    def fetch_func_revision(self, recv, host_name, host_type):
-        application_ident = self._revision_sql_utils.make_ident(self._application)
-        host_type_ident = self._revision_sql_utils.make_ident(host_type)
-        revision_schema_ident = self._revision_sql_utils.revision_schema_ident(application_ident)
-        revision_ident = self._revision_sql_utils.func_revision_ident(host_type_ident)
+                return var_revision, var_comment, func_revision, func_comment
+        except recv.con_error as e:
+            raise RevisionSqlError('{!r}: {!r}: {}'.format(host_name, type(e), e)) from e
 
-        return self._fetch_revision(
-                recv, host_name, revision_schema_ident, revision_ident, host_type)
+    def submit_fetch_revision(self, recv, host_name, host_type):
+        # the revisions of all hosts are fetched concurrently. the result
+        # is taken by ``recv.con_func_result()``
+
+        return recv.submit_con_func(host_name, self._fetch_revision, recv, host_name, host_type)
 
     def guard_var_revision(self, host_type, revision):
         application_ident = self._revision_sql_utils.make_ident(self._application)
@@ -413,7 +652,15 @@ class RevisionSql:
         if not cascade:
             raise AssertionError('drop variable schema can not be safe')
 
-        return self._drop_schemas_cascade(revision_schema_ident, revision_ident, host_type, schemas)
+        # every dropped object is locked until the commit, so the estimation
+        # goes before dropping to avoid running out of the shared lock table
+
+        drop_list = [
+            self._guard_drop_locks(revision_schema_ident, revision_ident, host_type, schemas),
+            self._drop_schemas_cascade(revision_schema_ident, revision_ident, host_type, schemas),
+        ]
+
+        return '\n\n'.join(drop_list)
 
     def drop_func_schemas(self, host_type, schemas, cascade):
         application_ident = self._revision_sql_utils.make_ident(self._application)
@@ -426,6 +673,11 @@ class RevisionSql:
         else:
             drop_func = self._drop_schemas_safe
 
-        return drop_func(revision_schema_ident, revision_ident, host_type, schemas)
+        drop_list = [
+            self._guard_drop_locks(revision_schema_ident, revision_ident, host_type, schemas),
+            drop_func(revision_schema_ident, revision_ident, host_type, schemas),
+        ]
+
+        return '\n\n'.join(drop_list)
 
 # vi:ts=4:sw=4:et
@@ -1,13 +1,14 @@
 def read_safeguard_sql(cluster_descr, host_type):
-    for schemas_descr in cluster_descr.schemas_list:
-        if schemas_descr.schemas_type != host_type:
-            continue
+    schemas_descr = cluster_descr.schemas_map.get(host_type)
 
-        safeguard_descr = schemas_descr.safeguard
+    if schemas_descr is None:
+        return
 
-        if safeguard_descr is None:
-            continue
+    safeguard_descr = schemas_descr.safeguard
 
-        yield from safeguard_descr.read_sql()
+    if safeguard_descr is None:
+        return
+
+    yield from safeguard_descr.read_sql()
 
 # vi:ts=4:sw=4:et
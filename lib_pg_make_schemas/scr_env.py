@@ -1,9 +1,25 @@
+import functools
 import json
 from . import pg_literal
 
 def _json_dumps(value):
     return json.dumps(value, indent=4)
 
+@functools.lru_cache(maxsize=4)
+def _shared_func(shared_dump, pg_dollar_quote_func):
+    # the same dumped ``shared`` object comes for every host, so its
+    # (possibly big) function is quoted only once
+
+    shared_body = 'select {}::json'.format(
+        pg_dollar_quote_func('json', shared_dump),
+    )
+
+    return 'create function pg_temp.scr_env_shared ()\n' \
+            'returns json language sql stable\n' \
+            'as {};'.format(
+                pg_dollar_quote_func('function', shared_body),
+            )
+
 def scr_env(
             hosts_descr,
             host_name,
@@ -11,25 +27,23 @@ def scr_env(
             pg_quote_func=pg_literal.pg_quote,
             pg_dollar_quote_func=pg_literal.pg_dollar_quote,
         ):
-    host_type = None
-    host_params = None
+    host = hosts_descr.host_map.get(host_name)
 
-    for other_host in hosts_descr.host_list:
-        other_host_name = other_host['name']
-        other_host_type = other_host['type']
-        other_host_params = other_host['params']
-
-        if other_host_name == host_name:
-            host_type = other_host_type
-            host_params = other_host_params
+    if host is not None:
+        host_type = host['type']
+        host_params = host['params']
+    else:
+        host_type = None
+        host_params = None
 
     host_name_body = 'select {}::text'.format(pg_quote_func(host_name))
     host_type_body = 'select {}::text'.format(pg_quote_func(host_type))
     host_params_body = 'select {}::json'.format(
         pg_dollar_quote_func('json', json_dumps_func(host_params)),
     )
-    shared_body = 'select {}::json'.format(
-        pg_dollar_quote_func('json', json_dumps_func(hosts_descr.shared)),
+    shared_func = _shared_func(
+        hosts_descr.dump_shared(json_dumps_func),
+        pg_dollar_quote_func,
     )
 
     func_list = [
@@ -48,11 +62,7 @@ def scr_env(
                 'as {};'.format(
                     pg_dollar_quote_func('function', host_params_body),
                 ),
-        'create function pg_temp.scr_env_shared ()\n'
-                'returns json language sql stable\n'
-                'as {};'.format(
-                    pg_dollar_quote_func('function', shared_body),
-                ),
+        shared_func,
     ]
 
     return '\n\n'.join(func_list)
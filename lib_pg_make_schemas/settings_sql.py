@@ -1,8 +1,9 @@
 def read_settings_sql(cluster_descr, host_type):
-    for settings_descr in cluster_descr.settings_list:
-        if settings_descr.settings_type != host_type:
-            continue
+    settings_descr = cluster_descr.settings_map.get(host_type)
 
-        yield from settings_descr.read_sql()
+    if settings_descr is None:
+        return
+
+    yield from settings_descr.read_sql()
 
 # vi:ts=4:sw=4:et
@@ -0,0 +1,322 @@
+import re
+
+_token_re = re.compile(rb'[;\'"]|--|/\*|\$(?:[A-Za-z_\x80-\xff][A-Za-z_0-9\x80-\xff]*)?\$')
+_word_token_re = re.compile(
+    rb'[;\'"()]|--|/\*|\$(?:[A-Za-z_\x80-\xff][A-Za-z_0-9\x80-\xff]*)?\$|'
+    rb'[A-Za-z_\x80-\xff][A-Za-z_0-9$\x80-\xff]*',
+)
+_non_routine_head_re = re.compile(rb'\s*[^cC\-/\s]')
+_escape_quote_re = re.compile(rb'[\\\']')
+_newline_re = re.compile(rb'[\r\n]')
+_block_comment_re = re.compile(rb'/\*|\*/')
+_ident_byte_set = frozenset(
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_$' + bytes(range(0x80, 0x100)),
+)
+
+# a token (e.g. a dollar quote tag) is not taken from the end of
+# the buffer, because its rest might be not read yet
+
+_token_margin = 66
+_routine_head_set = frozenset((
+    (b'create', b'function'),
+    (b'create', b'procedure'),
+    (b'create', b'or', b'replace', b'function'),
+    (b'create', b'or', b'replace', b'procedure'),
+))
+
+def _is_routine_head(head_list):
+    # ``True``, ``False`` or ``None`` (more words are needed)
+
+    head = tuple(head_list)
+
+    if head in _routine_head_set:
+        return True
+
+    if any(routine_head[:len(head)] == head for routine_head in _routine_head_set):
+        return None
+
+    return False
+
+def check_sql_bytes(content):
+    # the same check and newline translation as the text reading does
+
+    if not content.isascii():
+        content.decode('utf-8')
+
+    if b'\r' in content:
+        content = content.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+    return content
+
+def iter_sql_piece(read_func, piece_size, read_size=None):
+    # yields pieces of sql. every piece but the last one is a sequence of
+    # whole statements which ends with a semicolon. the string literals,
+    # quoted identifiers, comments and dollar quoted strings are skipped,
+    # so a semicolon inside them does not end a statement.
+    # the sql-standard body of a function (``begin atomic ... end``) is
+    # found the way psql finds it: in ``create [or replace] function`` or
+    # ``procedure`` the ``begin``, ``case`` and ``end`` words out of
+    # parentheses are counted. only the first words of other statements
+    # are looked at.
+    # the pieces put together are the same as the whole sql
+
+    if read_size is None:
+        read_size = 1024 * 1024
+
+    buf = bytearray()
+    pos = 0
+    piece_end = 0
+    state = None
+    quote = None
+    depth = 0
+    tag = None
+    eof = False
+
+    # the statement is a routine (``True``), is not a routine (``False``)
+    # or its first words are not read yet (``None``)
+
+    routine = None
+    head_list = []
+    paren_depth = 0
+    begin_depth = 0
+
+    while True:
+        need_more = False
+
+        if state is None:
+            m = (_token_re if routine is False else _word_token_re).search(buf, pos)
+
+            if m is None:
+                pos = max(pos, len(buf) - _token_margin)
+                need_more = True
+            elif not eof and m.end() + _token_margin > len(buf):
+                pos = m.start()
+                need_more = True
+            else:
+                token = m.group()
+                start = m.start()
+                pos = m.end()
+
+                if token == b';':
+                    if not begin_depth:
+                        piece_end = pos
+                        head_list = []
+                        paren_depth = 0
+
+                        # most statements are seen not to be routines
+                        # by their first letter
+
+                        if _non_routine_head_re.match(buf, pos):
+                            routine = False
+                        else:
+                            routine = None
+
+                        if piece_end >= piece_size:
+                            yield bytes(buf[:piece_end])
+
+                            del buf[:piece_end]
+                            pos = 0
+                            piece_end = 0
+                elif token == b'\'':
+                    if start and buf[start - 1] in b'Ee' and \
+                            not (start > 1 and buf[start - 2] in _ident_byte_set):
+                        state = 'escape_quote'
+                    else:
+                        state = 'quote'
+                        quote = b'\''
+                elif token == b'"':
+                    state = 'quote'
+                    quote = b'"'
+                elif token == b'--':
+                    state = 'line_comment'
+                elif token == b'/*':
+                    state = 'block_comment'
+                    depth = 1
+                elif token == b'(':
+                    paren_depth += 1
+                elif token == b')':
+                    if paren_depth:
+                        paren_depth -= 1
+                elif token[:1] != b'$':
+                    # a word
+                    word = token.lower()
+
+                    if routine is None:
+                        if head_list or word == b'create':
+                            head_list.append(word)
+                            routine = _is_routine_head(head_list)
+                        else:
+                            routine = False
+                    elif not paren_depth:
+                        if word == b'begin':
+                            begin_depth += 1
+                        elif word == b'case':
+                            # ``case`` also ends with ``end``
+
+                            if begin_depth:
+                                begin_depth += 1
+                        elif word == b'end':
+                            if begin_depth:
+                                begin_depth -= 1
+                elif start and buf[start - 1] in _ident_byte_set:
+                    # a ``$`` inside of an identifier
+
+                    pos = start + 1
+                else:
+                    state = 'dollar_quote'
+                    tag = bytes(token)
+        elif state == 'quote':
+            i = buf.find(quote, pos)
+
+            if i < 0:
+                pos = len(buf)
+                need_more = True
+            elif i + 1 == len(buf) and not eof:
+                pos = i
+                need_more = True
+            elif buf[i + 1:i + 2] == quote:
+                pos = i + 2
+            else:
+                pos = i + 1
+                state = None
+        elif state == 'escape_quote':
+            m = _escape_quote_re.search(buf, pos)
+
+            if m is None:
+                pos = len(buf)
+                need_more = True
+            elif m.end() == len(buf) and not eof:
+                pos = m.start()
+                need_more = True
+            elif m.group() == b'\\':
+                pos = m.end() + 1
+            elif buf[m.end():m.end() + 1] == b'\'':
+                pos = m.end() + 1
+            else:
+                pos = m.end()
+                state = None
+        elif state == 'line_comment':
+            m = _newline_re.search(buf, pos)
+
+            if m is None:
+                pos = len(buf)
+                need_more = True
+            else:
+                pos = m.end()
+                state = None
+        elif state == 'block_comment':
+            m = _block_comment_re.search(buf, pos)
+
+            if m is None:
+                pos = max(pos, len(buf) - 1)
+                need_more = True
+            else:
+                pos = m.end()
+
+                if m.group() == b'/*':
+                    depth += 1
+                else:
+                    depth -= 1
+
+                    if not depth:
+                        state = None
+        else:
+            i = buf.find(tag, pos)
+
+            if i < 0:
+                pos = max(pos, len(buf) - len(tag) + 1)
+                need_more = True
+            else:
+                pos = i + len(tag)
+                state = None
+
+        if need_more:
+            if eof:
+                break
+
+            chunk = read_func(read_size)
+
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+
+    if buf:
+        yield bytes(buf)
+
+_space_byte_set = frozenset(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')
+
+def rstrip_len(sql_bytes):
+    # the length of ``sql_bytes.decode('utf-8').rstrip()`` in bytes,
+    # found without decoding (or copying) the whole sql
+
+    end = len(sql_bytes)
+
+    while end:
+        if sql_bytes[end - 1] < 0x80:
+            if sql_bytes[end - 1] not in _space_byte_set:
+                break
+
+            end -= 1
+
+            continue
+
+        start = end - 1
+
+        while start and end - start < 4 and 0x80 <= sql_bytes[start] < 0xc0:
+            start -= 1
+
+        if not sql_bytes[start:end].decode('utf-8').isspace():
+            break
+
+        end = start
+
+    return end
+
+class SqlStream:
+    # a large sql file which is not kept in memory. every iteration opens
+    # the file again (with the same checks) and yields its pieces of whole
+    # statements. the last piece is stripped and gets ``suffix``
+
+    piece_size = 1024 * 1024
+
+    def __init__(self, load_utils, file_path, include_list, suffix=None):
+        self._load_utils = load_utils
+        self.file_path = file_path
+        self.include_list = include_list
+        self.suffix = suffix
+
+    def with_suffix(self, suffix):
+        return type(self)(self._load_utils, self.file_path, self.include_list, suffix=suffix)
+
+    def _iter_checked_piece(self):
+        with self._load_utils.open_sql_for_r(self.file_path, self.include_list) as fd:
+            for piece in iter_sql_piece(fd.read, self.piece_size):
+                yield check_sql_bytes(piece)
+
+    def __iter__(self):
+        if self.suffix is None:
+            yield from self._iter_checked_piece()
+
+            return
+
+        # only the last piece might be a tail of spaces, because every
+        # other piece ends with a semicolon
+
+        prev_piece = None
+
+        for piece in self._iter_checked_piece():
+            if prev_piece is not None:
+                yield prev_piece
+
+            prev_piece = piece
+
+        # the tail is stripped the same way as a file which is read
+        # as a whole is stripped, that is as ``str.rstrip()`` does
+
+        if prev_piece is None:
+            prev_piece = b''
+
+        yield prev_piece[:rstrip_len(prev_piece)] + self.suffix
+
+# vi:ts=4:sw=4:et
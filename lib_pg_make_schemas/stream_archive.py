@@ -0,0 +1,340 @@
+import os, os.path
+import re
+import json
+import threading
+from . import output_writer
+from . import output_store
+
+_magic = b'pg-make-schemas-archive 1\n'
+_record_head_re = re.compile(rb'(\d+) (\d+)\n')
+_trailer_re = re.compile(rb'index (\d{20})\n')
+_trailer_size = 27
+_max_record_head_size = 64
+
+def _make_record_head(name_bytes, size):
+    return '{} {}\n'.format(len(name_bytes), size).encode('ascii')
+
+class ArchiveStream:
+    # an output file of the archive. it has the same methods as
+    # an output file has, but it does not hold a file handle
+
+    def __init__(self, archive, name):
+        self._archive = archive
+        self.name = name
+        self._data_list = []
+        self._data_size = 0
+        self._closed = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        if not data:
+            return
+
+        self._archive._write(self, data)
+
+    def flush(self):
+        # a fragment boundary
+
+        self._archive._flush(self)
+
+    def close(self):
+        self._archive._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ArchiveWriter:
+    # one append-only file for the output files of all hosts, so the
+    # number of open file handles and of writing threads does not grow
+    # with the number of hosts. the data of every stream is buffered and
+    # goes to the archive as a record ``<name size> <data size>\n<name><data>``
+    # when the buffer exceeds ``chunk_size``, or when all buffers together
+    # exceed ``max_buffered_size``, or when the stream is closed.
+    # the last record has an empty name and the json index of the streams,
+    # and the trailer keeps the offset of this record. an archive without
+    # its index (e.g. an interrupted run) is still read by a scan
+
+    chunk_size = 64 * 1024
+    max_buffered_size = 16 * 1024 * 1024
+
+    def __init__(self, archive_path, buffer_size=None, fragment_flush=None, durable=None):
+        if fragment_flush is None:
+            fragment_flush = False
+
+        self.archive_path = archive_path
+        self._fragment_flush = fragment_flush
+        self._lock = threading.Lock()
+        self._stream_map = {}
+        self._index_map = {}
+        self._buffered_size = 0
+        self._offset = 0
+        self._closed = False
+
+        self._writer = output_writer.OutputWriter(
+            archive_path,
+            buffer_size=buffer_size,
+            fragment_flush=fragment_flush,
+            durable=durable,
+        )
+
+        self._writer.write(_magic)
+        self._offset = len(_magic)
+
+    def _append(self, name_bytes, data):
+        head = _make_record_head(name_bytes, len(data))
+
+        if name_bytes and data:
+            data_offset = self._offset + len(head) + len(name_bytes)
+
+            self._index_map[name_bytes.decode('utf-8')].append((data_offset, len(data)))
+
+        self._writer.write(head + name_bytes)
+        self._offset += len(head) + len(name_bytes)
+
+        self._writer.write(data)
+        self._offset += len(data)
+
+    def _append_stream(self, stream):
+        if not stream._data_size:
+            return
+
+        data = b''.join(stream._data_list)
+
+        self._buffered_size -= stream._data_size
+        stream._data_list = []
+        stream._data_size = 0
+
+        self._append(stream.name.encode('utf-8'), data)
+
+    def open_stream(self, name):
+        with self._lock:
+            if self._closed:
+                raise ValueError('{!r}: the archive is closed'.format(self.archive_path))
+
+            if name in self._index_map:
+                raise ValueError('{!r}, {!r}: non unique stream name'.format(
+                    name,
+                    self.archive_path,
+                ))
+
+            stream = ArchiveStream(self, name)
+
+            self._index_map[name] = []
+            self._stream_map[name] = stream
+
+            # an empty record, so an empty stream is also found by a scan
+
+            self._append(name.encode('utf-8'), b'')
+
+            return stream
+
+    def _write(self, stream, data):
+        with self._lock:
+            if stream._closed:
+                raise ValueError('{!r}, {!r}: the stream is closed'.format(
+                    stream.name,
+                    self.archive_path,
+                ))
+
+            stream._data_list.append(data)
+            stream._data_size += len(data)
+            self._buffered_size += len(data)
+
+            if stream._data_size >= self.chunk_size:
+                self._append_stream(stream)
+            elif self._buffered_size >= self.max_buffered_size:
+                for other_stream in self._stream_map.values():
+                    self._append_stream(other_stream)
+
+    def _flush(self, stream):
+        if not self._fragment_flush:
+            return
+
+        with self._lock:
+            self._append_stream(stream)
+
+        self._writer.flush()
+
+    def _close(self, stream):
+        with self._lock:
+            if stream._closed:
+                return
+
+            stream._closed = True
+            self._append_stream(stream)
+
+            del self._stream_map[stream.name]
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+
+        try:
+            with self._lock:
+                for stream in list(self._stream_map.values()):
+                    stream._closed = True
+                    self._append_stream(stream)
+
+                self._stream_map.clear()
+
+                index_offset = self._offset
+
+                self._append(b'', json.dumps(
+                    [[name, span_list] for name, span_list in self._index_map.items()],
+                    separators=(',', ':'),
+                ).encode('utf-8'))
+                self._writer.write('index {:020d}\n'.format(index_offset).encode('ascii'))
+        finally:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ArchiveReader:
+    read_size = 1024 * 1024
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.complete = None
+        self._index_map = None
+        self._fd = open(archive_path, 'rb')
+
+    def _read_record_head(self):
+        head = self._fd.readline(_max_record_head_size)
+        m = _record_head_re.fullmatch(head)
+
+        if m is None:
+            return None
+
+        return len(head), int(m.group(1)), int(m.group(2))
+
+    def _load_index(self):
+        fd = self._fd
+
+        fd.seek(0)
+
+        if fd.read(len(_magic)) != _magic:
+            raise ValueError('{!r}: not an output archive'.format(self.archive_path))
+
+        archive_size = fd.seek(0, os.SEEK_END)
+
+        if archive_size >= len(_magic) + _trailer_size:
+            fd.seek(archive_size - _trailer_size)
+            m = _trailer_re.fullmatch(fd.read(_trailer_size))
+
+            if m is not None:
+                fd.seek(int(m.group(1)))
+                record_head = self._read_record_head()
+
+                if record_head is not None and not record_head[1]:
+                    index_list = json.loads(fd.read(record_head[2]).decode('utf-8'))
+
+                    self.complete = True
+
+                    return {
+                        name: [tuple(span) for span in span_list]
+                        for name, span_list in index_list
+                    }
+
+        # the archive has no index. it is scanned up to its last whole record
+
+        self.complete = False
+        index_map = {}
+        offset = len(_magic)
+
+        fd.seek(offset)
+
+        while True:
+            record_head = self._read_record_head()
+
+            if record_head is None:
+                break
+
+            head_size, name_size, data_size = record_head
+            data_offset = offset + head_size + name_size
+
+            if not name_size or data_offset + data_size > archive_size:
+                break
+
+            name = fd.read(name_size).decode('utf-8')
+
+            index_map.setdefault(name, [])
+
+            if data_size:
+                index_map[name].append((data_offset, data_size))
+
+            offset = fd.seek(data_offset + data_size)
+
+        return index_map
+
+    def _get_index_map(self):
+        if self._index_map is None:
+            self._index_map = self._load_index()
+
+        return self._index_map
+
+    def name_list(self):
+        return list(self._get_index_map())
+
+    def iter_data(self, name):
+        index_map = self._get_index_map()
+
+        if name not in index_map:
+            raise ValueError('{!r}, {!r}: no such stream'.format(name, self.archive_path))
+
+        for data_offset, data_size in index_map[name]:
+            self._fd.seek(data_offset)
+
+            while data_size:
+                data = self._fd.read(min(data_size, self.read_size))
+
+                if not data:
+                    raise ValueError('{!r}, {!r}: unexpected end of archive'.format(
+                        name,
+                        self.archive_path,
+                    ))
+
+                data_size -= len(data)
+
+                yield data
+
+    def export(self, name, output_path):
+        # only one output file is open at a time
+
+        tmp_file_path = output_store._tmp_file_path(output_path)
+
+        try:
+            with open(tmp_file_path, 'wb') as fd:
+                for data in self.iter_data(name):
+                    fd.write(data)
+
+            os.replace(tmp_file_path, output_path)
+        except:
+            try:
+                os.unlink(tmp_file_path)
+            except OSError:
+                pass
+
+            raise
+
+    def close(self):
+        self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# vi:ts=4:sw=4:et
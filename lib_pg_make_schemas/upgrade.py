@@ -92,57 +92,70 @@ def find_migr_way(
     if migrations_descr is None:
         return
 
-    comp_list_map = {}
-    migr_list_candidates = []
-
-    for migration_descr in migrations_descr.migration_list:
-        comp_list = comp_list_map.setdefault(migration_descr.revision, [])
-        comp_list.extend(migration_descr.compatible_list)
-
-        if migration_descr.revision != target_rev:
-            continue
-
-        for comp_rev in migration_descr.compatible_list:
-            migr_list_candidates.append([(target_rev, comp_rev)])
-
-    result_migr_list = None
-
-    while migr_list_candidates:
-        for migr_list in migr_list_candidates:
-            top_from_rev = migr_list[0][1]
-
-            if top_from_rev != var_rev:
-                continue
-
-            if result_migr_list is not None:
-                raise AmbiguousUpgradeError(
-                    '{!r}, {!r}: ambiguous migration way'.format(
-                        result_migr_list,
-                        migr_list,
-                    ),
-                )
-
-            result_migr_list = migr_list
+    # breadth-first search from the target revision back along the compatible
+    # revisions. for every reached revision it keeps up to two next revisions
+    # of its shortest ways and the count of these ways capped at 2, that is
+    # enough to build the way or to report two ambiguous ones
+
+    compatible_map = migrations_descr.compatible_map
+    depth_map = {target_rev: 0}
+    next_rev_map = {target_rev: []}
+    way_cnt_map = {target_rev: 1}
+    rev_list = [target_rev]
+    depth = 0
+
+    while rev_list and var_rev not in depth_map:
+        depth += 1
+        next_rev_list = []
+
+        for rev in rev_list:
+            for comp_rev in compatible_map.get(rev, ()):
+                comp_depth = depth_map.get(comp_rev)
+
+                if comp_depth is None:
+                    depth_map[comp_rev] = depth
+                    next_rev_map[comp_rev] = [rev]
+                    way_cnt_map[comp_rev] = way_cnt_map[rev]
+                    next_rev_list.append(comp_rev)
+                elif comp_depth == depth:
+                    if len(next_rev_map[comp_rev]) < 2:
+                        next_rev_map[comp_rev].append(rev)
+
+                    way_cnt_map[comp_rev] = min(way_cnt_map[comp_rev] + way_cnt_map[rev], 2)
+
+        rev_list = next_rev_list
+
+    if var_rev not in depth_map:
+        return
 
-        if result_migr_list is not None:
-            return result_migr_list
+    def make_migr_list(alt):
+        migr_list = []
+        rev = var_rev
 
-        next = []
+        while rev != target_rev:
+            next_rev_list = next_rev_map[rev]
 
-        for migr_list in migr_list_candidates:
-            top_from_rev = migr_list[0][1]
+            if alt and len(next_rev_list) > 1:
+                next_rev = next_rev_list[1]
+                alt = False
+            else:
+                next_rev = next_rev_list[0]
 
-            comp_list = comp_list_map.get(top_from_rev)
+            migr_list.append((next_rev, rev))
+            rev = next_rev
 
-            if comp_list is None:
-                continue
+        return migr_list
 
-            for comp_rev in comp_list:
-                if (top_from_rev, comp_rev) in comp_list:
-                    continue
+    result_migr_list = make_migr_list(False)
 
-                next.append([(top_from_rev, comp_rev)] + migr_list)
+    if way_cnt_map[var_rev] > 1:
+        raise AmbiguousUpgradeError(
+            '{!r}, {!r}: ambiguous migration way'.format(
+                result_migr_list,
+                make_migr_list(True),
+            ),
+        )
 
-        migr_list_candidates = next
+    return result_migr_list
 
 # vi:ts=4:sw=4:et
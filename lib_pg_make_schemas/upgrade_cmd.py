@@ -2,12 +2,14 @@ import os, os.path
 import contextlib
 from . import verbose
 from . import descr
+from . import descr_cache
 from . import settings
 from . import revision_sql
 from . import comment
 from . import receivers
 from . import install
 from . import pg_role_path
+from . import render_cache
 from . import scr_env
 from . import upgrade
 from . import init_sql
@@ -33,6 +35,42 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
         hosts_descr.load(hosts_path)
 
+        # the descriptors of other host types are loaded as headers only
+
+        type_set = frozenset(host['type'] for host in hosts_descr.host_list)
+    else:
+        type_set = None
+
+    if args_ctx.compiled_descr is not None:
+        compiled_doc_path = os.path.realpath(args_ctx.compiled_descr)
+    else:
+        compiled_doc_path = None
+
+    if args_ctx.descr_cache is not None:
+        cache = descr_cache.DescrCache(os.path.realpath(args_ctx.descr_cache))
+
+        cache.load()
+
+        load_utils = descr_cache.CachedLoadUtils(
+            cache,
+            compiled_doc_path=compiled_doc_path,
+            jobs=args_ctx.load_jobs,
+            read_ahead=args_ctx.read_ahead,
+            read_ahead_size=args_ctx.read_ahead_size,
+            stream_size=args_ctx.stream_size,
+        )
+    else:
+        cache = None
+        load_utils = descr.LoadUtils(
+            compiled_doc_path=compiled_doc_path,
+            jobs=args_ctx.load_jobs,
+            read_ahead=args_ctx.read_ahead,
+            read_ahead_size=args_ctx.read_ahead_size,
+            stream_size=args_ctx.stream_size,
+        )
+
+    rend = render_cache.RenderCache(max_size=args_ctx.render_cache_size)
+
     include_list = []
     include_ref_map = {}
 
@@ -48,15 +86,19 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
         descr.ClusterDescr.file_name,
     ))
     source_code_include_list = include_list + [os.path.dirname(source_code_file_path)]
-    source_code_cluster_descr = descr.ClusterDescr()
-
-    source_code_cluster_descr.load(
-            source_code_file_path, source_code_include_list, include_ref_map)
+    source_code_cluster_descr = load_utils.load_descr(
+        descr.ClusterDescr(load_utils=load_utils),
+        source_code_file_path, source_code_include_list, include_ref_map,
+        type_set=type_set,
+    )
 
     if args_ctx.hosts is None:
         hosts_descr.load_pseudo(source_code_cluster_descr)
 
-    rev_sql = revision_sql.RevisionSql(source_code_cluster_descr.application)
+    rev_sql = revision_sql.RevisionSql(
+        source_code_cluster_descr.application,
+        lock_budget=args_ctx.lock_budget,
+    )
 
     settings_cluster_descr_list = []
 
@@ -79,13 +121,13 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
             descr.ClusterDescr.file_name,
         ))
         settings_include_list = include_list + [os.path.dirname(settings_file_path)]
-        settings_cluster_descr = descr.ClusterDescr()
-
-        settings_cluster_descr.load(
+        settings_cluster_descr = load_utils.load_descr(
+            descr.ClusterDescr(load_utils=load_utils),
             settings_file_path,
             settings_include_list,
             include_ref_map,
             settings_mode=True,
+            type_set=type_set,
         )
 
         settings.check_settings_compatibility(
@@ -95,6 +137,11 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
         settings_cluster_descr_list.append(settings_cluster_descr)
 
+    if cache is not None:
+        cache.save()
+
+        verb.descr_cache(cache.cache_file_path, cache.hit_cnt, cache.miss_cnt)
+
     var_rev_map = {}
     var_com_map = {}
     func_rev_map = {}
@@ -107,22 +154,30 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
         com,
     )
 
-    with contextlib.closing(
+    with contextlib.closing(load_utils), contextlib.closing(
                 receivers.Receivers(
                     args_ctx.execute,
                     args_ctx.pretend,
                     args_ctx.output,
+                    jobs=args_ctx.jobs,
+                    batch_size=args_ctx.batch_size,
+                    lazy_role_path=args_ctx.lazy_role_path,
+                    output_buffer_size=args_ctx.output_buffer_size,
+                    output_flush=args_ctx.output_flush,
+                    output_fsync=args_ctx.output_fsync,
+                    output_dedup=args_ctx.output_dedup,
+                    output_archive=args_ctx.output_archive,
                 ),
             ) as recv:
         recv.begin(hosts_descr, begin_host_verb_func=verb.begin_host)
 
+        fetch_revision_map = {}
+
         for host in hosts_descr.host_list:
             host_name = host['name']
             host_type = host['type']
 
-            func_schemas = install.func_schemas(source_code_cluster_descr, host_type)
-
-            recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+            recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
             verb.scr_env(host_name, recv.look_fragment_i(host_name))
 
@@ -132,12 +187,25 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
             recv.execute(host_name, rev_sql.ensure_revision_structs(host_type))
 
+            if args_ctx.rev is None:
+                # the revisions of all hosts are fetched concurrently
+                # before the first one is used
+
+                fetch_revision_map[host_name] = rev_sql.submit_fetch_revision(
+                        recv, host_name, host_type)
+
+        for host in hosts_descr.host_list:
+            host_name = host['name']
+            host_type = host['type']
+
+            func_schemas = install.func_schemas(source_code_cluster_descr, host_type)
+
             if args_ctx.rev is not None:
                 host_var_rev, host_var_com = args_ctx.rev, None
                 host_func_rev, host_func_com = args_ctx.rev, None
             else:
-                host_var_rev, host_var_com = rev_sql.fetch_var_revision(recv, host_name, host_type)
-                host_func_rev, host_func_com = rev_sql.fetch_func_revision(recv, host_name, host_type)
+                host_var_rev, host_var_com, host_func_rev, host_func_com = recv.con_func_result(
+                        host_name, fetch_revision_map[host_name])
 
                 upgrade.print_revision(
                     host_name,
@@ -186,6 +254,8 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
             func_com_map[host_name] = host_func_com
             migr_list_map[host_name] = host_migr_list
 
+        recv.wait()
+
         if not args_ctx.show_rev:
             if not args_ctx.change_rev:
                 for host in hosts_descr.host_list:
@@ -206,20 +276,24 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
                         host_type = host['type']
 
                         for i, sql in enumerate(
-                                    init_sql.read_init_sql(source_code_cluster_descr, host_type),
+                                    rend.render_sql(
+                                        ('init_sql', source_code_cluster_descr, host_type),
+                                        init_sql.read_init_sql(source_code_cluster_descr, host_type),
+                                        None, None,
+                                    ),
                                 ):
                             if not i:
                                 verb.execute_sql(
                                         host_name, 'init_sql', recv.look_fragment_i(host_name))
 
-                            sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                             verb.execute_sql(
                                     host_name, 'init_sql', recv.look_fragment_i(host_name),
                                     sql=sql)
 
                             recv.execute(host_name, sql)
 
+                    recv.wait()
+
                 for host in hosts_descr.host_list:
                     host_name = host['name']
                     host_type = host['type']
@@ -230,18 +304,20 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
                     if interm_migr_list:
                         for interm_migr in interm_migr_list:
                             for i, sql in enumerate(
-                                        upgrade_sql.read_upgrade_sql(
-                                            source_code_cluster_descr,
-                                            host_type,
-                                            interm_migr,
+                                        rend.render_sql(
+                                            ('upgrade_sql', source_code_cluster_descr, host_type, tuple(interm_migr)),
+                                            upgrade_sql.read_upgrade_sql(
+                                                source_code_cluster_descr,
+                                                host_type,
+                                                interm_migr,
+                                            ),
+                                            None, None,
                                         ),
                                     ):
                                 if not i:
                                     verb.execute_sql(
                                             host_name, 'upgrade_sql', recv.look_fragment_i(host_name))
 
-                                sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                                 verb.execute_sql(
                                         host_name, 'upgrade_sql', recv.look_fragment_i(host_name),
                                         sql=sql)
@@ -250,25 +326,27 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
                             for settings_cluster_descr in settings_cluster_descr_list:
                                 for i, sql in enumerate(
-                                            upgrade_sql.read_upgrade_sql(
-                                                settings_cluster_descr,
-                                                host_type,
-                                                interm_migr,
+                                            rend.render_sql(
+                                                ('settings_upgrade_sql', settings_cluster_descr, host_type, tuple(interm_migr)),
+                                                upgrade_sql.read_upgrade_sql(
+                                                    settings_cluster_descr,
+                                                    host_type,
+                                                    interm_migr,
+                                                ),
+                                                None, None,
                                             ),
                                         ):
                                     if not i:
                                         verb.execute_sql(
                                                 host_name, 'settings_upgrade_sql', recv.look_fragment_i(host_name))
 
-                                    sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                                     verb.execute_sql(
                                             host_name, 'settings_upgrade_sql', recv.look_fragment_i(host_name),
                                             sql=sql)
 
                                     recv.execute(host_name, sql)
 
-                            recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+                            recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
                             verb.push_var_revision(
                                     host_name, interm_migr[0], None, recv.look_fragment_i(host_name))
@@ -286,18 +364,20 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
                         final_migr = final_migr_list[0]
 
                         for i, sql in enumerate(
-                                    upgrade_sql.read_upgrade_sql(
-                                        source_code_cluster_descr,
-                                        host_type,
-                                        final_migr,
+                                    rend.render_sql(
+                                        ('upgrade_sql', source_code_cluster_descr, host_type, tuple(final_migr)),
+                                        upgrade_sql.read_upgrade_sql(
+                                            source_code_cluster_descr,
+                                            host_type,
+                                            final_migr,
+                                        ),
+                                        None, None,
                                     ),
                                 ):
                             if not i:
                                 verb.execute_sql(
                                         host_name, 'upgrade_sql', recv.look_fragment_i(host_name))
 
-                            sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                             verb.execute_sql(
                                     host_name, 'upgrade_sql', recv.look_fragment_i(host_name),
                                     sql=sql)
@@ -306,31 +386,35 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
                         for settings_cluster_descr in settings_cluster_descr_list:
                             for i, sql in enumerate(
-                                        upgrade_sql.read_upgrade_sql(
-                                            settings_cluster_descr,
-                                            host_type,
-                                            final_migr,
+                                        rend.render_sql(
+                                            ('settings_upgrade_sql', settings_cluster_descr, host_type, tuple(final_migr)),
+                                            upgrade_sql.read_upgrade_sql(
+                                                settings_cluster_descr,
+                                                host_type,
+                                                final_migr,
+                                            ),
+                                            None, None,
                                         ),
                                     ):
                                 if not i:
                                     verb.execute_sql(
                                             host_name, 'settings_upgrade_sql', recv.look_fragment_i(host_name))
 
-                                sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                                 verb.execute_sql(
                                         host_name, 'settings_upgrade_sql', recv.look_fragment_i(host_name),
                                         sql=sql)
 
                                 recv.execute(host_name, sql)
 
+                recv.wait()
+
                 for host in hosts_descr.host_list:
                     host_name = host['name']
                     host_type = host['type']
 
                     for schema_name, owner, grant_list, sql_iter in \
                             install_sql.read_func_install_sql(source_code_cluster_descr, host_type):
-                        recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+                        recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
 
                         verb.create_schema(host_name, schema_name, recv.look_fragment_i(host_name))
 
@@ -339,38 +423,48 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
                             install_sql.create_schema(schema_name, owner, grant_list),
                         )
 
-                        for i, sql in enumerate(sql_iter):
+                        for i, sql in enumerate(
+                                    rend.render_sql(
+                                        ('func_install_sql', source_code_cluster_descr, host_type, schema_name),
+                                        sql_iter,
+                                        owner, schema_name,
+                                    ),
+                                ):
                             if not i:
                                 verb.execute_sql(
                                         host_name, 'func_install_sql', recv.look_fragment_i(host_name))
 
-                            sql = pg_role_path.apply_pg_role_path(sql, owner, schema_name)
-
                             verb.execute_sql(
                                     host_name, 'func_install_sql', recv.look_fragment_i(host_name),
                                     sql=sql)
 
                             recv.execute(host_name, sql)
 
+                recv.wait()
+
             for host in hosts_descr.host_list:
                 host_name = host['name']
                 host_type = host['type']
 
                 for i, sql in enumerate(
-                            safeguard_sql.read_safeguard_sql(source_code_cluster_descr, host_type),
+                            rend.render_sql(
+                                ('safeguard_sql', source_code_cluster_descr, host_type),
+                                safeguard_sql.read_safeguard_sql(source_code_cluster_descr, host_type),
+                                None, None,
+                            ),
                         ):
                     if not i:
                         verb.execute_sql(
                                 host_name, 'safeguard_sql', recv.look_fragment_i(host_name))
 
-                    sql = pg_role_path.apply_pg_role_path(sql, None, None)
-
                     verb.execute_sql(
                             host_name, 'safeguard_sql', recv.look_fragment_i(host_name),
                             sql=sql)
 
                     recv.execute(host_name, sql)
 
+            recv.wait()
+
             for host in hosts_descr.host_list:
                 host_name = host['name']
                 host_type = host['type']
@@ -378,28 +472,25 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
                 var_schemas = install.var_schemas(source_code_cluster_descr, host_type)
                 func_schemas = install.func_schemas(source_code_cluster_descr, host_type)
 
-                recv.execute(host_name, pg_role_path.pg_role_path(None, None))
+                recv.execute(host_name, pg_role_path.pg_role_path_fragment(None, None))
+
+                schema_acl_list = []
 
                 for schema_name, owner, grant_list, sql_iter in \
                         install_sql.read_var_install_sql(source_code_cluster_descr, host_type):
-                    verb.guard_acls(host_name, schema_name,
-                            args_ctx.weak_guard_acls, recv.look_fragment_i(host_name))
-
-                    recv.execute(
-                        host_name,
-                        install_sql.guard_acls(schema_name, owner, grant_list,
-                                args_ctx.weak_guard_acls),
-                    )
+                    schema_acl_list.append((schema_name, owner, grant_list))
 
                 for schema_name, owner, grant_list, sql_iter in \
                         install_sql.read_func_install_sql(source_code_cluster_descr, host_type):
-                    verb.guard_acls(host_name, schema_name,
+                    schema_acl_list.append((schema_name, owner, grant_list))
+
+                if schema_acl_list:
+                    verb.guard_acls(host_name, [x[0] for x in schema_acl_list],
                             args_ctx.weak_guard_acls, recv.look_fragment_i(host_name))
 
                     recv.execute(
                         host_name,
-                        install_sql.guard_acls(schema_name, owner, grant_list,
-                                args_ctx.weak_guard_acls),
+                        install_sql.guard_acls(schema_acl_list, args_ctx.weak_guard_acls),
                     )
 
                 verb.push_var_revision(
@@ -424,4 +515,6 @@ def upgrade_cmd(args_ctx, print_func, err_print_func):
 
         recv.finish(hosts_descr, finish_host_verb_func=verb.finish_host)
 
+        verb.render_cache(rend.hit_cnt, rend.miss_cnt)
+
 # vi:ts=4:sw=4:et
@@ -3,20 +3,7 @@ def read_upgrade_sql(cluster_descr, host_type, migr):
     migration_descr = None
 
     if migrations_descr is not None:
-        for other_migration_descr in migrations_descr.migration_list:
-            if other_migration_descr.revision != migr[0] or \
-                    migr[1] not in other_migration_descr.compatible_list:
-                continue
-
-            if migration_descr is not None:
-                raise ValueError(
-                    '{!r}, {!r}: non unique migration'.format(
-                        cluster_descr.cluster_file_path,
-                        migr,
-                    ),
-                )
-
-            migration_descr = other_migration_descr
+        migration_descr = migrations_descr.migration_way_map.get(tuple(migr))
 
     if migration_descr is None:
         raise ValueError(
@@ -26,10 +13,11 @@ def read_upgrade_sql(cluster_descr, host_type, migr):
             ),
         )
 
-    for upgrade_descr in migration_descr.upgrade_list:
-        if upgrade_descr.upgrade_type != host_type:
-            continue
+    upgrade_descr = migration_descr.upgrade_map.get(host_type)
+
+    if upgrade_descr is None:
+        return
 
-        yield from upgrade_descr.read_sql()
+    yield from upgrade_descr.read_sql()
 
 # vi:ts=4:sw=4:et
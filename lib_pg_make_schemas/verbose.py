@@ -8,6 +8,12 @@ class NonVerbose:
     def prepare_upgrade(self):
         pass
 
+    def prepare_export(self, archive_path, complete):
+        pass
+
+    def descr_cache(self, cache_file_path, hit_cnt, miss_cnt):
+        pass
+
     def source_code_revision(self, application, revision, comment):
         pass
 
@@ -47,7 +53,7 @@ class NonVerbose:
     def create_schema(self, host_name, schema_name, fragment_i):
         pass
 
-    def guard_acls(self, host_name, schema_name, weak, fragment_i):
+    def guard_acls(self, host_name, schema_name_list, weak, fragment_i):
         pass
 
     def execute_sql(self, host_name, script_type, fragment_i, sql=None):
@@ -59,6 +65,12 @@ class NonVerbose:
     def finish_host(self, host_name):
         pass
 
+    def render_cache(self, hit_cnt, miss_cnt):
+        pass
+
+    def export_file(self, name, output_path):
+        pass
+
 class Verbose:
     def __init__(self, print_func, err_print_func, show_execute_sql_details=None):
         if show_execute_sql_details is None:
@@ -83,6 +95,23 @@ class Verbose:
     def prepare_upgrade(self):
         self._print_func('preparing for upgrading...')
 
+    def prepare_export(self, archive_path, complete):
+        self._print_func(
+            'preparing for exporting from archive {!r}{}...'.format(
+                archive_path,
+                '' if complete else ' (without index, scanning)',
+            ),
+        )
+
+    def descr_cache(self, cache_file_path, hit_cnt, miss_cnt):
+        self._print_func(
+            'descriptor cache {!r}: {!r} hits, {!r} misses'.format(
+                cache_file_path,
+                hit_cnt,
+                miss_cnt,
+            ),
+        )
+
     def source_code_revision(self, application, revision, comment):
         self._print_func(
             'application {!r}: source code has revision {!r}{}'.format(
@@ -195,12 +224,12 @@ class Verbose:
             ),
         )
 
-    def guard_acls(self, host_name, schema_name, weak, fragment_i):
+    def guard_acls(self, host_name, schema_name_list, weak, fragment_i):
         self._print_func(
-            '{!r}: {} guarding acls for schema {!r} ({})...'.format(
+            '{!r}: {} guarding acls for schemas {} ({})...'.format(
                 host_name,
                 'weak' if weak else 'strong',
-                schema_name,
+                ', '.join(repr(schema_name) for schema_name in schema_name_list),
                 self._format_frag(fragment_i),
             ),
         )
@@ -284,6 +313,17 @@ class Verbose:
     def finish_host(self, host_name):
         self._print_func('{!r}: finishing...'.format(host_name))
 
+    def render_cache(self, hit_cnt, miss_cnt):
+        self._print_func(
+            'render cache: {!r} hits, {!r} misses'.format(
+                hit_cnt,
+                miss_cnt,
+            ),
+        )
+
+    def export_file(self, name, output_path):
+        self._print_func('{!r}: exporting to {!r}...'.format(name, output_path))
+
 def make_verbose(print_func, err_print_func, verbose):
     if not verbose:
         return NonVerbose()
@@ -0,0 +1,116 @@
+import random
+import pytest
+from lib_pg_make_schemas import upgrade
+from benchmarks import migr_way
+from benchmarks import descr_syscalls
+from benchmarks import open_files
+from benchmarks import doc_parse
+from benchmarks import hosts_scale
+from lib_pg_make_schemas import scr_env
+from lib_pg_make_schemas import descr
+
+@pytest.mark.parametrize('seed', range(20))
+def test_migr_way_random_graph(seed):
+    # the indexed search gives the same ways (and the same ambiguity)
+    # as the old search
+
+    rnd = random.Random(seed)
+    cluster_descr = migr_way.make_random_cluster_descr(30, 45, rnd)
+
+    for i in range(30):
+        var_rev = migr_way.rev_name(i)
+
+        assert migr_way.try_find_migr_way(upgrade.find_migr_way, cluster_descr, var_rev) == \
+                migr_way.try_find_migr_way(migr_way.old_find_migr_way, cluster_descr, var_rev)
+
+def test_migr_way_chain_graph():
+    cluster_descr = migr_way.make_chain_cluster_descr(2001)
+
+    migr_list = upgrade.find_migr_way(cluster_descr, None, migr_way.rev_name(3))
+
+    assert len(migr_list) == 7 + 199
+    assert migr_list[0] == (migr_way.rev_name(4), migr_way.rev_name(3))
+    assert migr_list[-1] == (migr_way.rev_name(2000), migr_way.rev_name(1990))
+    assert migr_way.bench_find_migr_way(
+        upgrade.find_migr_way,
+        cluster_descr,
+        [migr_way.rev_name(i) for i in range(0, 2000, 100)],
+    ) < 5.0
+
+def test_descr_syscalls(tmp_path):
+    # every directory is scanned once, and the entries are never
+    # resolved or checked by ``stat``
+
+    path = str(tmp_path)
+
+    descr_syscalls.make_source_code(path, 50, 3)
+
+    result = descr_syscalls.measure(path)
+
+    assert result['scandir'] == 52
+    assert result['stat'] == 0
+    assert result['lstat'] == 0
+
+    cluster_descr = descr_syscalls.load_cluster_descr(path)
+    schemas_descr = cluster_descr.schemas_map['main']
+
+    assert len(schemas_descr.var_schema_list) + len(schemas_descr.func_schema_list) == 50
+    assert all(len(schema_descr.file_path_list) == 3 for schema_descr in schemas_descr.var_schema_list)
+
+def test_open_files(tmp_path):
+    # every directory is opened once, and every file costs one ``openat``
+    # and one ``readlink`` of its check
+
+    include_list, file_path_list = open_files.make_file_tree(str(tmp_path), 500, 5, 3)
+
+    assert open_files.open_files(include_list, file_path_list) == \
+            sum(len('select {};\n'.format(i)) for i in range(500))
+
+    result = open_files.measure(include_list, file_path_list)
+
+    assert result['open'] == 500 + 5 + 1
+    assert result['stat'] == 0
+
+    if descr.LoadUtils._proc_fd_supported:
+        assert result['readlink'] == 500
+
+def test_doc_parse(tmp_path):
+    # every backend gives the same documents
+
+    result_map = doc_parse.measure_all(str(tmp_path), 30)
+    doc_list, _ = result_map['yaml']
+
+    assert len(doc_list) == 30
+    assert doc_list[3]['schema']['name'] == 'schema_3'
+
+    for name, (other_doc_list, _) in result_map.items():
+        assert other_doc_list == doc_list, name
+
+    assert len(list((tmp_path / 'compiled').glob('*/*.json'))) == 30
+
+def test_hosts_scale(tmp_path):
+    hosts_file_path = str(tmp_path / 'hosts.yaml')
+
+    hosts_scale.make_hosts_file(hosts_file_path, 300, 20)
+
+    hosts_descr = descr.HostsDescr()
+
+    hosts_descr.load(hosts_file_path)
+
+    assert len(hosts_descr.host_map) == 300
+
+    host_scr_env = scr_env.scr_env(hosts_descr, 'host_17')
+
+    assert '\'type_7\'' in host_scr_env
+    assert '"shard": 17' in host_scr_env
+    assert '"key_19"' in host_scr_env
+    assert '\'type_7\'' not in scr_env.scr_env(hosts_descr, 'other_host')
+
+    _, size = hosts_scale.render_scr_env(hosts_file_path)
+
+    assert size == sum(
+        len(scr_env.scr_env(hosts_descr, 'host_{}'.format(i)))
+        for i in range(300)
+    )
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,63 @@
+import os, os.path
+import pytest
+from lib_pg_make_schemas import descr
+
+def write_file(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    with open(file_path, 'w', encoding='utf-8') as fd:
+        fd.write(content)
+
+def read_file(load_utils, file_path, include_list):
+    with load_utils.check_and_open_for_r(file_path, include_list) as fd:
+        return fd.read()
+
+@pytest.fixture
+def load_utils():
+    load_utils = descr.LoadUtils()
+
+    try:
+        yield load_utils
+    finally:
+        load_utils.close()
+
+def test_moved_dir(tmp_path, load_utils):
+    # a directory moved out of the include directory is not read through
+    # its kept descriptor
+
+    include = str(tmp_path / 'include')
+    file_path = os.path.join(include, 'a', 'x.sql')
+
+    write_file(file_path, 'select 1;\n')
+
+    assert read_file(load_utils, file_path, [include]) == 'select 1;\n'
+
+    os.rename(os.path.join(include, 'a'), str(tmp_path / 'a'))
+
+    with pytest.raises(FileNotFoundError):
+        read_file(load_utils, file_path, [include])
+
+    write_file(file_path, 'select 2;\n')
+
+    assert read_file(load_utils, file_path, [include]) == 'select 2;\n'
+
+def test_symlink_dir(tmp_path, load_utils):
+    include = str(tmp_path / 'include')
+    file_path = os.path.join(include, 'a', 'x.sql')
+
+    write_file(str(tmp_path / 'a' / 'x.sql'), 'select 1;\n')
+    os.makedirs(include)
+    os.symlink(str(tmp_path / 'a'), os.path.join(include, 'a'))
+
+    with pytest.raises(OSError):
+        read_file(load_utils, file_path, [include])
+
+def test_not_included(tmp_path, load_utils):
+    file_path = str(tmp_path / 'other' / 'x.sql')
+
+    write_file(file_path, 'select 1;\n')
+
+    with pytest.raises(ValueError):
+        read_file(load_utils, file_path, [str(tmp_path / 'include')])
+
+# vi:ts=4:sw=4:et
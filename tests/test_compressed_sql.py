@@ -0,0 +1,54 @@
+import pytest
+from lib_pg_make_schemas import descr
+
+zstandard = pytest.importorskip('zstandard')
+
+def write_zst(tmp_path, frame_list, cut_size=None):
+    data = b''.join(zstandard.ZstdCompressor().compress(frame) for frame in frame_list)
+
+    if cut_size is not None:
+        data = data[:-cut_size]
+
+    file_path = str(tmp_path / 'x.sql.zst')
+
+    with open(file_path, 'wb') as fd:
+        fd.write(data)
+
+    return file_path
+
+def read_sql(file_path, include_list, size):
+    load_utils = descr.LoadUtils()
+
+    try:
+        with load_utils.open_sql_for_r(file_path, include_list) as fd:
+            piece_list = []
+
+            while True:
+                piece = fd.read(size)
+
+                if not piece:
+                    break
+
+                piece_list.append(piece)
+
+                if size < 0:
+                    break
+
+            return b''.join(piece_list)
+    finally:
+        load_utils.close()
+
+@pytest.mark.parametrize('size', [-1, 1, 5, 64 * 1024])
+def test_zst_two_frames(tmp_path, size):
+    file_path = write_zst(tmp_path, [b'select 1;\n', b'select 2;\n'])
+
+    assert read_sql(file_path, [str(tmp_path)], size) == b'select 1;\nselect 2;\n'
+
+@pytest.mark.parametrize('size', [-1, 5])
+def test_zst_truncated(tmp_path, size):
+    file_path = write_zst(tmp_path, [b'select 1;\n', b'select 2;\n'], cut_size=4)
+
+    with pytest.raises(ValueError, match='unexpected end of zstd frame'):
+        read_sql(file_path, [str(tmp_path)], size)
+
+# vi:ts=4:sw=4:et
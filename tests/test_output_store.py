@@ -0,0 +1,57 @@
+import hashlib
+import os, os.path
+from lib_pg_make_schemas import output_store
+
+def read_output(output_path):
+    # the written sql, by the objects which the output file includes
+
+    data_list = []
+
+    with open(output_path, encoding='utf-8') as fd:
+        for line in fd:
+            object_path = os.path.join(
+                os.path.dirname(output_path),
+                line.rstrip('\n')[len('\\ir \''):-len('\'')],
+            )
+
+            with open(object_path, 'rb') as object_fd:
+                data = object_fd.read()
+
+            assert os.path.basename(object_path) == '{}.sql'.format(hashlib.sha256(data).hexdigest())
+
+            data_list.append(data)
+
+    return b''.join(data_list)
+
+def test_spill_of_several_hosts(tmp_path):
+    # the objects of both hosts are spilled at the same time on the same thread
+
+    store = output_store.ContentStore(str(tmp_path / 'out.objects'))
+    store.spill_size = 64
+    writer_list = [
+        output_store.ManifestWriter(str(tmp_path / 'out.{}.sql'.format(host_i)), store)
+        for host_i in range(2)
+    ]
+    data_list_list = [[], []]
+
+    for writer in writer_list:
+        writer.cut_modulus = 2 ** 33
+
+    for i in range(100):
+        for host_i, writer in enumerate(writer_list):
+            data = 'select {}, {};\n'.format(host_i, i).encode('utf-8')
+
+            writer.write(data)
+            writer.flush()
+            data_list_list[host_i].append(data)
+
+    for writer in writer_list:
+        writer.close()
+
+    for host_i in range(2):
+        assert read_output(str(tmp_path / 'out.{}.sql'.format(host_i))) == \
+                b''.join(data_list_list[host_i])
+
+    assert not [name for name in os.listdir(store.store_path) if name.endswith('.tmp')]
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,22 @@
+import pytest
+from lib_pg_make_schemas import output_writer
+
+@pytest.mark.parametrize('buffer_size', [0, -1])
+def test_bad_buffer_size(tmp_path, buffer_size):
+    output_path = str(tmp_path / 'out.sql')
+
+    with pytest.raises(ValueError):
+        output_writer.OutputWriter(output_path, buffer_size=buffer_size)
+
+@pytest.mark.parametrize('buffer_size', [1, 3, 1024])
+def test_write(tmp_path, buffer_size):
+    output_path = str(tmp_path / 'out.sql')
+
+    with output_writer.OutputWriter(output_path, buffer_size=buffer_size) as fd:
+        for i in range(100):
+            fd.write('select {};\n'.format(i))
+
+    with open(output_path, encoding='utf-8') as fd:
+        assert fd.read() == ''.join('select {};\n'.format(i) for i in range(100))
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,67 @@
+import types
+import pytest
+from lib_pg_make_schemas import pg_role_path
+
+receivers = pytest.importorskip('lib_pg_make_schemas.receivers')
+
+def make_fragment_list():
+    return [
+        pg_role_path.pg_role_path_fragment(None, None),
+        'create schema s;',
+        pg_role_path.apply_pg_role_path('select 1;', 'owner', 's'),
+        pg_role_path.apply_pg_role_path('select 2;', 'owner', 's'),
+        pg_role_path.apply_pg_role_path(b'select 3;', 'owner', 's'),
+        pg_role_path.pg_role_path_fragment(None, None),
+        pg_role_path.pg_role_path_fragment(None, None),
+        'select 4;',
+        pg_role_path.pg_role_path_fragment(None, None),
+    ]
+
+def write_output(tmp_path, lazy_role_path):
+    output = str(tmp_path / 'out')
+    host = {'name': 'host', 'type': 'type', 'conninfo': None, 'params': None}
+    hosts_descr = types.SimpleNamespace(host_list=[host], hosts_file_path='<hosts>')
+    recv = receivers.Receivers(False, False, output, lazy_role_path=lazy_role_path)
+
+    try:
+        recv.begin(hosts_descr)
+
+        for fragment in make_fragment_list():
+            recv.execute('host', fragment)
+
+        recv.finish(hosts_descr)
+    finally:
+        recv.close()
+
+    with open('{}.host.type.sql'.format(output), encoding='utf-8') as fd:
+        return fd.read()
+
+def test_role_path(tmp_path):
+    output_sql = write_output(tmp_path, False)
+
+    assert output_sql.count('set local role to') == 7
+    assert output_sql.count('set local search_path to') == 7
+    assert output_sql.count('set local check_function_bodies to off;') == 7
+    assert 'fragment 9: ok' in output_sql
+
+def test_lazy_role_path(tmp_path):
+    # the role path is set again only when it changes, or after
+    # a fragment which might have changed it
+
+    output_sql = write_output(tmp_path, True)
+
+    assert output_sql.count('set local role to') == 4
+    assert output_sql.count('set local search_path to') == 4
+    assert output_sql.count('set local check_function_bodies to off;') == 4
+    assert 'fragment 8: ok' in output_sql
+    assert 'fragment 9: ok' not in output_sql
+
+    for sql in ('create schema s;', 'select 1;', 'select 2;', 'select 3;', 'select 4;'):
+        assert sql in output_sql
+
+    # the first statement of every schema file goes after its role path
+
+    assert output_sql.index('set local role to "owner";') < output_sql.index('select 1;')
+    assert output_sql.index('select 4;') < output_sql.rindex('set local role to postgres;')
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,38 @@
+from lib_pg_make_schemas import render_cache
+
+def make_value_list(key):
+    return [('select {};'.format(key), {})]
+
+def test_render():
+    rend = render_cache.RenderCache(max_size=20)
+
+    for key in ('a', 'b', 'c', 'a'):
+        assert list(rend.render(key, iter(make_value_list(key)))) == make_value_list(key)
+
+    # two values of 9 are kept, ``a`` was dropped before it came again
+
+    assert rend.hit_cnt == 0
+    assert rend.miss_cnt == 4
+    assert rend.size == 18
+
+    assert list(rend.render('c', iter([]))) == make_value_list('c')
+    assert rend.hit_cnt == 1
+
+def test_render_negative_max_size():
+    # nothing is kept, and nothing fails
+
+    rend = render_cache.RenderCache(max_size=-1)
+
+    for key in ('a', 'a'):
+        assert list(rend.render(key, iter(make_value_list(key)))) == make_value_list(key)
+
+    assert rend.hit_cnt == 0
+    assert rend.size == 0
+
+def test_render_empty():
+    rend = render_cache.RenderCache(max_size=-1)
+
+    assert list(rend.render('a', iter([]))) == []
+    assert list(rend.render('a', iter([]))) == []
+
+# vi:ts=4:sw=4:et
@@ -0,0 +1,111 @@
+import io
+import tracemalloc
+import pytest
+from lib_pg_make_schemas import sql_stream
+from lib_pg_make_schemas import pg_role_path
+from lib_pg_make_schemas import descr
+
+def split_sql(sql, read_size):
+    fd = io.BytesIO(sql)
+
+    return list(sql_stream.iter_sql_piece(fd.read, 1, read_size=read_size))
+
+@pytest.mark.parametrize('read_size', [3, 7, 1024])
+@pytest.mark.parametrize('sql, piece_list', [
+    (
+        b'select 1; select \';\'; select ";"; select $x$;$x$;',
+        [b'select 1;', b' select \';\';', b' select ";";', b' select $x$;$x$;'],
+    ),
+    (
+        b'select 1 -- ;\n; /* ; /* ; */ ; */ select E\'\\\';\';',
+        [b'select 1 -- ;\n;', b' /* ; /* ; */ ; */ select E\'\\\';\';'],
+    ),
+    (
+        b'create function f() returns int language sql '
+        b'begin atomic select 1; select case when true then 2 end; end; select 3;',
+        [
+            b'create function f() returns int language sql '
+            b'begin atomic select 1; select case when true then 2 end; end;',
+            b' select 3;',
+        ],
+    ),
+    (
+        b'CREATE OR REPLACE PROCEDURE p(a int default (1)) BEGIN ATOMIC select a; END; select 4;',
+        [b'CREATE OR REPLACE PROCEDURE p(a int default (1)) BEGIN ATOMIC select a; END;', b' select 4;'],
+    ),
+    (
+        b'begin; select 5; end; select a$b; create table t (c int);',
+        [b'begin;', b' select 5;', b' end;', b' select a$b;', b' create table t (c int);'],
+    ),
+])
+def test_iter_sql_piece(sql, piece_list, read_size):
+    assert split_sql(sql, read_size) == piece_list
+
+def test_iter_sql_piece_memory():
+    # a large sql goes through by pieces, so the memory does not
+    # depend on its size
+
+    statement = b'insert into t (a, b) values (1, \'text; text\');\n'
+    sql_size = 4 * 1024 * 1024
+    piece_size = 256 * 1024
+    read_size = 64 * 1024
+    chunk = statement * (read_size // len(statement))
+    left_size_list = [sql_size]
+
+    def read_func(size):
+        if left_size_list[0] <= 0:
+            return b''
+
+        left_size_list[0] -= len(chunk)
+
+        return chunk
+
+    tracemalloc.start()
+
+    try:
+        total_size = 0
+
+        for piece in sql_stream.iter_sql_piece(read_func, piece_size, read_size=read_size):
+            assert piece.rstrip().endswith(b';')
+
+            total_size += len(piece)
+
+        _, peak_size = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert total_size >= sql_size
+    assert peak_size < 4 * (piece_size + read_size)
+
+@pytest.mark.parametrize('sql', [
+    b'select 1;\n\x1c\xc2\xa0\n',
+    b'select 1;\nselect 2;\n\xc2\x85 \xe2\x80\x83\n',
+    b'select 1;\n\xc2\xa0\xe3\x80\x80',
+    b'select 1;\nselect \'\xc2\xa0\';',
+    b'select 1;  \n\n',
+    b'\xc2\xa0\n',
+    b'',
+])
+def test_sql_stream_suffix(tmp_path, sql):
+    # the streamed file ends the same way as the file which is read as a whole
+
+    file_path = str(tmp_path / 'x.sql')
+
+    with open(file_path, 'wb') as fd:
+        fd.write(sql)
+
+    load_utils = descr.LoadUtils()
+
+    try:
+        stream = sql_stream.SqlStream(load_utils, file_path, [str(tmp_path)])
+        stream.piece_size = 1
+        stream_sql = b''.join(stream.with_suffix(b'\n\n;'))
+    finally:
+        load_utils.close()
+
+    sql_str_list, _ = pg_role_path.apply_pg_role_path(sql, None, None)
+
+    assert stream_sql == bytes(sql_str_list[-1])
+    assert stream_sql == sql.decode('utf-8').rstrip().encode('utf-8') + b'\n\n;'
+
+# vi:ts=4:sw=4:et